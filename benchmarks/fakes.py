@@ -0,0 +1,258 @@
+# --- DOBLES LOCALES DE FIRESTORE Y GEMINI PARA LOS BENCHMARKS ---
+# Firestore en memoria con la parte del API que usan medflash/storage.py y la cola
+# write-behind (documentos, subcolecciones, batches con create/set/merge/update/delete,
+# centinelas), con latencia configurable por RPC y contadores de operaciones. El modelo
+# devuelve mazos JSON enlatados y variados (no los descarta el filtro de casi-duplicados).
+# install() los registra en sys.modules antes de que la app importe nada.
+import copy
+import json
+import random
+import sys
+import threading
+import time
+import types
+from collections import Counter
+
+
+SERVER_TIMESTAMP = object()
+DELETE_FIELD = object()
+
+
+class Increment:
+    def __init__(self, n): self.n = n
+
+
+class AlreadyExists(Exception):
+    code = 409
+
+
+class NotFound(Exception):
+    code = 404
+
+
+def _resolve(value, old=None):
+    if value is SERVER_TIMESTAMP: return time.time()
+    if isinstance(value, Increment): return (old if isinstance(old, (int, float)) else 0) + value.n
+    if isinstance(value, dict): return {k: _resolve(v) for k, v in value.items() if v is not DELETE_FIELD}
+    if isinstance(value, list): return [_resolve(v) for v in value]
+    return value
+
+
+def _merge(base, extra):
+    out = dict(base)
+    for k, v in extra.items():
+        if v is DELETE_FIELD: out.pop(k, None)
+        elif isinstance(v, dict) and isinstance(out.get(k), dict): out[k] = _merge(out[k], v)
+        else: out[k] = _resolve(v, out.get(k))
+    return out
+
+
+class Snapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class DocumentRef:
+    def __init__(self, db, path):
+        self._db, self.path = db, tuple(path)
+        self.id = path[-1]
+
+    def collection(self, name): return CollectionRef(self._db, self.path + (name,))
+
+    def get(self, field_paths=None, **kwargs):
+        self._db.rpc("get")
+        with self._db.lock:
+            data = self._db.docs.get(self.path)
+            self._db.ops["reads"] += 1
+            if data is not None and field_paths is not None:
+                data = {k: v for k, v in data.items() if k in field_paths}
+            return Snapshot(self.id, copy.deepcopy(data))
+
+    def set(self, data, merge=False):
+        batch = self._db.batch()
+        batch.set(self, data, merge=merge)
+        batch.commit()
+
+    def create(self, data):
+        batch = self._db.batch()
+        batch.create(self, data)
+        batch.commit()
+
+
+class CollectionRef:
+    def __init__(self, db, path):
+        self._db, self.path = db, tuple(path)
+
+    def document(self, doc_id): return DocumentRef(self._db, self.path + (doc_id,))
+
+    def list_documents(self):
+        self._db.rpc("list")
+        n = len(self.path) + 1
+        with self._db.lock: ids = sorted({p[n - 1] for p in self._db.docs if len(p) >= n and p[:n - 1] == self.path})
+        return [self.document(i) for i in ids]
+
+    def stream(self):
+        self._db.rpc("stream")
+        n = len(self.path) + 1
+        with self._db.lock:
+            found = [(p[-1], copy.deepcopy(d)) for p, d in self._db.docs.items() if len(p) == n and p[:-1] == self.path]
+            self._db.ops["reads"] += len(found)
+        return iter([Snapshot(doc_id, d) for doc_id, d in sorted(found)])
+
+
+class WriteBatch:
+    def __init__(self, db):
+        self._db, self._ops = db, []
+
+    def set(self, ref, data, merge=False): self._ops.append(("set", ref.path, data, merge))
+    def create(self, ref, data): self._ops.append(("create", ref.path, data, False))
+    def update(self, ref, data): self._ops.append(("update", ref.path, data, True))
+    def delete(self, ref): self._ops.append(("delete", ref.path, None, False))
+
+    def commit(self):
+        self._db.rpc("commit")
+        with self._db.lock:
+            docs = self._db.docs
+            for kind, path, data, _ in self._ops:  # atómico: se valida todo antes de aplicar nada
+                if kind == "create" and path in docs: raise AlreadyExists(f"/{'/'.join(path)}")
+                if kind == "update" and path not in docs: raise NotFound(f"/{'/'.join(path)}")
+            for kind, path, data, merge in self._ops:
+                if kind == "delete": docs.pop(path, None)
+                elif merge: docs[path] = _merge(docs.get(path, {}), data)
+                else: docs[path] = _resolve(data)
+            self._db.ops["writes"] += len(self._ops)
+            self._db.ops["batches"] += 1
+
+
+class InMemoryFirestore:
+    """
+    Cliente de Firestore en memoria. Cada RPC (get, stream, commit) espera `latency` s
+    (± `jitter`); `ops` cuenta RPCs por tipo, documentos leídos, escrituras y batches.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=None):
+        self.latency, self.jitter = latency, jitter
+        self.docs = {}  # ruta (col, doc, col, doc...) -> dict
+        self.ops = Counter()
+        self.lock = threading.Lock()
+        self._rng = random.Random(seed)
+
+    def rpc(self, kind):
+        with self.lock:
+            self.ops[f"rpc_{kind}"] += 1
+            delay = self.latency + (self._rng.uniform(-self.jitter, self.jitter) if self.jitter else 0.0)
+        if delay > 0: time.sleep(delay)
+
+    def collection(self, name): return CollectionRef(self, (name,))
+    def batch(self): return WriteBatch(self)
+
+    def seed(self, path, data):
+        with self.lock: self.docs[tuple(path)] = _resolve(data)
+
+    def counters(self):
+        with self.lock: return dict(self.ops)
+
+
+# --- Modelos enlatados ---
+class FakeModel:
+    """
+    Modelo local para pruebas y benchmarks: devuelve un mazo JSON de `n` preguntas tras
+    `latency` segundos, y falla con un 429 simulado con probabilidad `fail_rate`.
+    """
+
+    class _Chunk:
+        def __init__(self, text): self.text = text
+
+    class RateLimited(Exception):
+        code = 429
+
+    def __init__(self, n=5, latency=0.0, fail_rate=0.0, chunk_chars=80, seed=None):
+        self.n, self.latency, self.fail_rate, self.chunk_chars = n, latency, fail_rate, chunk_chars
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def deck_json(self, prompt):
+        tag = abs(hash(json.dumps(prompt, default=str))) % 100000
+        return json.dumps([{
+            "pregunta": f"Paciente de {20 + i} años (caso {tag}-{i}). ¿Cuál es el diagnóstico más probable?",
+            "opciones": {"A": "Opción A", "B": "Opción B", "C": "Opción C", "D": "Opción D"},
+            "respuesta_correcta": "ABCD"[i % 4],
+            "explicacion": f"| Opción | Motivo |\n|---|---|\n| {'ABCD'[i % 4]} | Correcta en el caso {i}. |",
+        } for i in range(self.n)], ensure_ascii=False)
+
+    def generate_content(self, prompt, stream=False, **params):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.fail_rate
+        if self.latency: time.sleep(self.latency)
+        if fail: raise FakeModel.RateLimited("429 Resource has been exhausted (simulado)")
+        text = "```json\n" + self.deck_json(prompt) + "\n```"
+        if not stream: return FakeModel._Chunk(text)
+        return [FakeModel._Chunk(text[i:i + self.chunk_chars]) for i in range(0, len(text), self.chunk_chars)]
+
+
+_TERMS = ("disnea", "fiebre", "tos", "hemoptisis", "dolor torácico", "síncope", "ictericia", "ascitis",
+          "edema", "poliuria", "cefalea", "diplopía", "hematuria", "melena", "astenia", "artralgias",
+          "exantema", "adenopatías", "soplo", "crepitantes", "hipotensión", "taquicardia", "bradicardia",
+          "hepatomegalia", "esplenomegalia", "proteinuria", "hiponatremia", "hiperpotasemia", "anemia",
+          "leucocitosis", "trombopenia", "convulsiones", "parestesias", "disfagia", "vómitos", "diarrea")
+_DIAGNOSES = ("neumonía", "tromboembolismo pulmonar", "insuficiencia cardiaca", "estenosis aórtica",
+              "cirrosis", "pancreatitis", "diabetes insípida", "síndrome nefrótico", "lupus",
+              "endocarditis", "hipotiroidismo", "feocromocitoma", "meningitis", "sarcoidosis",
+              "mieloma múltiple", "enfermedad celíaca", "glomerulonefritis", "Addison")
+
+
+class CannedModel(FakeModel):
+    """FakeModel con mazos distintos por prompt: cada caso mezcla hallazgos al azar (semilla = prompt)."""
+
+    def deck_json(self, prompt):
+        rng = random.Random(json.dumps(prompt, default=str))
+        deck = []
+        for i in range(self.n):
+            dx = rng.sample(_DIAGNOSES, 4)
+            hallazgos = ", ".join(rng.sample(_TERMS, 5))
+            deck.append({
+                "pregunta": f"Paciente de {rng.randint(18, 90)} años con {hallazgos}. ¿Diagnóstico más probable?",
+                "opciones": dict(zip("ABCD", dx)),
+                "respuesta_correcta": "ABCD"[i % 4],
+                "explicacion": f"| Opción | Motivo |\n|---|---|\n| {'ABCD'[i % 4]} | {dx[i % 4]} explica {hallazgos}. |",
+            })
+        return json.dumps(deck, ensure_ascii=False)
+
+
+def install(db, model_factory):
+    """
+    Registra firebase_admin(.credentials/.firestore) y google.generativeai falsos en sys.modules.
+    `db` es el InMemoryFirestore que devolverá firestore.client(); `model_factory(model_name)`
+    crea el modelo de GenerativeModel.
+    """
+    fa = types.ModuleType("firebase_admin")
+    fa._apps = {}
+    fa.initialize_app = lambda cred=None, *a, **kw: fa._apps.setdefault("[DEFAULT]", cred)
+    cred = types.ModuleType("firebase_admin.credentials")
+    cred.Certificate = lambda info: ("certificado", info)
+    fs = types.ModuleType("firebase_admin.firestore")
+    fs.client = lambda *a, **kw: db
+    fs.SERVER_TIMESTAMP, fs.DELETE_FIELD, fs.Increment = SERVER_TIMESTAMP, DELETE_FIELD, Increment
+    fa.credentials, fa.firestore = cred, fs
+
+    try: import google  # paquete de espacio de nombres (protobuf, api_core...): se conserva
+    except ImportError:
+        google = types.ModuleType("google")
+        google.__path__ = []
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kw: None
+    genai.GenerativeModel = lambda model_name=None, **kw: model_factory(model_name)
+    google.generativeai = genai
+
+    sys.modules.update({"firebase_admin": fa, "firebase_admin.credentials": cred, "firebase_admin.firestore": fs,
+                        "google": google, "google.generativeai": genai})
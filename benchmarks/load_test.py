@@ -0,0 +1,358 @@
+# --- PRUEBA DE CARGA REPRODUCIBLE (AppTest + FIRESTORE Y GEMINI LOCALES) ---
+# Lanza N sesiones de main_medflash.py con streamlit.testing.v1.AppTest, cada una en su hilo,
+# y recorre login -> subida -> generación -> estudio contra un Firestore en memoria con
+# latencia configurable y un modelo enlatado (ver benchmarks/fakes.py). Mide la latencia de
+# cada rerun por paso (p50/p90/p95/p99), lecturas/escrituras de Firestore por interacción
+# (de las trazas de medflash/tracing.py) y memoria por sesión, y lo guarda en JSON.
+#
+#   python -m benchmarks.load_test --sesiones 8 --latencia-firestore-ms 40 --latencia-llm-ms 800
+#   python -m benchmarks.load_test --comparar benchmarks/results/<anterior>.json
+#
+# Límites de AppTest que se sortean aquí (ver apptest_compat):
+# - no rellena st.file_uploader: la "subida" elige materia/sistema en la página 1 y deja el
+#   texto del documento en la caché de documentos, como haría "Procesar Archivo";
+# - un clic dentro de un @st.fragment re-ejecuta el script entero, así que responder/siguiente
+#   se miden como reruns completos (cota superior de lo que ve el navegador).
+import argparse
+import json
+import os
+import pickle
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(ROOT, "main_medflash.py")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+PASSWORD = "bench-clave"
+MATERIA = "Cardiología"
+PERCENTILES = (50, 90, 95, 99)
+SECRETS = {"FIREBASE_SERVICE_ACCOUNT": "{}", "GOOGLE_API_KEY": "bench"}  # los dobles no miran el valor
+
+
+def percentile(sorted_values, p):
+    if not sorted_values: return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as fh: return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # pico, no actual (macOS: bytes)
+
+
+def state_bytes(at):
+    """Tamaño serializado de lo que guarda la sesión (lo que no se puede serializar no cuenta)."""
+    total = 0
+    for key in list(at.session_state):
+        try: total += len(pickle.dumps(at.session_state[key], protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception: continue
+    return total
+
+
+def apptest_compat(secrets):
+    """
+    AppTest está pensado para una sesión por proceso: en cada run cambia st.secrets,
+    Runtime._instance y la opción global.appTest y los restaura al acabar, lo que deja a las
+    demás sesiones sin secretos o sin runtime a mitad de rerun. Se fijan los secretos, la
+    opción y el último runtime visto; st.rerun(scope="fragment") fuera de un rerun de
+    fragmento (lo que hace AppTest) pasa a ser un rerun completo. Además compila el script en
+    cada run (y ast.parse no es seguro entre hilos en CPython 3.11): el bytecode se comparte,
+    como en el servidor, que tiene una sola ScriptCache.
+    """
+    import streamlit as st
+    from streamlit import config
+    from streamlit.errors import StreamlitInvalidLayoutContextError
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.runtime.secrets import Secrets
+
+    st.secrets = Secrets()
+    st.secrets._secrets = dict(secrets)
+    config.set_option("global.appTest", True)  # cada run lo pone y lo restaura
+
+    last = []
+    def instance(cls):
+        if cls._instance is not None: last[:] = [cls._instance]
+        if last: return last[0]
+        raise RuntimeError("Runtime hasn't been created!")
+    def exists(cls):
+        if cls._instance is not None: last[:] = [cls._instance]
+        return bool(last)
+    Runtime.instance, Runtime.exists = classmethod(instance), classmethod(exists)
+
+    get_bytecode, compiled, lock = ScriptCache.get_bytecode, {}, threading.Lock()
+    def shared_bytecode(self, script_path):
+        with lock:
+            if script_path not in compiled: compiled[script_path] = get_bytecode(self, script_path)
+            return compiled[script_path]
+    ScriptCache.get_bytecode = shared_bytecode
+
+    rerun = st.rerun
+    def full_rerun(scope="app"):
+        try: rerun(scope=scope)
+        except StreamlitInvalidLayoutContextError: rerun()
+    st.rerun = full_rerun
+
+
+def document_text(seed, paragraphs=60):
+    import random
+    from benchmarks.fakes import _DIAGNOSES, _TERMS
+    rng = random.Random(seed)
+    return "\n\n".join(
+        f"{rng.choice(_DIAGNOSES).capitalize()}: cursa con {', '.join(rng.sample(_TERMS, 6))}. "
+        f"El diagnóstico diferencial incluye {', '.join(rng.sample(_DIAGNOSES, 3))}."
+        for _ in range(paragraphs))
+
+
+class Session:
+    """Un usuario recorriendo la app; cada paso = una interacción = uno o varios reruns."""
+
+    def __init__(self, n, args):
+        from streamlit.testing.v1 import AppTest
+        self.username = f"bench{n:03d}"
+        self.n, self.args = n, args
+        self.at = AppTest.from_file(APP, default_timeout=args.timeout)
+        self.at.secrets.update(SECRETS)
+        self.samples = []  # (paso, ms, ms del script según la traza, lecturas, escrituras encoladas)
+        self.error = None
+        self._seen = set()
+
+    def _new_traces(self):
+        out = []
+        for key in ("_trace_prev", "_trace"):
+            trace = self.at.session_state[key] if key in self.at.session_state else None
+            if trace is not None and id(trace) not in self._seen:
+                self._seen.add(id(trace))
+                out.append(trace)
+        return out
+
+    def step(self, name, action=None):
+        if action: action()
+        t0 = time.perf_counter()
+        self.at.run()
+        ms = (time.perf_counter() - t0) * 1000
+        traces = self._new_traces()
+        totals = [t.totals() for t in traces]
+        self.samples.append((name, ms, sum(t.root.duration for t in traces) * 1000,
+                             sum(t.get("firestore_reads", 0) for t in totals),
+                             sum(t.get("firestore_writes_encoladas", 0) for t in totals)))
+        if self.at.exception: raise RuntimeError(f"{name}: {self.at.exception[0].message}")
+
+    def widget(self, kind, label):
+        for w in getattr(self.at, kind):
+            if w.label == label: return w
+        raise LookupError(f"{kind} '{label}' no está en la página")
+
+    def run(self, doc_cache):
+        from medflash.doc_cache import content_key
+        try:
+            self.step("inicio")
+            def login():
+                self.widget("text_input", "Username").input(self.username)
+                self.widget("text_input", "Password").input(PASSWORD)
+                self.widget("button", "Login").click()
+            self.step("login", login)
+            self.step("entrada")  # el navegador vuelve a ejecutar el script al recibir la cookie
+
+            self.step("subida.materia", lambda: self.widget("selectbox", "Materia:").set_value(MATERIA))
+            sistemas = self.widget("selectbox", "Tema/Sistema:").options
+            self.step("subida.sistema", lambda: self.widget("selectbox", "Tema/Sistema:").set_value(sistemas[min(1, len(sistemas) - 1)]))
+            text = document_text(self.n if not self.args.documento_compartido else 0)
+            key = content_key(text.encode("utf-8"), "text/plain", None)
+            doc_cache.put(key, text)
+            self.at.session_state["extracted_key"] = key
+
+            self.step("navegar", lambda: self.widget("button", "3. Generar Examen").click())
+            def generar():
+                self.widget("text_input", "Nombre del Mazo (ej. Parcial Bioquímica)").input(f"Mazo {self.username}")
+                self.widget("slider", "Preguntas").set_value(self.args.preguntas)
+                self.widget("button", "🚀 Crear con Feedback Visual").click()
+            self.step("generar", generar)
+
+            self.step("navegar", lambda: self.widget("button", "4. Estudiar").click())
+            self.step("abrir_mazo", lambda: self.widget("button", "Estudiar").click())
+            for _ in range(self.args.respuestas):
+                if self.at.session_state["page"] != "Estudiar" or not any(r.label == "Tu respuesta:" for r in self.at.radio): break
+                def responder():
+                    radio = self.widget("radio", "Tu respuesta:")
+                    radio.set_value(radio.options[0])
+                    self.widget("button", "Responder").click()
+                self.step("responder", responder)
+                self.step("siguiente", lambda: self.widget("button", "Siguiente ➡").click())
+            self.step("estadisticas", lambda: self.widget("button", "5. Estadísticas").click())
+        except Exception as e:
+            traceback.print_exc()
+            self.error = f"{self.username}: {type(e).__name__}: {e}"
+
+
+def summarize(samples):
+    # *_ms: lo que tarda at.run() (incluye la sobrecarga de AppTest); script_*: la traza del rerun.
+    ms, script = sorted(s[1] for s in samples), sorted(s[2] for s in samples)
+    n = len(samples)
+    if not n: return {"n": 0}
+    return {"n": n, **{f"p{p}_ms": round(percentile(ms, p), 1) for p in PERCENTILES},
+            "max_ms": round(ms[-1], 1), "mean_ms": round(sum(ms) / n, 1),
+            **{f"script_p{p}_ms": round(percentile(script, p), 1) for p in (50, 95)},
+            "firestore_reads_por_interaccion": round(sum(s[3] for s in samples) / n, 2),
+            "firestore_writes_por_interaccion": round(sum(s[4] for s in samples) / n, 2)}
+
+
+def wait_for_writes(db, settle=1.5, timeout=30.0):
+    # La cola write-behind envía en segundo plano: se espera a que el contador deje de moverse.
+    deadline = time.monotonic() + timeout
+    last, since = None, time.monotonic()
+    while time.monotonic() < deadline:
+        now = db.counters().get("writes", 0)
+        if now != last: last, since = now, time.monotonic()
+        elif time.monotonic() - since >= settle: break
+        time.sleep(0.1)
+
+
+def git_revision():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, capture_output=True, text=True, timeout=10)
+        return rev.stdout.strip() + ("+cambios" if dirty.stdout.strip() else "") if rev.returncode == 0 else None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    # Cachés en un directorio nuevo (arranque en frío reproducible) antes de importar medflash.
+    os.environ["MEDFLASH_CACHE_DIR"] = args.cache_dir or tempfile.mkdtemp(prefix="medflash_bench_")
+    os.environ.pop("MEDFLASH_METRICS_PATH", None)
+    sys.path.insert(0, ROOT)
+    from benchmarks import fakes
+    db = fakes.InMemoryFirestore(latency=args.latencia_firestore_ms / 1000, jitter=args.jitter_ms / 1000, seed=args.semilla)
+    models = []
+    def model_factory(name):
+        models.append(fakes.CannedModel(n=args.preguntas_por_lote, latency=args.latencia_llm_ms / 1000, seed=args.semilla))
+        return models[-1]
+    fakes.install(db, model_factory)
+    apptest_compat(SECRETS)
+
+    import bcrypt
+    from medflash import tracing
+    from medflash.doc_cache import DocumentCache
+    hashed = bcrypt.hashpw(PASSWORD.encode(), bcrypt.gensalt(args.bcrypt_rounds)).decode()
+    for n in range(args.sesiones + 1):
+        db.seed(["usuarios", f"bench{n:03d}"], {"name": f"Bench {n}", "email": f"bench{n}@medflash.ai",
+                                                "password": hashed, "progreso": {}})
+    doc_cache = DocumentCache()
+
+    # Calentamiento: una sesión completa fuera de la medida paga las importaciones y los
+    # recursos de proceso (arranque en frío), que se informan aparte.
+    warmup = Session(args.sesiones, args)
+    if not args.sin_calentamiento:
+        warmup.run(doc_cache)
+        wait_for_writes(db)
+    seeded = db.counters()
+    calls0 = sum(m.calls for m in models)
+    spans0 = {s["span"]: s["count"] for s in tracing.METRICS.snapshot()}
+
+    if args.tracemalloc: tracemalloc.start()
+    rss0 = rss_bytes()
+    t0 = time.perf_counter()
+    sessions = [Session(n, args) for n in range(args.sesiones)]
+    with ThreadPoolExecutor(max_workers=args.concurrencia or args.sesiones, thread_name_prefix="sesion") as pool:
+        list(pool.map(lambda s: s.run(doc_cache), sessions))
+    elapsed = time.perf_counter() - t0
+    rss1 = rss_bytes()
+    traced = tracemalloc.get_traced_memory() if args.tracemalloc else None
+    if args.tracemalloc: tracemalloc.stop()
+    wait_for_writes(db)
+
+    samples = [s for session in sessions for s in session.samples]
+    steps = {}
+    for s in samples: steps.setdefault(s[0], []).append(s)
+    ops = {k: v - seeded.get(k, 0) for k, v in db.counters().items()}
+    n_sessions = max(len(sessions), 1)
+    return {
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "entorno": {"python": platform.python_version(), "plataforma": platform.platform(),
+                    "streamlit": sys.modules["streamlit"].__version__, "cpus": os.cpu_count()},
+        "config": {k: v for k, v in vars(args).items() if k not in ("comparar", "salida")},
+        "duracion_s": round(elapsed, 2),
+        "sesiones": {"total": len(sessions), "ok": sum(1 for s in sessions if not s.error),
+                     "errores": [s.error for s in [warmup] + sessions if s.error]},
+        "arranque_en_frio": [[name, round(ms, 1)] for name, ms, *_ in warmup.samples] or None,
+        "reruns": summarize(samples),
+        "pasos": {name: summarize(rows) for name, rows in steps.items()},
+        "firestore": {"ops": ops, "por_interaccion": {k: round(v / max(len(samples), 1), 2) for k, v in ops.items()}},
+        "llm": {"llamadas": sum(m.calls for m in models) - calls0},
+        "memoria": {
+            "rss_por_sesion_kb": round((rss1 - rss0) / n_sessions / 1024, 1),
+            "estado_por_sesion_kb": round(sum(state_bytes(s.at) for s in sessions) / n_sessions / 1024, 1),
+            **({"tracemalloc_por_sesion_kb": round(traced[0] / n_sessions / 1024, 1),
+                "tracemalloc_pico_kb": round(traced[1] / 1024, 1)} if traced else {}),
+        },
+        # Agregados de proceso (incluyen el calentamiento); count_medido excluye sus spans.
+        "spans": [dict(s, count_medido=s["count"] - spans0.get(s["span"], 0)) for s in tracing.METRICS.snapshot()],
+    }
+
+
+def compare(current, base):
+    print(f"{'paso':<18}{'p50 ms':>20}{'p95 ms':>20}{'script p50 ms':>20}{'lecturas/int':>16}")
+    for name in ["reruns"] + sorted(set(current["pasos"]) | set(base["pasos"])):
+        a, b = (base["reruns"], current["reruns"]) if name == "reruns" else (base["pasos"].get(name, {}), current["pasos"].get(name, {}))
+        def col(k, fmt="{:.0f}"):
+            if k not in a or k not in b: return "-"
+            return f"{fmt.format(a[k])}→{fmt.format(b[k])}" + (f" ({(b[k] - a[k]) / a[k]:+.0%})" if a[k] else "")
+        print(f"{name:<18}{col('p50_ms'):>20}{col('p95_ms'):>20}{col('script_p50_ms'):>20}"
+              f"{col('firestore_reads_por_interaccion', '{:.1f}'):>16}")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m benchmarks.load_test",
+                                description="Prueba de carga de main_medflash.py con Firestore y Gemini locales.")
+    p.add_argument("--sesiones", type=int, default=4)
+    p.add_argument("--concurrencia", type=int, default=None, help="sesiones a la vez (por defecto, todas)")
+    p.add_argument("--preguntas", type=int, default=10, help="preguntas por mazo generado")
+    p.add_argument("--preguntas-por-lote", type=int, default=10, help="preguntas que devuelve cada llamada al modelo")
+    p.add_argument("--respuestas", type=int, default=5, help="preguntas que responde cada sesión")
+    p.add_argument("--latencia-firestore-ms", type=float, default=30.0)
+    p.add_argument("--jitter-ms", type=float, default=10.0)
+    p.add_argument("--latencia-llm-ms", type=float, default=500.0)
+    p.add_argument("--documento-compartido", action="store_true", help="todas las sesiones suben el mismo documento")
+    p.add_argument("--bcrypt-rounds", type=int, default=12, help="coste del hash de las contraseñas sembradas")
+    p.add_argument("--sin-calentamiento", action="store_true", help="medir también el arranque en frío")
+    p.add_argument("--tracemalloc", action="store_true", help="medir memoria con tracemalloc (más lento)")
+    p.add_argument("--timeout", type=float, default=120.0, help="segundos máximos por rerun")
+    p.add_argument("--semilla", type=int, default=1)
+    p.add_argument("--cache-dir", default=None, help="por defecto, un directorio temporal nuevo")
+    p.add_argument("--salida", default=None, help=f"JSON de resultados (por defecto en {os.path.relpath(RESULTS_DIR, ROOT)}/)")
+    p.add_argument("--comparar", default=None, help="JSON de una ejecución anterior")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = run(args)
+    path = args.salida or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}_{result['revision'] or 'sin-git'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as fh: json.dump(result, fh, ensure_ascii=False, indent=2)
+
+    r = result["reruns"]
+    print(f"{result['sesiones']['ok']}/{result['sesiones']['total']} sesiones en {result['duracion_s']} s · "
+          f"{r['n']} interacciones · p50 {r['p50_ms']:.0f} ms · p95 {r['p95_ms']:.0f} ms · "
+          f"{r['firestore_reads_por_interaccion']} lecturas/interacción · "
+          f"{result['memoria']['rss_por_sesion_kb']:.0f} KB/sesión")
+    for e in result["sesiones"]["errores"]: print(f"  ⚠️ {e}")
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as fh: compare(result, json.load(fh))
+    print(f"Resultados en {path}")
+    return 0 if not result["sesiones"]["errores"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
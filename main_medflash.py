@@ -3,27 +3,47 @@ import streamlit as st
 import time
 import json
 import random 
+import uuid
+import hashlib
+import os
+import sqlite3
+import tempfile
+import zipfile
+from contextlib import ExitStack
 import yaml
 from yaml.loader import SafeLoader
 
-try:
-    # --- Importaciones Críticas ---
-    from PIL import Image
-    import fitz  # PyMuPDF
-    from pptx import Presentation
-    import pandas as pd
-    import google.generativeai as genai
-    import plotly.graph_objects as go
-    import firebase_admin
-    from firebase_admin import credentials, firestore
-    import streamlit_authenticator as stauth
-    import bcrypt
-    from streamlit_authenticator.utilities.hasher import Hasher 
-except ImportError as e:
+from medflash import deps
+from medflash.auth import CREDENTIAL_FIELDS, CredentialIndex, LazyUsernames, normalize_username
+from medflash.contexto import select_context, select_context_batches
+from medflash.biblioteca import IndexRegistry
+from medflash.busqueda import SearchIndex
+from medflash.dedup import DedupFilter, NearDuplicateIndex
+from medflash.doc_cache import BlobCache, DocumentCache, content_key
+from medflash.extraccion import extraer_texto_pdf, extraer_texto_pptx
+from medflash.llm_cache import CachedModel, ResponseCache
+from medflash.llm_client import GeminiClient
+from medflash import analytics, imagenes, intercambio, render, shards, srs, tracing
+from medflash import write_queue as wq
+from medflash.storage import FirestoreBackend, SQLiteBackend, deck_meta
+from medflash.generacion import CONTEXT_TOKENS_GENERACION, MAX_CONCURRENCY, build_exam_prompt, generate_deck, refill_deck, split_batches
+
+def _dependencia_faltante(nombre, e):
     st.error("Error crítico de dependencias.")
     st.code(f"Error: {e}")
     st.stop()
 
+# --- Importaciones Críticas (perezosas: se cargan en su primer uso) ---
+deps.set_missing_handler(_dependencia_faltante)
+genai = deps.lazy_module("google.generativeai")
+firebase_admin = deps.lazy_module("firebase_admin")
+credentials = deps.lazy_module("firebase_admin.credentials")
+firestore = deps.lazy_module("firebase_admin.firestore")
+stauth = deps.lazy_module("streamlit_authenticator")
+stx = deps.lazy_module("extra_streamlit_components")
+hasher = deps.lazy_module("streamlit_authenticator.utilities.hasher")
+px = deps.lazy_module("plotly.express")
+
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(
     page_title="Med-Flash AI v2.5",
@@ -32,12 +52,13 @@ st.set_page_config(
     initial_sidebar_state="collapsed", 
 )
 
-# --- INICIALIZACIÓN DE MEMORIA OFFLINE (FALLBACK) ---
-if 'offline_db' not in st.session_state:
-    st.session_state.offline_db = {
-        'users': {},
-        'decks': {}
-    }
+# --- TRAZA DEL RERUN (ver medflash/tracing.py) ---
+# La traza anterior se cierra aquí si st.stop()/st.rerun() cortaron el script antes del final.
+if st.session_state.get('_trace'):
+    tracing.end_trace(st.session_state._trace)
+    st.session_state._trace_prev = st.session_state._trace
+st.session_state._trace = tracing.begin_trace(st.session_state.get('page', ''))
+tracing.start_exporter()
 
 # --- VÍNCULOS VISUALES DINÁMICOS ---
 SYSTEM_VISUALS = {
@@ -86,6 +107,10 @@ TOPICOS_POR_MATERIA = {
     "DEFAULT": SISTEMAS_CUERPO
 }
 
+# Presupuesto de contexto por prompt (tokens aprox.; antes eran 15k y 10k caracteres fijos)
+CONTEXT_TOKENS_AUDITORIA = 3750
+DECKS_PER_PAGE = 20
+
 # --- ESTILOS CSS (UI Limpia + Inputs Blancos) ---
 st.markdown("""
 <style>
@@ -205,50 +230,60 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# --- Funciones Auxiliares ---
-def extraer_texto_pdf(file_stream):
-    try:
-        doc = fitz.open(stream=file_stream.read(), filetype="pdf")
-        texto = ""
-        for page in doc: texto += page.get_text()
-        doc.close()
-        return texto
-    except Exception as e: return f"Error PDF: {e}"
-
-def extraer_texto_pptx(file_stream):
-    try:
-        prs = Presentation(file_stream)
-        texto = ""
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"): texto += shape.text + "\n"
-        return texto
-    except Exception as e: return f"Error PPTX: {e}"
-
 # --- Estado de Sesión ---
 if 'page' not in st.session_state: st.session_state.page = "Cargar Contenido"
-if 'extracted_content' not in st.session_state: st.session_state.extracted_content = None
+if 'extracted_key' not in st.session_state: st.session_state.extracted_key = None  # hash en la caché de documentos
 if 'current_exam' not in st.session_state: st.session_state.current_exam = None
+if 'exam_id' not in st.session_state: st.session_state.exam_id = None  # clave de idempotencia del intento
 if 'current_question_index' not in st.session_state: st.session_state.current_question_index = 0
 if 'user_answer' not in st.session_state: st.session_state.user_answer = None
 if 'show_explanation' not in st.session_state: st.session_state.show_explanation = False
 if 'exam_results' not in st.session_state: st.session_state.exam_results = []
+if 'question_started' not in st.session_state: st.session_state.question_started = time.time()
+if 'answer_buffer' not in st.session_state: st.session_state.answer_buffer = []
 if "authentication_status" not in st.session_state: st.session_state.authentication_status = None
 if "user_level" not in st.session_state: st.session_state.user_level = "Nivel 1 (Novato)"
 if "materia_actual" not in st.session_state: st.session_state.materia_actual = MATERIAS[0]
 if "sistema_actual" not in st.session_state: st.session_state.sistema_actual = "General"
 
+@st.cache_resource
+def get_doc_cache():
+    # Una caché por proceso: todas las sesiones comparten el texto de un mismo archivo.
+    return DocumentCache()
+
+@st.cache_resource
+def get_source_cache():
+    # PDF originales por clave de extracción: las figuras se sacan al generar, no al subir.
+    return BlobCache(namespace="fuentes")
+
+@st.cache_resource
+def get_image_cache():
+    return imagenes.image_cache()
+
+def get_extracted_content():
+    # La sesión sólo guarda el hash; el texto se lee de la caché cuando una página lo necesita.
+    return get_doc_cache().get(st.session_state.extracted_key)
+
+def contexto_relevante(contenido, token_budget):
+    # Trozos del documento que mejor puntúan (BM25) para la materia/sistema actuales.
+    return select_context(st.session_state.extracted_key, contenido, st.session_state.materia_actual,
+                          st.session_state.sistema_actual, token_budget)
+
 def restart_exam():
+    flush_answer_buffer(session_username())
     st.session_state.current_exam = None
+    st.session_state.exam_id = None
     st.session_state.current_question_index = 0
     st.session_state.user_answer = None
     st.session_state.show_explanation = False
     st.session_state.exam_results = []
+    st.session_state.question_started = time.time()
 
 def go_to_next_question():
     st.session_state.current_question_index += 1
     st.session_state.user_answer = None
     st.session_state.show_explanation = False
+    st.session_state.question_started = time.time()
 
 # --- API & Database ---
 @st.cache_resource
@@ -270,174 +305,545 @@ def init_firebase():
 
 db = init_firebase()
 
+@st.cache_resource
+def get_write_queue():
+    # Cola write-behind por proceso; al arrancar reenvía lo que quedó pendiente en el diario.
+    return wq.WriteBehindQueue(db) if db else None
+
 api_key_disponible = "GOOGLE_API_KEY" in st.secrets and st.secrets["GOOGLE_API_KEY"]
-gemini_model = None
-if api_key_disponible:
+
+GEMINI_MODEL_NAME = "gemini-2.5-flash-preview-09-2025"
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache()
+
+@st.cache_resource
+def get_gemini_client():
+    # Un cliente por proceso: todas las sesiones comparten límites de cuota, cola y reintentos.
+    # google.generativeai sólo se importa cuando una página pide el modelo.
+    if not api_key_disponible: return None
     try:
         genai.configure(api_key=st.secrets["GOOGLE_API_KEY"])
-        gemini_model = genai.GenerativeModel(model_name="gemini-2.5-flash-preview-09-2025")
-    except Exception as e: pass
+        return GeminiClient(genai.GenerativeModel(model_name=GEMINI_MODEL_NAME), GEMINI_MODEL_NAME)
+    except Exception as e:
+        tracing.error("Gemini", e)
+        return None
 
-# --- CAPA DE DATOS HÍBRIDA ---
-def get_all_users_credentials():
-    try: test_hash = Hasher(['123']).generate()[0] 
-    except: test_hash = "$2b$12$y.X.1.1.1.1.1.1.1.1.1.u.1.1.1.1.1.1.1.1.1.1.1.1.1.1.1"
-
-    base_credentials = {
-        'usernames': {
-            'drdavid': {
-                'name': 'Dr. David',
-                'email': 'david@medflash.ai',
-                'password': test_hash,
-                'progreso': {},
-                'logged_in': False
-            }
-        }
-    }
+def get_gemini_model():
+    client = get_gemini_client()
+    return CachedModel(client, get_response_cache(), GEMINI_MODEL_NAME) if client else None
 
-    if db:
-        try:
-            users_ref = db.collection('usuarios')
-            docs = users_ref.stream()
-            for doc in docs:
-                data = doc.to_dict()
-                if 'password' in data: base_credentials['usernames'][doc.id] = data
-        except Exception as e: print(f"Error DB: {e}")
+def mostrar_cola_ia():
+    client = get_gemini_client()
+    if not client: return
+    e = client.stats()
+    if e['en_cola'] or e['en_vuelo']:
+        st.caption(f"⏳ Cola IA: {e['en_cola']} esperando · {e['en_vuelo']} en curso · "
+                   f"espera media {e['espera_media_s']:.1f} s")
+
+def es_admin(username):
+    try: return username in st.secrets.get("ADMIN_USERS", [])
+    except Exception: return False
+
+# --- CAPA DE DATOS (Firestore o SQLite local, ver medflash/storage.py) ---
+@st.cache_resource
+def get_storage():
+    # Un backend por proceso, compartido por todas las sesiones.
+    if db: return FirestoreBackend(db, get_write_queue())
+    return SQLiteBackend()
+
+storage = get_storage()
 
-    if 'offline_db' in st.session_state:
-        for u, data in st.session_state.offline_db['users'].items():
-            base_credentials['usernames'][u] = data
+@st.cache_resource
+def get_credential_index():
+    # Índice por proceso: un login cuesta como mucho una lectura de un documento.
+    return CredentialIndex(ttl=300.0, negative_ttl=30.0)
 
-    return base_credentials
+def _load_user_credentials(username):
+    try:
+        record = storage.get_user_credentials(username)
+        if record is None:
+            # Usuarios antiguos guardados con mayúsculas: 'id' es su id real en el almacén.
+            stored = storage.find_username(username)
+            record = storage.get_user_credentials(stored) if stored and stored != username else None
+            if record: record = dict(record, id=stored)
+        return record
+    except Exception as e: tracing.error("DB", e)
+    return None
 
+def _resolve_user(username):
+    return get_credential_index().lookup(normalize_username(username), _load_user_credentials)
+
+def session_username():
+    # El login llega en minúsculas; los datos se guardan con el id real del usuario.
+    login = st.session_state.get("username")
+    record = _resolve_user(login) if login else None
+    return (record or {}).get('id', login)
+
+@st.cache_resource
+def get_seed_credentials():
+    # Un solo bcrypt (coste 12) por proceso, no uno por rerun.
+    try: test_hash = hasher.Hasher(['123']).generate()[0] 
+    except Exception as e:
+        tracing.error("bcrypt", e)
+        test_hash = "$2b$12$y.X.1.1.1.1.1.1.1.1.1.u.1.1.1.1.1.1.1.1.1.1.1.1.1.1.1"
+    return {
+        'drdavid': {
+            'name': 'Dr. David',
+            'email': 'david@medflash.ai',
+            'password': test_hash,
+            'progreso': {},
+            'logged_in': False
+        }
+    }
+
+@tracing.traced("auth.credenciales")
+def get_all_users_credentials():
+    seed_users = {u: dict(data) for u, data in get_seed_credentials().items()}
+    # Los demás usuarios se resuelven al hacer login, no se lee la colección entera.
+    return {'usernames': LazyUsernames(_resolve_user, seed_users)}
+
+@tracing.traced("auth.registro")
 def register_new_user(name, email, username, password):
     if not name or not email or not username or not password: return "Por favor completa todos los campos."
+    username = normalize_username(username)
 
-    hashed_pw = Hasher([password]).generate()[0]
+    hashed_pw = hasher.Hasher([password]).generate()[0]
     user_data = {'name': name, 'email': email, 'password': hashed_pw, 'progreso': {}}
 
-    # Offline
-    if 'offline_db' not in st.session_state: st.session_state.offline_db = {'users': {}, 'decks': {}}
-    st.session_state.offline_db['users'][username] = user_data
+    try:
+        if storage.find_username(username) or not storage.create_user(username, user_data): return "El usuario ya existe."
+    except Exception as e: return f"Error guardando el usuario: {str(e)}"
+    # El índice ya conoce al usuario: puede entrar aunque la escritura siga pendiente.
+    get_credential_index().invalidate(username)
+    get_credential_index().put(username, {k: user_data.get(k) for k in CREDENTIAL_FIELDS})
+    return "success"
 
-    # Online
-    if db:
-        try:
-            doc_ref = db.collection('usuarios').document(username)
-            if doc_ref.get().exists: return "El usuario ya existe."
-            doc_ref.set(user_data)
-        except Exception as e: return f"Guardado localmente, pero error en nube: {str(e)}"
+LEVELS = ["Nivel 1 (Novato)", "Nivel 2 (Estudiante)", "Nivel 3 (Interno)", "Nivel 4 (Residente)", "Nivel 5 (Especialista)"]
 
-    return "success"
+@tracing.traced("progreso.carga")
+def _load_progress(username):
+    try: return storage.get_progress(username)
+    except Exception as e: tracing.error("DB", e)
+    return {}
 
-def get_user_progress(username, materia):
-    if 'offline_db' in st.session_state and username in st.session_state.offline_db['users']:
-        progreso = st.session_state.offline_db['users'][username].get('progreso', {})
-        if materia in progreso: return progreso[materia]['level'], progreso[materia]['xp']
+def _progress_cache(username):
+    # Caché write-through en la sesión: una lectura al entrar, cero lecturas por rerun.
+    cache = st.session_state.get('progress_cache')
+    if not cache or cache['user'] != username:
+        cache = {'user': username, 'progreso': _load_progress(username), 'aplicados': {}}
+        st.session_state.progress_cache = cache
+    return cache
 
-    if not db: return "Nivel 1 (Novato)", 0
-    try:
-        doc = db.collection('usuarios').document(username).get()
-        if doc.exists: 
-            data = doc.to_dict()
-            progreso = data.get('progreso', {})
-            if materia in progreso: return progreso[materia]['level'], progreso[materia]['xp']
-    except: pass
+@tracing.traced("progreso")
+def get_user_progress(username, materia):
+    progreso = _progress_cache(username)['progreso']
+    if materia in progreso: return progreso[materia]['level'], progreso[materia]['xp']
     return "Nivel 1 (Novato)", 0
 
-def update_user_level(username, materia, passed):
-    levels = ["Nivel 1 (Novato)", "Nivel 2 (Estudiante)", "Nivel 3 (Interno)", "Nivel 4 (Residente)", "Nivel 5 (Especialista)"]
-    
-    def calc_next_level(current_prog):
-        if materia in current_prog: lvl = current_prog[materia]['level']; xp = current_prog[materia]['xp']
-        else: lvl = "Nivel 1 (Novato)"; xp = 0
-        
+@tracing.traced("progreso.examen")
+def update_user_level(username, materia, passed, exam_id):
+    # Idempotente por exam_id: los reruns de la pantalla de resultados no vuelven a sumar XP.
+    cache = _progress_cache(username)
+    if exam_id in cache['aplicados']: return cache['aplicados'][exam_id]
+
+    def calc_next_level(current):
+        lvl = current.get('level', "Nivel 1 (Novato)"); xp = current.get('xp', 0)
         if passed:
             xp += 10
-            idx = levels.index(lvl) if lvl in levels else 0
-            if idx < 4: return levels[idx+1], xp, f"¡Subiste de nivel en {materia}! Ahora eres: {levels[idx+1]} 🌟"
+            idx = LEVELS.index(lvl) if lvl in LEVELS else 0
+            if idx < 4: return LEVELS[idx+1], xp, f"¡Subiste de nivel en {materia}! Ahora eres: {LEVELS[idx+1]} 🌟"
         return lvl, xp, ""
 
-    if 'offline_db' in st.session_state and username in st.session_state.offline_db['users']:
-        user = st.session_state.offline_db['users'][username]
-        nl, nx, m = calc_next_level(user.get('progreso', {}))
-        if 'progreso' not in user: user['progreso'] = {}
-        user['progreso'][materia] = {'level': nl, 'xp': nx}
-
-    if not db: return nl, m if 'nl' in locals() else ""
-        
+    nl, nx, m = calc_next_level(cache['progreso'].get(materia, {}))
     try:
-        doc_ref = db.collection('usuarios').document(username)
-        data = doc_ref.get().to_dict() or {}
-        progreso = data.get('progreso', {})
-        nl, nx, m = calc_next_level(progreso)
-        progreso[materia] = {'level': nl, 'xp': nx}
-        doc_ref.update({'progreso': progreso})
-        return nl, m
-    except: return None, None
+        # La marca del examen es la clave de idempotencia: el backend suma el XP una sola vez.
+        if not storage.apply_exam(username, materia, nl, 10 if passed else 0, exam_id):
+            # Otra pestaña ya aplicó este examen: se refresca la caché en vez de sumar de nuevo.
+            cache['progreso'] = _load_progress(username)
+            cache['aplicados'][exam_id] = (get_user_progress(username, materia)[0], "")
+            return cache['aplicados'][exam_id]
+    except Exception as e:
+        tracing.error("DB", e)
+        return None, None
+
+    cache['progreso'][materia] = {'level': nl, 'xp': nx}
+    cache['aplicados'][exam_id] = (nl, m)
+    return nl, m
+
+@tracing.traced("mazos.indice")
+def get_user_deck_index(username):
+    try: return storage.get_deck_index(username)
+    except Exception as e: tracing.error("DB", e)
+    return {}
+
+@tracing.traced("mazos.cargar")
+def get_user_deck(username, name):
+    # Las preguntas de un mazo sólo se descargan al ir a estudiarlo.
+    try: return storage.get_deck(username, name)
+    except Exception as e: tracing.error("DB", e)
+    return None
+
+@st.cache_resource
+def get_dedup_registry():
+    # Índices MinHash por usuario compartidos por el proceso; su instantánea vive en la caché de disco.
+    return IndexRegistry(DocumentCache(namespace="dedup", memory_items=0), NearDuplicateIndex, "dedup")
+
+@st.cache_resource
+def get_search_registry():
+    return IndexRegistry(DocumentCache(namespace="busqueda", memory_items=0), SearchIndex, "busqueda")
+
+def library_registries():
+    return (get_dedup_registry(), get_search_registry())
+
+def session_deck_index(username):
+    # Índice de mazos de la sesión: se lee de storage una vez y se mantiene al guardar/borrar.
+    index = st.session_state.get("deck_index")
+    if not isinstance(index, dict):
+        index = st.session_state.deck_index = get_user_deck_index(username)
+    return index
+
+def _library_index(registry, username):
+    # Se concilia con la lista de mazos una vez por sesión o cuando cambia, no en cada consulta.
+    decks = session_deck_index(username)
+    synced = st.session_state.setdefault("library_synced", {})
+    state = (username, hash(frozenset(decks)))
+    index = registry.loaded(username) if synced.get(registry.name) == state else None
+    if index is None:
+        index = registry.get(username, decks, lambda name: get_user_deck(username, name))
+        synced[registry.name] = state
+    return index
+
+@tracing.traced("biblioteca.dedup")
+def get_dedup_index(username): return _library_index(get_dedup_registry(), username)
+@tracing.traced("biblioteca.busqueda")
+def get_search_index(username): return _library_index(get_search_registry(), username)
 
 def get_user_decks(username):
-    decks = {}
-    if 'offline_db' in st.session_state and username in st.session_state.offline_db['decks']:
-        decks.update(st.session_state.offline_db['decks'][username])
-    if db:
-        try:
-            stream = db.collection('usuarios').document(username).collection('mazos').stream()
-            for d in stream:
-                data = d.to_dict()
-                if isinstance(data, dict) and 'preguntas' in data: decks[d.id] = data
-        except: pass
-    return decks
+    # Generador (nombre, mazo) de uno en uno: recorrer toda la biblioteca no la carga entera.
+    try: yield from storage.iter_decks(username)
+    except Exception as e: tracing.error("DB", e)
 
+@tracing.traced("mazos.guardar")
 def save_user_deck(username, name, content, mat, sis):
     deck_data = {'preguntas': content, 'materia': mat, 'sistema': sis, 'creado': str(time.time())}
-    if 'offline_db' not in st.session_state: st.session_state.offline_db = {'users':{}, 'decks':{}}
-    if 'decks' not in st.session_state.offline_db: st.session_state.offline_db['decks'] = {}
-    if username not in st.session_state.offline_db['decks']: st.session_state.offline_db['decks'][username] = {}
-    st.session_state.offline_db['decks'][username][name] = deck_data
-
-    if db:
-        try:
-            db.collection('usuarios').document(username).collection('mazos').document(name).set({
-                'preguntas': content, 'materia': mat, 'sistema': sis, 'creado': firestore.SERVER_TIMESTAMP
-            })
-        except: return False 
-    return True
+    try: ok = storage.save_deck(username, name, deck_data)
+    except Exception as e:
+        tracing.error("DB", e)
+        return False
+    if ok:
+        schedule_new_cards(username, name, content)
+        for registry in library_registries(): registry.on_save(username, name, content, deck_meta(deck_data))
+    return ok
 
+@tracing.traced("mazos.borrar")
 def delete_user_deck(username, name):
-    success = False
-    if 'offline_db' in st.session_state and username in st.session_state.offline_db['decks']:
-        if name in st.session_state.offline_db['decks'][username]:
-            del st.session_state.offline_db['decks'][username][name]
-            success = True
-    if db:
-        try:
-            db.collection('usuarios').document(username).collection('mazos').document(name).delete()
-            success = True
-        except: pass
-    return success
+    queue = get_due_queue(username)
+    try:
+        ok = storage.delete_deck(username, name)
+        storage.delete_card_states(username, name, queue.states)
+    except Exception as e:
+        tracing.error("DB", e)
+        return False
+    queue.remove_deck(name)
+    for registry in library_registries(): registry.on_delete(username, name)
+    return ok
+
+# --- REPETICIÓN ESPACIADA ---
+REVIEW_SESSION_SIZE = 20
+
+@tracing.traced("srs.cola")
+def get_due_queue(username):
+    # Estados compactos de todas las tarjetas del usuario (sin preguntas), una lectura por sesión.
+    cached = st.session_state.get('srs_queue')
+    if not cached or cached[0] != username:
+        try: states = storage.get_card_states(username)
+        except Exception as e:
+            tracing.error("DB", e)
+            states = {}
+        cached = (username, srs.DueQueue(states))
+        st.session_state.srs_queue = cached
+    return cached[1]
+
+def schedule_new_cards(username, deck_name, preguntas):
+    queue, now = get_due_queue(username), time.time()
+    nuevas = {}
+    for q in preguntas:
+        cid = srs.card_id(q)
+        state = queue.states.get(cid)
+        if state is None: queue.push(cid, srs.new_state(deck_name, now))
+        else: queue.states[cid] = srs.with_deck(state, deck_name)  # ya programada: sólo suma este mazo
+        if queue.states[cid] is not state: nuevas[cid] = queue.states[cid]
+    if nuevas:
+        try: storage.save_card_states(username, nuevas)
+        except Exception as e: tracing.error("DB", e)
+
+def record_answer(username, q, opcion, correct, latency):
+    # La cola SRS en memoria se actualiza al momento; la escritura y el evento quedan en answer_buffer.
+    exam, idx = st.session_state.current_exam, st.session_state.current_question_index
+    deck_name = exam['mazos'][idx] if exam.get('mazos') else exam.get('name')
+    materia, sistema = exam['temas'][idx] if exam.get('temas') else (exam.get('materia'), exam.get('sistema'))
+    queue = get_due_queue(username)
+    cid = srs.card_id(q)
+    state = queue.states.get(cid) or srs.new_state(deck_name)
+    state = srs.review(state, srs.quality_from_answer(correct, latency))
+    queue.push(cid, state)
+    st.session_state.answer_buffer.append({
+        'card_id': cid, 'state': state,
+        'event': analytics.make_event(deck_name, cid, opcion, correct, latency, materia, sistema)})
+
+@tracing.traced("estadisticas.rollups")
+def get_attempt_rollups(username):
+    cached = st.session_state.get('stats_rollups')
+    if not cached or cached[0] != username:
+        try: rows = storage.get_attempt_rollups(username)
+        except Exception as e:
+            tracing.error("DB", e)
+            rows = []
+        cached = (username, rows)
+        st.session_state.stats_rollups = cached
+    return cached[1]
+
+@tracing.traced("respuestas.volcar")
+def flush_answer_buffer(username):
+    """Persiste de una vez las respuestas acumuladas durante el examen."""
+    buffer = st.session_state.get('answer_buffer')
+    if not buffer or not username: return
+    states = {a['card_id']: a['state'] for a in buffer}  # la última revisión de cada tarjeta gana
+    events = [a['event'] for a in buffer]
+    deltas = analytics.rollup_deltas(events)
+    try:
+        storage.save_card_states(username, states)
+        storage.append_attempts(username, uuid.uuid4().hex, events, deltas)
+    except Exception as e:
+        tracing.error("DB", e)
+        return
+    st.session_state.answer_buffer = []
+    cached = st.session_state.get('stats_rollups')
+    if cached and cached[0] == username:
+        st.session_state.stats_rollups = (username, analytics.merge_rollups(cached[1], deltas))
+
+def build_card_session(username, cards, **exam):
+    """cards: [(card_id, mazo)] en el orden de estudio; sólo se descargan los mazos implicados."""
+    by_deck = {}
+    for cid, deck_name in cards: by_deck.setdefault(deck_name, set()).add(cid)
+    found = {}
+    for deck_name, cids in by_deck.items():
+        deck = get_user_deck(username, deck_name) or {}
+        try: picked = shards.pick(deck.get('preguntas', []), cids)  # sólo los fragmentos con esas tarjetas
+        except shards.CorruptShard as e:
+            tracing.error("sesión de tarjetas", e)
+            continue
+        for cid, q in picked.items(): found[cid] = (q, deck_name, (deck.get('materia'), deck.get('sistema')))
+    orden = [found[cid] for cid, _ in cards if cid in found]
+    return dict(exam, preguntas=[q for q, _, _ in orden], mazos=[d for _, d, _ in orden], temas=[t for _, _, t in orden])
+
+def build_review_session(username, n=REVIEW_SESSION_SIZE):
+    due = get_due_queue(username).due(n)
+    return build_card_session(username, [(cid, state[srs.DECK]) for cid, state in due],
+                              materia='Repaso', sistema='General', name='Repaso del día', repaso=True)
+
+def start_card_session(exam):
+    restart_exam()
+    st.session_state.current_exam = exam
+    st.session_state.exam_id = uuid.uuid4().hex
+    st.session_state.page = "Estudiar"
+    st.rerun()
+
+# --- BÚSQUEDA ---
+SEARCH_RESULTS = 30
+
+@st.fragment
+def search_panel(username):
+    # Cada consulta re-ejecuta sólo este fragmento; el índice responde en milisegundos.
+    consulta = st.text_input("🔎 Buscar en tu biblioteca", placeholder="ej. estenosis aórtica, hipotiroid...",
+                             key="busqueda")
+    if not consulta.strip(): return
+    t0 = time.perf_counter()
+    total, resultados = get_search_index(username).search(consulta, limit=SEARCH_RESULTS)
+    ms = (time.perf_counter() - t0) * 1000
+    if not resultados:
+        st.caption(f"Sin resultados ({ms:.1f} ms).")
+        return
+    c1, c2 = st.columns([3, 1])
+    c1.caption(f"{total} tarjetas ({ms:.1f} ms)" + (f" · se muestran las {SEARCH_RESULTS} mejores" if total > SEARCH_RESULTS else ""))
+    if c2.button(f"Estudiar estas {len(resultados)}", key="estudiar_busqueda"):
+        sesion = build_card_session(username, [(r[2], r[1]) for r in resultados], materia='Búsqueda',
+                                    sistema='General', name=f"Búsqueda: {consulta.strip()}", libre=True)
+        if sesion['preguntas']: start_card_session(sesion)
+        else: st.info("Las tarjetas encontradas ya no están disponibles.")
+    for _, deck_name, _, fragmento, materia, sistema in resultados:
+        st.markdown(f"**{fragmento}**  \n<small>{deck_name} · {materia} · {sistema}</small>", unsafe_allow_html=True)
+
+# --- IMPORTAR / EXPORTAR ---
+EXPORT_FORMATS = {"JSONL": ".jsonl", "Anki (.apkg)": ".apkg"}
+
+def export_path(username, ext):
+    # Un archivo por usuario, reescrito en cada exportación.
+    return os.path.join(tempfile.gettempdir(), f"medflash_export_{hashlib.sha256(username.encode()).hexdigest()[:16]}{ext}")
+
+@st.fragment
+def exchange_panel(username):
+    with st.expander("📦 Importar / exportar biblioteca"):
+        if st.session_state.get('import_summary'):
+            resumen, errores = st.session_state.pop('import_summary')
+            st.success(f"Importado: {resumen}")
+            for where, reason in errores: st.caption(f"✗ {where}: {reason}")
+        e1, e2 = st.columns(2)
+        formato = e1.radio("Exportar como", list(EXPORT_FORMATS), horizontal=True)
+        if e1.button("Preparar exportación"):
+            ext = EXPORT_FORMATS[formato]
+            path, estado = export_path(username, ext), e1.empty()
+            progreso = intercambio.Progress(lambda p: estado.caption(p.summary()))
+            with st.spinner("Exportando..."):
+                try:
+                    if ext == ".apkg": intercambio.export_apkg(get_user_decks(username), path, progreso, get_image_cache())
+                    else:
+                        with open(path, "w", encoding="utf-8") as out: intercambio.export_jsonl(get_user_decks(username), out, progreso)
+                except (OSError, sqlite3.Error, shards.CorruptShard) as e:  # fragmento dañado en algún mazo
+                    tracing.error("exportación", e)
+                    e1.error(f"No se pudo exportar: {e}")
+                else:
+                    estado.caption(progreso.summary())
+                    st.session_state.export_file = path
+        path = st.session_state.get('export_file')
+        if path and os.path.exists(path):
+            with open(path, "rb") as fh:
+                e1.download_button("⬇️ Descargar", fh, file_name=f"medflash{os.path.splitext(path)[1]}")
+
+        f = e2.file_uploader("Importar (JSONL, Anki .apkg o texto de Anki)", ["jsonl", "json", "apkg", "colpkg", "txt", "tsv"])
+        if f and e2.button("Importar"):
+            existentes = set(get_user_deck_index(username))
+            estado = e2.empty()
+            progreso = intercambio.Progress(lambda p: estado.caption(p.summary()))
+            writer = intercambio.DeckWriter(lambda name, qs, mat, sis: save_user_deck(username, name, qs, mat, sis),
+                                            existentes.__contains__, progreso)
+            with st.spinner("Importando..."), ExitStack() as diferidos:
+                # Los índices de la biblioteca se guardan una sola vez al terminar, no tras cada parte.
+                for registry in library_registries(): diferidos.enter_context(registry.deferred(username))
+                try: intercambio.import_file(f, f.name, writer)
+                except (ValueError, zipfile.BadZipFile, sqlite3.Error) as e:
+                    tracing.error("importación", e)
+                    e2.error(f"No se pudo importar: {e}")
+                    return
+            st.session_state.import_summary = (progreso.summary(), progreso.errors)
+            st.session_state.deck_index = None  # se recarga con los mazos nuevos
+            st.rerun()
+
+# --- VISTA DE ESTUDIO ---
+# Responder/Siguiente sólo re-ejecutan este fragmento (no el CSS, la autenticación ni la barra
+# lateral). Al terminar el mazo se vuelcan las respuestas y se recarga la app para el resultado.
+@st.fragment
+def study_card(username):
+    exam = st.session_state.current_exam.get('preguntas', [])
+    idx = st.session_state.current_question_index
+    if idx >= len(exam): st.rerun()
+    try: q = exam[idx]  # en un mazo fragmentado, descarga (o ya adelantó) el fragmento de esta pregunta
+    except shards.CorruptShard as e:
+        tracing.error("fragmento", e)
+        st.error("No se pudo cargar esta parte del mazo. Inténtalo de nuevo.")
+        return
+    st.markdown(f"### Pregunta {idx+1}/{len(exam)}")
+    st.html(render.question_html(q))
+    figuras = imagenes.figures(q)
+    slot_figuras = st.empty() if figuras else None
+
+    ops = list(q['opciones'].values())
+    sel = st.radio("Tu respuesta:", ops, key=f"q{idx}", disabled=st.session_state.show_explanation)
+    if st.button("Responder", disabled=st.session_state.show_explanation) and sel:
+        st.session_state.show_explanation = True
+        cor_txt = q['opciones'][q['respuesta_correcta']]
+        is_ok = (sel == cor_txt)
+        if len(st.session_state.exam_results) <= idx:
+            st.session_state.exam_results.append({'ok': is_ok, 'sel': sel, 'cor': cor_txt})
+            opcion = next((k for k, v in q['opciones'].items() if v == sel), None)
+            record_answer(username, q, opcion, is_ok, time.time() - st.session_state.question_started)
+        st.rerun(scope="fragment")
+
+    if st.session_state.show_explanation:
+        res = st.session_state.exam_results[idx]
+        st.html(render.feedback_html(res['ok'], res['cor'], q.get('explicacion', '')))
+        miniatura = imagenes.thumbnail(q)
+        slot_pagina = st.empty() if miniatura else None
+        st.write("")
+        if st.button("Siguiente ➡"):
+            go_to_next_question()
+            if st.session_state.current_question_index < len(exam): st.rerun(scope="fragment")
+            flush_answer_buffer(username)
+            st.rerun()
+        if slot_pagina: show_card_images(slot_pagina, [miniatura], f"Página {q.get('pagina')} del documento")
+    if slot_figuras: show_card_images(slot_figuras, figuras)
+
+def show_card_images(slot, refs, caption=None):
+    # Se llama al final de study_card: el enunciado y los botones ya están en pantalla cuando se
+    # leen los bytes de la caché, y el JPEG progresivo se ve primero borroso y luego nítido.
+    cache = get_image_cache()
+    with slot.container():
+        for col, ref in zip(st.columns(len(refs)), refs):
+            data = cache.get(ref['id'])
+            if data is None: col.caption("🖼️ Imagen no disponible (ya no está en la caché de este servidor).")
+            else: col.image(data, caption=caption)
+
+# --- PANEL DE DEPURACIÓN ---
+def mostrar_traza(trace):
+    # Cascada del rerun anterior (el actual aún no ha terminado cuando se pinta la barra lateral).
+    with st.expander("🔬 Traza del rerun anterior", expanded=True):
+        if trace is None:
+            st.caption("Todavía no hay un rerun terminado.")
+            return
+        rows = trace.rows()
+        tot = trace.totals()
+        st.caption(f"**{trace.label or 'inicio'}** · {rows[0][3]:.0f} ms · {tot.get('firestore_reads', 0)} lecturas · "
+                   f"{tot.get('firestore_writes_encoladas', 0)} escrituras · {tot.get('errores', 0)} errores")
+        etiquetas = [f"{i:02d} {'· ' * depth}{name}" for i, (name, depth, *_rest) in enumerate(rows)]
+        fig = px.bar(x=[r[3] for r in rows], base=[r[2] for r in rows], y=etiquetas, orientation='h',
+                     hover_name=[", ".join(f"{k}={v}" for k, v in r[4].items()) or r[0] for r in rows],
+                     labels={'x': 'ms', 'y': ''})
+        fig.update_yaxes(autorange="reversed")
+        fig.update_layout(height=max(200, 22 * len(rows)), margin=dict(l=0, r=0, t=10, b=0), showlegend=False)
+        st.plotly_chart(fig, use_container_width=True)
 
 # --- AUTHENTICATOR SETUP ---
-credentials_data = get_all_users_credentials()
 config = {
-    'credentials': credentials_data,
     'cookie': {'expiry_days': 30, 'key': 'medflash_key_v2', 'name': 'medflash_cookie_v2'},
     'preauthorized': {'emails': []}
 }
-authenticator = stauth.Authenticate(
-    config['credentials'], config['cookie']['name'], config['cookie']['key'], 
-    config['cookie']['expiry_days'], config['preauthorized']['emails']
-)
+
+@tracing.traced("auth.autenticador")
+def get_authenticator():
+    # Cache por sesión (no cache_resource): el CookieManager guarda las cookies del navegador
+    # de cada usuario y no puede compartirse entre sesiones.
+    version = get_credential_index().version
+    cached = st.session_state.get('_authenticator')
+    if cached and cached[0] == version:
+        auth = cached[1]
+        # El componente de cookies entrega su valor al renderizarse: se renderiza en cada rerun.
+        auth.cookie_controller.cookie_model.cookie_manager = stx.CookieManager()
+        return auth
+
+    credentials_data = get_all_users_credentials()
+    lazy_usernames = credentials_data['usernames']
+    auth = stauth.Authenticate(
+        credentials_data, config['cookie']['name'], config['cookie']['key'], 
+        config['cookie']['expiry_days'], config['preauthorized']['emails']
+    )
+    # stauth copia 'usernames' a un dict plano al iniciar la sesión; se vuelve a poner el perezoso.
+    credentials_data['usernames'] = lazy_usernames
+    st.session_state._authenticator = (version, auth)
+    return auth
+
+authenticator = get_authenticator()
 
 # --- MAIN APP ---
 if st.session_state["authentication_status"] is None:
     st.markdown("<h1 style='text-align: center; color: #4A5568;'>Med-Flash AI v2.5 🧬</h1>", unsafe_allow_html=True)
     
     if not db:
-        st.warning("⚠️ Modo Offline Activado: Datos temporales.")
+        st.warning("⚠️ Modo Local Activado: los datos se guardan sólo en este servidor (SQLite).")
     
     tab1, tab2 = st.tabs(["Login", "Registro"])
-    with tab1: 
+    with tab1, tracing.span("auth.login"):
         authenticator.login('main')
 
     with tab2:
@@ -457,8 +863,9 @@ if st.session_state["authentication_status"] is None:
                 else: st.error(res)
 
 elif st.session_state["authentication_status"]:
-    username = st.session_state.get("username")
+    username = session_username()
     name = st.session_state.get("name")
+    if st.session_state.page != "Estudiar": flush_answer_buffer(username)  # examen abandonado a medias
     
     materia_display = st.session_state.materia_actual
     if materia_display == "Seleccionar Materia":
@@ -469,7 +876,7 @@ elif st.session_state["authentication_status"]:
         st.session_state.user_level = nivel_actual 
 
     if st.session_state.get("last_login") != username:
-        st.session_state.flashcard_library = get_user_decks(username)
+        st.session_state.deck_index = get_user_deck_index(username)
         st.session_state.last_login = username
 
     current_system = st.session_state.sistema_actual
@@ -478,7 +885,7 @@ elif st.session_state["authentication_status"]:
     with st.sidebar:
         st.markdown(f"### Dr. {name}")
         if not db:
-            st.caption("⚠️ MODO OFFLINE")
+            st.caption("⚠️ MODO LOCAL (SQLite)")
             
         if materia_display != "Seleccionar Materia":
             st.caption(f"Nivel en {materia_display}:")
@@ -486,6 +893,8 @@ elif st.session_state["authentication_status"]:
         else:
             st.caption("Selecciona una materia para ver tu nivel.")
             
+        pendientes = storage.pending(username)
+        if pendientes: st.caption(f"🔄 {pendientes} cambios pendientes de sincronizar")
         authenticator.logout('Salir', 'sidebar')
         st.markdown("---")
         st.markdown(f"""
@@ -500,112 +909,192 @@ elif st.session_state["authentication_status"]:
         if st.button("2. Verificación IA", use_container_width=True): st.session_state.page = "Verificación IA"
         if st.button("3. Generar Examen", use_container_width=True): st.session_state.page = "Generar Examen"
         if st.button("4. Estudiar", use_container_width=True): st.session_state.page = "Mi Progreso"
+        if st.button("5. Estadísticas", use_container_width=True): st.session_state.page = "Estadísticas"
+        if es_admin(username):
+            with st.expander("🛠️ Admin: cachés"):
+                if db:
+                    q = get_write_queue()
+                    st.caption(f"**Firestore (write-behind)**: {q.pending()} pendientes · {q.flushed} enviadas "
+                               f"en {q.batches} batches · {q.failed} descartadas"
+                               + (f" · último error: {q.last_error}" if q.last_error else ""))
+                if get_gemini_client():
+                    e = get_gemini_client().stats()
+                    st.caption(f"**Cliente IA**: {e['llamadas']} llamadas · {e['reintentos']} reintentos · "
+                               f"{e['coalescidas']} coalescidas · {e['errores']} errores")
+                for titulo, cache in (("Respuestas IA", get_response_cache()), ("Documentos", get_doc_cache())):
+                    e = cache.stats()
+                    st.caption(f"**{titulo}**: {e['hits']} hits / {e['misses']} misses "
+                               f"({e['hit_rate']:.0%}) · {e['memoria']} en RAM · {e['disco_mb']:.1f} MB en disco")
+            with st.expander("📈 Admin: métricas"):
+                st.checkbox("Mostrar la traza de cada rerun", key="debug_trace")
+                st.download_button("Prometheus (texto)", tracing.METRICS.prometheus(), "medflash_metrics.prom", "text/plain")
+                st.download_button("JSON lines", tracing.METRICS.jsonl(), "medflash_metrics.jsonl", "application/x-ndjson")
+                for m in tracing.METRICS.snapshot()[:15]:
+                    st.caption(f"`{m['span']}` ×{m['count']} · p50 {m['p50'] * 1000:.0f} ms · p95 {m['p95'] * 1000:.0f} ms")
+        if tracing.DEBUG_TRACE or st.session_state.get('debug_trace'):
+            mostrar_traza(st.session_state.get('_trace_prev'))
+        if deps.DEBUG_IMPORTS:
+            with st.expander("⏱️ Coste de importaciones"):
+                for mod, ms, at in deps.import_report():
+                    st.caption(f"{mod}: {ms:.0f} ms (a los {at:.0f} ms)")
 
-    # --- PÁGINA 1: CARGAR ---
-    if st.session_state.page == "Cargar Contenido":
-        st.header("1. Contexto Clínico 📚")
-        c1, c2 = st.columns(2)
-        with c1:
-            mat = st.selectbox("Materia:", MATERIAS)
-            st.session_state.materia_actual = mat
-            if mat != materia_display: st.rerun()
-        with c2:
-            if mat in TOPICOS_POR_MATERIA: ops = TOPICOS_POR_MATERIA[mat]
-            elif mat == "Seleccionar Materia": ops = ["Selecciona Materia Primero"]
-            else: ops = TOPICOS_POR_MATERIA["DEFAULT"]
-            sis = st.selectbox("Tema/Sistema:", ops)
-            st.session_state.sistema_actual = sis
+    with tracing.span(f"pagina:{st.session_state.page}"):
+        # --- PÁGINA 1: CARGAR ---
+        if st.session_state.page == "Cargar Contenido":
+            st.header("1. Contexto Clínico 📚")
+            c1, c2 = st.columns(2)
+            with c1:
+                mat = st.selectbox("Materia:", MATERIAS)
+                st.session_state.materia_actual = mat
+                if mat != materia_display: st.rerun()
+            with c2:
+                if mat in TOPICOS_POR_MATERIA: ops = TOPICOS_POR_MATERIA[mat]
+                elif mat == "Seleccionar Materia": ops = ["Selecciona Materia Primero"]
+                else: ops = TOPICOS_POR_MATERIA["DEFAULT"]
+                sis = st.selectbox("Tema/Sistema:", ops)
+                st.session_state.sistema_actual = sis
             
-        st.divider()
-        f = st.file_uploader("Sube PDF/PPTX/TXT", ["pdf", "pptx", "txt"])
-        if st.button("Procesar Archivo", type="primary"):
-            if f:
-                with st.spinner("Leyendo..."):
-                    if f.type == "application/pdf": t = extraer_texto_pdf(f)
-                    elif "presentation" in f.type: t = extraer_texto_pptx(f)
-                    else: t = f.read().decode("utf-8")
-                    st.session_state.extracted_content = t
-                    st.success("Texto extraído. Continúa a 'Verificación IA'.")
-
-    # --- PÁGINA 2: VERIFICACIÓN IA ---
-    elif st.session_state.page == "Verificación IA":
-        st.header("2. Verificación Médica con IA 🔬")
-        if not st.session_state.extracted_content: st.warning("Carga un archivo primero."); st.stop()
+            st.divider()
+            f = st.file_uploader("Sube PDF/PPTX/TXT", ["pdf", "pptx", "txt"])
+            rango = None
+            if f and f.type == "application/pdf":
+                rango = st.text_input("Páginas a extraer (vacío = todas)", placeholder="ej. 120-185, 190")
+            if st.button("Procesar Archivo", type="primary"):
+                if f:
+                    barra = st.progress(0.0, text="Leyendo...")
+                    def avance(pagina, hechas, total):
+                        barra.progress(hechas / max(total, 1), text=f"Página {pagina} ({hechas}/{total})")
+                    def extraer():
+                        if f.type == "application/pdf": return extraer_texto_pdf(f, pages=rango, on_page=avance)
+                        elif "presentation" in f.type: return extraer_texto_pptx(f)
+                        else: return f.read().decode("utf-8")
+                    with st.spinner("Leyendo..."):
+                        key = content_key(f, f.type, rango)
+                        with tracing.span("extraccion"): t = get_doc_cache().get_or_extract(key, extraer)
+                        barra.progress(1.0, text="Listo")
+                        if t.startswith(("Error PDF:", "Error PPTX:")): st.error(t)
+                        else:
+                            if f.type == "application/pdf" and get_source_cache().path(key) is None:
+                                get_source_cache().put(key, f.getvalue())
+                            st.session_state.extracted_key = key
+                            st.success("Texto extraído. Continúa a 'Verificación IA'.")
+
+        # --- PÁGINA 2: VERIFICACIÓN IA ---
+        elif st.session_state.page == "Verificación IA":
+            st.header("2. Verificación Médica con IA 🔬")
+            contenido = get_extracted_content()
+            if not contenido: st.warning("Carga un archivo primero."); st.stop()
         
-        st.info(f"Analizando contenido de **{st.session_state.materia_actual} / {st.session_state.sistema_actual}**")
-        st.text_area("Contenido:", st.session_state.extracted_content[:2000]+"...", height=200)
+            st.info(f"Analizando contenido de **{st.session_state.materia_actual} / {st.session_state.sistema_actual}**")
+            st.text_area("Contenido:", contenido[:2000]+"...", height=200)
         
-        if st.button("🔬 Analizar Precisión Científica", type="primary"):
-            if not gemini_model:
-                st.error("❌ Error: No se detectó la API Key de Google en los secrets.")
-                st.stop()
+            mostrar_cola_ia()
+            if st.button("🔬 Analizar Precisión Científica", type="primary"):
+                gemini_model = get_gemini_model()
+                if not gemini_model:
+                    st.error("❌ Error: No se detectó la API Key de Google en los secrets.")
+                    st.stop()
                 
-            prompt = [
-                f"Rol: Profesor de medicina experto en {st.session_state.materia_actual}.",
-                f"Contexto: {st.session_state.materia_actual} - {st.session_state.sistema_actual}.",
-                f"Texto a revisar:\n{st.session_state.extracted_content[:15000]}",
-                "Tarea: Evalúa la precisión científica y claridad.",
-                "Usa formato Markdown:",
-                "- 🟢 Puntos Clave Correctos.",
-                "- 🟡 Ambigüedades o puntos a mejorar.",
-                "- 🔴 Errores potenciales o falta de contexto.",
-                "Provee un resumen ejecutivo para el estudiante."
-            ]
+                prompt = [
+                    f"Rol: Profesor de medicina experto en {st.session_state.materia_actual}.",
+                    f"Contexto: {st.session_state.materia_actual} - {st.session_state.sistema_actual}.",
+                    f"Texto a revisar:\n{contexto_relevante(contenido, CONTEXT_TOKENS_AUDITORIA)}",
+                    "Tarea: Evalúa la precisión científica y claridad.",
+                    "Usa formato Markdown:",
+                    "- 🟢 Puntos Clave Correctos.",
+                    "- 🟡 Ambigüedades o puntos a mejorar.",
+                    "- 🔴 Errores potenciales o falta de contexto.",
+                    "Provee un resumen ejecutivo para el estudiante."
+                ]
             
-            with st.spinner("La IA está auditando el contenido..."):
-                try:
-                    response = gemini_model.generate_content(prompt)
-                    st.markdown("### Informe de Auditoría IA")
-                    st.markdown(response.text)
-                except Exception as e:
-                    st.error(f"Error en análisis: {e}")
-
-    # --- PÁGINA 3: GENERAR EXAMEN ---
-    elif st.session_state.page == "Generar Examen":
-        st.header("3. Generar Flashcards Visuales 🧠")
-        if not st.session_state.extracted_content: st.warning("Carga un archivo primero."); st.stop()
+                with st.spinner("La IA está auditando el contenido..."):
+                    try:
+                        response = gemini_model.generate_content(prompt)
+                        st.markdown("### Informe de Auditoría IA")
+                        st.markdown(response.text)
+                    except Exception as e:
+                        st.error(f"Error en análisis: {e}")
+
+        # --- PÁGINA 3: GENERAR EXAMEN ---
+        elif st.session_state.page == "Generar Examen":
+            st.header("3. Generar Flashcards Visuales 🧠")
+            contenido = get_extracted_content()
+            if not contenido: st.warning("Carga un archivo primero."); st.stop()
         
-        d_name = st.text_input("Nombre del Mazo (ej. Parcial Bioquímica)")
-        num = st.slider("Preguntas", 1, 10, 5)
+            d_name = st.text_input("Nombre del Mazo (ej. Parcial Bioquímica)")
+            num = st.slider("Preguntas", 1, 200, 5)
+            lotes = split_batches(num)
+            if len(lotes) > 1: st.caption(f"Se generará en {len(lotes)} lotes en paralelo (máx. {MAX_CONCURRENCY} a la vez).")
         
-        if st.button("🚀 Crear con Feedback Visual", type="primary"):
-            if not gemini_model:
-                st.error("❌ Error Crítico: No se detectó la API Key.")
-                st.stop()
+            mostrar_cola_ia()
+            if st.button("🚀 Crear con Feedback Visual", type="primary"):
+                gemini_model = get_gemini_model()
+                if not gemini_model:
+                    st.error("❌ Error Crítico: No se detectó la API Key.")
+                    st.stop()
 
-            if not d_name: st.error("Pon un nombre al mazo."); st.stop()
-            restart_exam()
+                if not d_name: st.error("Pon un nombre al mazo."); st.stop()
+                restart_exam()
             
-            # PROMPT MIR/USMLE ESPECIALIZADO
-            prompt = [
-                f"Eres un experto redactor de preguntas para exámenes MIR y USMLE especializado en {st.session_state.materia_actual}.",
-                f"Tema: {st.session_state.sistema_actual}. Nivel Estudiante: {st.session_state.user_level}.",
-                f"Texto base para extraer conceptos:\n{st.session_state.extracted_content[:10000]}...",
-                f"Genera {num} preguntas de opción múltiple.",
-                
-                "ESTILO DE PREGUNTAS (PRIORIDAD MIR/USMLE):",
-                "1. VINETAS CLÍNICAS (80%): Presenta un caso corto (Paciente de X años, síntomas Y...).",
-                "   - Pregunta por el DIAGNÓSTICO, MECANISMO o MANEJO.",
-                "2. RAZONAMIENTO FISIOLÓGICO (Importante):",
-                "   - Incluye preguntas de vectores/cambios: '¿Cómo cambian la Presión Arterial y la RVS?'",
-                "   - Opciones tipo: 'Aumenta / Disminuye', 'No cambia / Aumenta'.",
-                "3. CONCEPTUALES (20%): Definiciones directas si el nivel es Novato.",
-                
-                "IMPORTANTE - FEEDBACK VISUAL Y EDUCATIVO:",
-                "En el campo 'explicacion', la respuesta debe ser una revisión de alto rendimiento:",
-                "- Usa MARKDOWN para Tablas, Listas y Esquemas.",
-                "- Explica por qué la correcta es correcta Y por qué las otras son incorrectas.",
-                
-                "Formato JSON array estricto:",
-                """[{"pregunta": "...", "opciones": {"A": "...", "B": "...", "C": "...", "D": "..."}, "respuesta_correcta": "A", "explicacion": "Markdown rico aquí..."}]"""
-            ]
+                # Cada lote recibe trozos distintos del documento.
+                contextos = select_context_batches(
+                    st.session_state.extracted_key, contenido, st.session_state.materia_actual,
+                    st.session_state.sistema_actual, len(lotes), CONTEXT_TOKENS_GENERACION)
+                prompts = [
+                    build_exam_prompt(st.session_state.materia_actual, st.session_state.sistema_actual,
+                                      st.session_state.user_level, ctx, n)
+                    for ctx, n in zip(contextos, lotes)
+                ]
             
-            with st.spinner("Diseñando caso clínico y preguntas..."):
-                try:
-                    res = gemini_model.generate_content(prompt)
-                    txt = res.text.replace('```json', '').replace('```', '')
-                    data = json.loads(txt[txt.find('['):txt.rfind(']')+1])
-                    
+                barra = st.progress(0.0, text="Diseñando caso clínico y preguntas...")
+                vista_previa = st.container()
+                recibidas, hechos = [], []
+                def nueva_pregunta(n, q):
+                    # Cada pregunta se muestra en cuanto su JSON se cierra, sin esperar al lote entero.
+                    recibidas.append(q)
+                    vista_previa.markdown(f"**{len(recibidas)}.** {q['pregunta']}")
+                    barra.progress(min(len(recibidas) / num, 1.0), text=f"{len(recibidas)}/{num} preguntas listas")
+                def avance(n, total, error):
+                    hechos.append(n)
+                    if error: vista_previa.caption(f"⚠️ Lote {n+1}/{len(prompts)} falló: {error}")
+            
+                with st.spinner("Revisando tu biblioteca..."):
+                    filtro = DedupFilter(get_dedup_index(username))
+                with st.spinner("Diseñando caso clínico y preguntas..."), tracing.span("generacion"):
+                    data, errores = generate_deck(gemini_model, prompts, on_batch=avance, on_question=nueva_pregunta,
+                                                  is_duplicate=filtro)
+                    def prompts_reposicion(extra_lotes, evitar):
+                        extra_ctx = select_context_batches(
+                            st.session_state.extracted_key, contenido, st.session_state.materia_actual,
+                            st.session_state.sistema_actual, len(extra_lotes), CONTEXT_TOKENS_GENERACION)
+                        return [build_exam_prompt(st.session_state.materia_actual, st.session_state.sistema_actual,
+                                                  st.session_state.user_level, ctx, n, avoid=evitar)
+                                for ctx, n in zip(extra_ctx, extra_lotes)]
+                    # Reposición de lo descartado por casi duplicado, pidiendo casos distintos.
+                    mas, mas_errores = refill_deck(gemini_model, num - len(data), filtro.discarded, prompts_reposicion,
+                                                   on_question=nueva_pregunta, is_duplicate=filtro)
+                    data, errores = data + mas, errores + mas_errores
+                if filtro.discarded:
+                    with st.expander(f"♻️ {len(filtro.discarded)} preguntas casi duplicadas descartadas"):
+                        for q, matches in filtro.discarded:
+                            _, sim, mazos = matches[0]
+                            st.caption(f"{q['pregunta'][:160]}… — {sim:.0%} similar ({', '.join(m for m in mazos if m) or 'este mazo'})")
+                
+                espera = get_gemini_client().stats()['ultima_espera_s']
+                if espera >= 1: st.caption(f"⏳ Se esperaron {espera:.1f} s en la cola de la IA (límite de cuota).")
+                if not data:
+                    st.error(f"Error IA: {errores[0][1] if errores else 'respuesta vacía'}")
+                else:
+                    if errores: st.warning(f"{len(errores)} de {len(prompts)} lotes fallaron; se guardan las {len(data)} preguntas generadas.")
+                    fuente = get_source_cache().path(st.session_state.extracted_key)
+                    if fuente and imagenes.cited_pages(data):
+                        with st.spinner("Extrayendo figuras de las páginas citadas..."):
+                            try: con_imagen = imagenes.attach_images(data, fuente, get_image_cache(), get_doc_cache(),
+                                                                     st.session_state.extracted_key)
+                            except Exception as e:
+                                tracing.error("imágenes", e)
+                                con_imagen = 0
+                        if con_imagen: st.caption(f"🖼️ {con_imagen} preguntas con figuras o miniatura de su página.")
                     deck_full_structure = {
                         'preguntas': data,
                         'materia': st.session_state.materia_actual,
@@ -614,97 +1103,127 @@ elif st.session_state["authentication_status"]:
                     }
 
                     if save_user_deck(username, d_name, data, st.session_state.materia_actual, st.session_state.sistema_actual):
-                        if not isinstance(st.session_state.get('flashcard_library'), dict):
-                             st.session_state.flashcard_library = {}
-                        st.session_state.flashcard_library[d_name] = deck_full_structure
+                        if not isinstance(st.session_state.get('deck_index'), dict):
+                             st.session_state.deck_index = {}
+                        st.session_state.deck_index[d_name] = deck_meta(deck_full_structure)
                         st.success("Mazo creado. Vamos a estudiar."); st.balloons()
-                except Exception as e: st.error(f"Error IA: {e}")
 
-    # --- PÁGINA 4: PROGRESO (AUTO-REPARACIÓN) ---
-    elif st.session_state.page == "Mi Progreso":
-        st.header("4. Biblioteca de Estudio 🏆")
+        # --- PÁGINA 4: PROGRESO (AUTO-REPARACIÓN) ---
+        elif st.session_state.page == "Mi Progreso":
+            st.header("4. Biblioteca de Estudio 🏆")
         
-        raw_decks = st.session_state.get("flashcard_library", {})
-        if not isinstance(raw_decks, dict):
-            raw_decks = get_user_decks(username)
-            st.session_state.flashcard_library = raw_decks
+            index = session_deck_index(username)
         
-        if not raw_decks:
-            st.info("No tienes mazos guardados aún.")
-        else:
-            valid_opts = []
-            deck_map = {}
-            corrupted_count = 0
-            
-            for k, v in raw_decks.items():
-                if isinstance(v, dict) and 'preguntas' in v: 
-                    label = f"{k} [{v.get('materia','General')}]"
-                    valid_opts.append(label)
-                    deck_map[label] = k
-                else:
-                    corrupted_count += 1
+            if not index:
+                st.info("No tienes mazos guardados aún.")
+            else:
+                vencidas = get_due_queue(username).count_due()
+                r1, r2 = st.columns([3, 1])
+                r1.markdown(f"#### 🗓️ Repaso del día: {vencidas} tarjetas pendientes")
+                if r2.button("Empezar repaso", disabled=not vencidas):
+                    repaso = build_review_session(username)
+                    if repaso['preguntas']: start_card_session(repaso)
+                    else: st.info("Las tarjetas pendientes pertenecen a mazos que ya no existen.")
+                st.divider()
+                search_panel(username)
+                st.divider()
+
+                # Listado, filtros y paginación sólo sobre el índice (nombre, materia, nº de preguntas).
+                f1, f2 = st.columns([1, 2])
+                materias = ["Todas"] + sorted({m.get('materia', 'General') for m in index.values()})
+                filtro_mat = f1.selectbox("Filtrar por materia", materias)
+                filtro_txt = f2.text_input("Buscar mazo por nombre").strip().lower()
+                nombres = [k for k, m in sorted(index.items(), key=lambda kv: kv[1].get('creado', 0), reverse=True)
+                           if (filtro_mat == "Todas" or m.get('materia') == filtro_mat) and filtro_txt in k.lower()]
             
-            if corrupted_count > 0: st.caption(f"Nota: Se ocultaron {corrupted_count} archivos antiguos incompatibles.")
+                paginas = max(1, -(-len(nombres) // DECKS_PER_PAGE))
+                pagina = st.number_input(f"Página (de {paginas})", 1, paginas, 1) if paginas > 1 else 1
+                visibles = nombres[(pagina - 1) * DECKS_PER_PAGE: pagina * DECKS_PER_PAGE]
 
-            if not valid_opts:
-                st.info("Tu biblioteca está vacía (los archivos anteriores no eran válidos). Crea un nuevo mazo.")
-            else:
-                sel = st.selectbox("Selecciona Mazo", valid_opts)
-                real_name = deck_map[sel]
+                if not visibles:
+                    st.info("Ningún mazo coincide con el filtro.")
+                else:
+                    opciones = {f"{k} [{index[k].get('materia','General')} · {index[k].get('n', 0)} preguntas]": k for k in visibles}
+                    sel = st.selectbox("Selecciona Mazo", list(opciones))
+                    real_name = opciones[sel]
                 
-                c1, c2 = st.columns([1, 4])
-                if c1.button("Estudiar"):
-                    st.session_state.current_exam = raw_decks[real_name]
-                    st.session_state.current_exam['name'] = real_name
-                    st.session_state.page = "Estudiar"
-                    st.rerun()
-                if c1.button("Borrar"):
-                     delete_user_deck(username, real_name)
-                     del st.session_state.flashcard_library[real_name]
-                     st.rerun()
-
-    # --- PÁGINA 5: ESTUDIO ---
-    elif st.session_state.page == "Estudiar":
-        exam = st.session_state.current_exam.get('preguntas', [])
-        materia_examen = st.session_state.current_exam.get('materia', 'General')
-        idx = st.session_state.current_question_index
+                    c1, c2 = st.columns([1, 4])
+                    if c1.button("Estudiar"):
+                        deck = get_user_deck(username, real_name)
+                        if not deck: st.error("No se pudo cargar el mazo.")
+                        else:
+                            restart_exam()
+                            st.session_state.current_exam = dict(deck, name=real_name)
+                            st.session_state.exam_id = uuid.uuid4().hex
+                            st.session_state.page = "Estudiar"
+                            st.rerun()
+                    if c1.button("Borrar"):
+                         delete_user_deck(username, real_name)
+                         st.session_state.deck_index.pop(real_name, None)
+                         st.rerun()
+            st.divider()
+            exchange_panel(username)
+
+        # --- PÁGINA 5: ESTUDIO ---
+        elif st.session_state.page == "Estudiar":
+            exam = st.session_state.current_exam.get('preguntas', [])
+            materia_examen = st.session_state.current_exam.get('materia', 'General')
         
-        if st.button("⬅ Volver"): st.session_state.page = "Mi Progreso"; restart_exam(); st.rerun()
-        if idx < len(exam):
-            q = exam[idx]
-            st.markdown(f"### Pregunta {idx+1}/{len(exam)}")
-            
-            st.markdown(f'<div class="flashcard"><h5>{q["pregunta"]}</h5></div>', unsafe_allow_html=True)
-            
-            ops = list(q['opciones'].values())
-            sel = st.radio("Tu respuesta:", ops, key=f"q{idx}", disabled=st.session_state.show_explanation)
-            if st.button("Responder") and sel:
-                st.session_state.show_explanation = True
-                cor_ltr = q['respuesta_correcta']
-                cor_txt = q['opciones'][cor_ltr]
-                is_ok = (sel == cor_txt)
-                if len(st.session_state.exam_results) <= idx:
-                    st.session_state.exam_results.append({'ok': is_ok, 'sel': sel, 'cor': cor_txt})
-                st.rerun()
-
-            if st.session_state.show_explanation:
-                st.markdown('<div class="feedback-container">', unsafe_allow_html=True)
-                res = st.session_state.exam_results[idx]
-                if res['ok']: st.markdown('<div class="feedback-correct">✅ ¡EXCELENTE! RESPUESTA CORRECTA</div>', unsafe_allow_html=True)
-                else: st.markdown(f'<div class="feedback-incorrect">❌ INCORRECTO. RESPUESTA REAL: {res["cor"]}</div>', unsafe_allow_html=True)
-                st.markdown(f'<div class="feedback-explanation">{q["explicacion"]}</div>', unsafe_allow_html=True)
-                st.markdown('</div>', unsafe_allow_html=True) 
-                st.write("") 
-                if st.button("Siguiente ➡"): go_to_next_question(); st.rerun()
-        else:
-            st.balloons()
-            score = sum(1 for r in st.session_state.exam_results if r['ok'])
-            final = (score / len(exam)) * 100
-            st.metric("Resultado Final", f"{final:.0f}%")
-            nl, msg = update_user_level(username, materia_examen, final >= 80)
-            if msg: st.success(msg)
-            if materia_examen == st.session_state.materia_actual:
-                st.session_state.user_level = nl if nl else st.session_state.user_level
+            if st.button("⬅ Volver"): st.session_state.page = "Mi Progreso"; restart_exam(); st.rerun()
+            if st.session_state.current_question_index < len(exam):
+                study_card(username)
+            else:
+                st.balloons()
+                score = sum(1 for r in st.session_state.exam_results if r['ok'])
+                final = (score / len(exam)) * 100
+                st.metric("Resultado Final", f"{final:.0f}%")
+                if st.session_state.current_exam.get('repaso'):
+                    st.caption("Cada respuesta ya reprogramó su tarjeta. ¡Vuelve mañana!")
+                elif st.session_state.current_exam.get('libre'):
+                    st.caption("Sesión libre: tus respuestas cuentan para el repaso y las estadísticas, no para el nivel.")
+                else:
+                    if not st.session_state.exam_id: st.session_state.exam_id = uuid.uuid4().hex
+                    nl, msg = update_user_level(username, materia_examen, final >= 80, st.session_state.exam_id)
+                    if msg: st.success(msg)
+                    if materia_examen == st.session_state.materia_actual:
+                        st.session_state.user_level = nl if nl else st.session_state.user_level
+
+        elif st.session_state.page == "Estadísticas":
+            st.header("5. Estadísticas 📊")
+            rows = get_attempt_rollups(username)
+            if not rows: st.info("Responde algún examen para ver tus estadísticas.")
+            else:
+                df = analytics.frame(rows)
+                total, aciertos = int(df['n'].sum()), int(df['ok'].sum())
+                m1, m2, m3 = st.columns(3)
+                m1.metric("Respuestas", f"{total:,}")
+                m2.metric("Precisión", f"{100 * aciertos / total:.0f}%")
+                m3.metric("Tiempo medio", f"{df['lat_ms'].sum() / total / 1000:.1f} s")
+
+                por_materia = analytics.accuracy_by(df, 'materia')
+                st.plotly_chart(px.bar(por_materia, x='precision', y='materia', orientation='h', hover_data=['n', 'lat_media_s'],
+                                       range_x=[0, 100], labels={'precision': 'Precisión (%)', 'materia': ''},
+                                       title="Precisión por materia"), use_container_width=True)
+
+                mapa = analytics.heatmap(df)
+                st.plotly_chart(px.imshow(mapa, color_continuous_scale='RdYlGn', zmin=0, zmax=100, text_auto='.0f', aspect='auto',
+                                          labels={'color': 'Precisión (%)', 'x': 'Sistema', 'y': 'Materia'},
+                                          title="Mapa de temas débiles"), use_container_width=True)
+
+                c1, c2 = st.columns([3, 1])
+                materia_f = c2.selectbox("Materia", ["Todas"] + sorted(df['materia'].unique()))
+                freq = c2.radio("Agrupar por", ["Día", "Semana", "Mes"], horizontal=False)
+                serie = analytics.trend(df, {"Día": 'D', "Semana": 'W', "Mes": 'MS'}[freq], None if materia_f == "Todas" else materia_f)
+                c1.plotly_chart(px.line(serie, x='dia', y='precision', markers=True, hover_data=['n'], range_y=[0, 100],
+                                        labels={'precision': 'Precisión (%)', 'dia': ''}, title="Evolución"), use_container_width=True)
+
+                debiles = analytics.weakest(df)
+                if not debiles.empty:
+                    st.markdown("#### 🎯 A reforzar")
+                    st.dataframe(debiles[['materia', 'sistema', 'n', 'precision', 'lat_media_s']], hide_index=True,
+                                 use_container_width=True)
 
 elif st.session_state["authentication_status"] is False:
     st.error("Credenciales inválidas")
+
+tracing.end_trace(st.session_state._trace)
@@ -0,0 +1 @@
+# Módulos de soporte de Med-Flash AI (estado compartido por proceso, fuera del script de Streamlit).
@@ -0,0 +1,88 @@
+# --- ANALÍTICA DE INTENTOS ---
+# Cada respuesta es un evento compacto que sólo se añade (nunca se reescribe). El panel no
+# recorre esos eventos: lee rollups (materia, sistema, día) -> contadores que se incrementan
+# con cada lote de respuestas, y el lote se agrega con pandas en forma columnar.
+import time
+
+from medflash import deps
+
+pd = deps.lazy_module("pandas")
+
+EVENT_FIELDS = ('ts', 'deck', 'card_id', 'opcion', 'ok', 'lat_ms', 'materia', 'sistema')
+ROLLUP_FIELDS = ('materia', 'sistema', 'dia', 'n', 'ok', 'lat_ms')
+KEY_SEP = "|"
+
+
+def make_event(deck, card_id, opcion, ok, latency, materia, sistema, ts=None):
+    return (ts if ts is not None else time.time(), deck, card_id, opcion, bool(ok),
+            int(latency * 1000), materia or 'General', sistema or 'General')
+
+
+def to_columns(events):
+    """Lista de eventos -> {campo: [valores]} (lo que se guarda por lote)."""
+    return {f: [e[i] for e in events] for i, f in enumerate(EVENT_FIELDS)}
+
+
+def rollup_deltas(events):
+    """Incrementos [materia, sistema, dia, n, ok, lat_ms] de un lote de eventos."""
+    if not events: return []
+    df = pd.DataFrame(to_columns(events))
+    df['dia'] = pd.to_datetime(df['ts'], unit='s').dt.strftime('%Y-%m-%d')
+    g = df.groupby(['materia', 'sistema', 'dia'], sort=False).agg(n=('ok', 'size'), ok=('ok', 'sum'), lat_ms=('lat_ms', 'sum'))
+    return [[m, s, d, int(n), int(ok), int(lat)] for (m, s, d), (n, ok, lat) in zip(g.index, g.itertuples(index=False))]
+
+
+def rollup_key(materia, sistema, dia):
+    return KEY_SEP.join((materia, sistema, dia))
+
+
+def split_key(key):
+    materia, sistema, dia = key.rsplit(KEY_SEP, 2)
+    return materia, sistema, dia
+
+
+def merge_rollups(rows, deltas):
+    """Suma incrementos a una lista de rollups ya cargada (caché de la sesión)."""
+    acc = {tuple(r[:3]): list(r) for r in rows}
+    for d in deltas:
+        row = acc.setdefault(tuple(d[:3]), list(d[:3]) + [0, 0, 0])
+        for i in (3, 4, 5): row[i] += d[i]
+    return list(acc.values())
+
+
+# --- Agregados para el panel (sobre los rollups, no sobre los eventos) ---
+def frame(rows):
+    df = pd.DataFrame(rows, columns=list(ROLLUP_FIELDS))
+    df['dia'] = pd.to_datetime(df['dia'])
+    return df
+
+
+def _with_accuracy(g):
+    g = g.reset_index()
+    g['precision'] = (100 * g['ok'] / g['n']).round(1)
+    g['lat_media_s'] = (g['lat_ms'] / g['n'] / 1000).round(1)
+    return g
+
+
+def accuracy_by(df, col):
+    return _with_accuracy(df.groupby(col)[['n', 'ok', 'lat_ms']].sum()).sort_values('precision')
+
+
+def heatmap(df, min_attempts=1):
+    """Matriz materia x sistema de precisión (%); NaN donde hay menos de min_attempts intentos."""
+    g = df.groupby(['materia', 'sistema'])[['n', 'ok']].sum()
+    acc = (100 * g['ok'] / g['n']).where(g['n'] >= min_attempts)
+    return acc.unstack('sistema')
+
+
+def trend(df, freq='D', materia=None):
+    if materia: df = df[df['materia'] == materia]
+    g = df.set_index('dia')[['n', 'ok', 'lat_ms']].resample(freq).sum()
+    g = g[g['n'] > 0]
+    return _with_accuracy(g)
+
+
+def weakest(df, n=5, min_attempts=10):
+    """Temas (materia, sistema) con peor precisión y suficientes intentos."""
+    g = accuracy_by(df, ['materia', 'sistema'])
+    return g[g['n'] >= min_attempts].head(n)
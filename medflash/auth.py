@@ -0,0 +1,81 @@
+# --- CREDENCIALES BAJO DEMANDA ---
+# El script de Streamlit se re-ejecuta en cada click; este módulo se importa una sola vez
+# por proceso, así que el índice vive aquí y lo comparten todas las sesiones.
+import threading
+import time
+
+CREDENTIAL_FIELDS = ['name', 'email', 'password']
+
+
+def normalize_username(username):
+    # streamlit_authenticator pasa el usuario tecleado a minúsculas antes de buscarlo.
+    return username.strip().lower()
+
+
+class CredentialIndex:
+    """Índice username -> {name, email, password} con TTL, compartido por el proceso."""
+
+    def __init__(self, ttl=300.0, negative_ttl=30.0):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = {}  # username -> (expira_en, registro | None)
+        self.version = 0  # sube en cada invalidación; las sesiones reconstruyen su authenticator
+        self._lock = threading.Lock()
+
+    def lookup(self, username, loader):
+        now = time.monotonic()
+        with self._lock:
+            hit = self._entries.get(username)
+        if hit and hit[0] > now:
+            return hit[1]
+        record = loader(username)
+        ttl = self.ttl if record else self.negative_ttl
+        with self._lock:
+            self._entries[username] = (now + ttl, record)
+        return record
+
+    def put(self, username, record):
+        with self._lock:
+            self._entries[username] = (time.monotonic() + self.ttl, record)
+
+    def invalidate(self, username=None):
+        with self._lock:
+            if username is None: self._entries.clear()
+            else: self._entries.pop(username, None)
+            self.version += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class LazyUsernames(dict):
+    """
+    Sustituto de credentials['usernames'] para streamlit_authenticator: en vez de cargar
+    todos los usuarios, resuelve cada username la primera vez que el login lo consulta.
+    """
+
+    def __init__(self, resolver, seed=None):
+        super().__init__(seed or {})
+        self._resolver = resolver
+
+    def _resolve(self, username):
+        if not isinstance(username, str) or not username.strip(): return None
+        record = self._resolver(normalize_username(username))
+        if record is None: return None
+        # Copia propia: stauth escribe 'logged_in'/'failed_login_attempts' sobre el registro.
+        entry = dict(record)
+        entry.setdefault('logged_in', False)
+        super().__setitem__(username, entry)
+        return entry
+
+    def __contains__(self, username):
+        return super().__contains__(username) or self._resolve(username) is not None
+
+    def __missing__(self, username):
+        entry = self._resolve(username)
+        if entry is None: raise KeyError(username)
+        return entry
+
+    def get(self, username, default=None):
+        try: return self[username]
+        except KeyError: return default
@@ -0,0 +1,263 @@
+# --- GENERACIÓN DE MAZOS POR LOTES (SIN INTERFAZ) ---
+# Recorre una carpeta de PDF/PPTX y crea un mazo por archivo con el mismo extractor, el mismo
+# prompt MIR/USMLE y el mismo backend de almacenamiento que la app. La extracción corre en un
+# pool de procesos y la generación en un pool acotado de hilos que comparten un GeminiClient
+# (cuota, reintentos). Cada archivo terminado se apunta en un checkpoint JSONL, así que una
+# ejecución interrumpida continúa donde se quedó.
+#
+#   python -m medflash.batch apuntes/ --user profe --materia Cardiología --preguntas 30
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from medflash import deps, imagenes, srs
+from medflash import write_queue as wq
+from medflash.biblioteca import IndexRegistry
+from medflash.contexto import select_context_batches
+from medflash.dedup import DedupFilter, NearDuplicateIndex
+from medflash.doc_cache import DocumentCache
+from medflash.extraccion import PDF_MAX_WORKERS, extraer_texto_pdf, extraer_texto_pptx
+from medflash.generacion import (CONTEXT_TOKENS_GENERACION, MAX_CONCURRENCY, build_exam_prompt,
+                                 generate_deck, split_batches)
+from medflash.llm_cache import CachedModel, ResponseCache
+from medflash.llm_client import DEFAULT_RPM, DEFAULT_TPM, GeminiClient
+from medflash.storage import DEFAULT_SQLITE_PATH, FirestoreBackend, SQLiteBackend
+
+genai = deps.lazy_module("google.generativeai")
+firebase_admin = deps.lazy_module("firebase_admin")
+credentials = deps.lazy_module("firebase_admin.credentials")
+firestore = deps.lazy_module("firebase_admin.firestore")
+
+EXTENSIONS = (".pdf", ".pptx")
+DEFAULT_MODEL = "gemini-2.5-flash-preview-09-2025"
+DEFAULT_LEVEL = "Nivel 2 (Estudiante)"
+CHECKPOINT_NAME = ".medflash_batch.jsonl"
+
+
+def find_files(root):
+    found = []
+    for dirpath, dirnames, files in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        found += [os.path.join(dirpath, f) for f in sorted(files) if f.lower().endswith(EXTENSIONS)]
+    return found
+
+
+def file_signature(path):
+    st_ = os.stat(path)
+    return [st_.st_size, st_.st_mtime_ns]
+
+
+def extract_file(path, pages=None):
+    # Corre en un proceso del pool; el PDF se lee en serie dentro del proceso (workers=1).
+    t0, count = time.perf_counter(), [0]
+    def contar(*_): count[0] += 1
+    if path.lower().endswith(".pdf"): text = extraer_texto_pdf(path, pages=pages, on_page=contar, workers=1)
+    else: text = extraer_texto_pptx(path, on_slide=contar)
+    return text, count[0], time.perf_counter() - t0
+
+
+class Checkpoint:
+    """JSONL sólo-añadir: la última línea de cada archivo manda."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as fh:
+                for line in fh:
+                    try: rec = json.loads(line)
+                    except ValueError: continue
+                    self.entries[rec["file"]] = rec
+
+    def done(self, rel, signature):
+        rec = self.entries.get(rel)
+        return bool(rec) and rec.get("status") == "ok" and rec.get("sig") == signature
+
+    def record(self, rel, **data):
+        rec = dict(data, file=rel, at=time.time())
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                fh.flush()
+                os.fsync(fh.fileno())
+            self.entries[rel] = rec
+
+
+def save_deck(storage, username, name, preguntas, materia, sistema, known_cards):
+    """
+    Lo mismo que save_user_deck en la app: mazo + tarjetas nuevas en la cola de repaso.
+    known_cards: {card_id: estado} ya programadas (se actualiza); las que ya estaban suman el mazo.
+    """
+    deck = {'preguntas': preguntas, 'materia': materia, 'sistema': sistema, 'creado': str(time.time())}
+    storage.save_deck(username, name, deck)
+    now = time.time()
+    nuevas = {}
+    for cid in map(srs.card_id, preguntas):
+        state = known_cards.get(cid)
+        new = srs.new_state(name, now) if state is None else srs.with_deck(state, name)
+        if new is not state: nuevas[cid] = new
+    if nuevas:
+        storage.save_card_states(username, nuevas)
+        known_cards.update(nuevas)
+    return deck
+
+
+def open_storage(args):
+    if args.backend == "sqlite": return SQLiteBackend(args.sqlite), None
+    cred = args.firebase_cred or os.environ.get("FIREBASE_SERVICE_ACCOUNT")
+    if not cred: sys.exit("Firestore necesita --firebase-cred o FIREBASE_SERVICE_ACCOUNT.")
+    cred = json.loads(cred) if cred.lstrip().startswith("{") else cred
+    if not firebase_admin._apps: firebase_admin.initialize_app(credentials.Certificate(cred))
+    db = firestore.client()
+    queue = wq.WriteBehindQueue(db)
+    return FirestoreBackend(db, queue), queue
+
+
+def open_model(args):
+    if args.fake:
+        from benchmarks.fakes import FakeModel  # sólo con el árbol del repo (no va en el paquete)
+        base = FakeModel(n=10, latency=0.2, seed=1)
+    else:
+        api_key = args.api_key or os.environ.get("GOOGLE_API_KEY")
+        if not api_key: sys.exit("Falta la API key de Gemini (--api-key o GOOGLE_API_KEY).")
+        genai.configure(api_key=api_key)
+        base = genai.GenerativeModel(model_name=args.model)
+    client = GeminiClient(base, args.model, rpm=args.rpm, tpm=args.tpm, max_concurrency=args.workers * MAX_CONCURRENCY)
+    return CachedModel(client, ResponseCache(), args.model), client
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m medflash.batch", description="Genera un mazo por cada PDF/PPTX de una carpeta.")
+    p.add_argument("carpeta")
+    p.add_argument("--user", required=True, help="usuario dueño de los mazos")
+    p.add_argument("--materia", default="General")
+    p.add_argument("--sistema", default="General")
+    p.add_argument("--nivel", default=DEFAULT_LEVEL)
+    p.add_argument("--preguntas", type=int, default=20, help="preguntas por archivo")
+    p.add_argument("--paginas", default=None, help="rango de páginas de cada PDF, p.ej. '1-80'")
+    p.add_argument("--prefijo", default="", help="prefijo del nombre de cada mazo")
+    p.add_argument("--extract-workers", type=int, default=PDF_MAX_WORKERS, help="procesos de extracción")
+    p.add_argument("--workers", type=int, default=2, help="archivos generándose a la vez")
+    p.add_argument("--rpm", type=int, default=DEFAULT_RPM)
+    p.add_argument("--tpm", type=int, default=DEFAULT_TPM)
+    p.add_argument("--model", default=DEFAULT_MODEL)
+    p.add_argument("--api-key", default=None)
+    p.add_argument("--fake", action="store_true", help="modelo local de prueba (sin llamadas a Gemini)")
+    p.add_argument("--backend", choices=("sqlite", "firestore"), default="sqlite")
+    p.add_argument("--sqlite", default=DEFAULT_SQLITE_PATH)
+    p.add_argument("--firebase-cred", default=None, help="ruta o JSON de la cuenta de servicio")
+    p.add_argument("--checkpoint", default=None, help=f"por defecto <carpeta>/{CHECKPOINT_NAME}")
+    p.add_argument("--sin-dedup", action="store_true", help="no filtrar casi-duplicados de la biblioteca")
+    p.add_argument("--sin-imagenes", action="store_true",
+                   help="no adjuntar figuras de las páginas citadas (van a la caché de imágenes local)")
+    return p.parse_args(argv)
+
+
+def run(args):
+    root = os.path.abspath(args.carpeta)
+    checkpoint = Checkpoint(args.checkpoint or os.path.join(root, CHECKPOINT_NAME))
+    files = [(f, os.path.relpath(f, root), file_signature(f)) for f in find_files(root)]
+    todo = [(f, rel, sig) for f, rel, sig in files if not checkpoint.done(rel, sig)]
+    print(f"{len(files)} archivos · {len(files) - len(todo)} ya hechos · {len(todo)} pendientes")
+    if not todo: return 0
+
+    storage, queue = open_storage(args)
+    model, client = open_model(args)
+    known_cards = storage.get_card_states(args.user)
+    registry = library = None
+    if not args.sin_dedup:
+        registry = IndexRegistry(DocumentCache(namespace="dedup", memory_items=0), NearDuplicateIndex, "dedup")
+        library = registry.get(args.user, storage.get_deck_index(args.user), lambda n: storage.get_deck(args.user, n))
+    images = None if args.sin_imagenes else imagenes.image_cache()
+    totals = {"ok": 0, "paginas": 0, "t_extraccion": 0.0, "preguntas": 0, "duplicadas": 0, "errores": 0}
+    save_lock = threading.Lock()
+
+    def generate(path, rel, sig, text, n_pages):
+        t0 = time.perf_counter()
+        lotes = split_batches(args.preguntas)
+        contextos = select_context_batches(rel, text, args.materia, args.sistema, len(lotes), CONTEXT_TOKENS_GENERACION)
+        prompts = [build_exam_prompt(args.materia, args.sistema, args.nivel, ctx, n) for ctx, n in zip(contextos, lotes)]
+        filtro = DedupFilter(library) if library is not None else None
+        data, errores = generate_deck(model, prompts, is_duplicate=filtro)
+        if not data: raise RuntimeError(errores[0][1] if errores else "respuesta vacía")
+        if images is not None and path.lower().endswith(".pdf"): imagenes.attach_images(data, path, images)
+        name = args.prefijo + os.path.splitext(rel)[0].replace(os.sep, " / ")
+        with save_lock:
+            save_deck(storage, args.user, name, data, args.materia, args.sistema, known_cards)
+            if library is not None: registry.on_save(args.user, name, data, {'materia': args.materia, 'sistema': args.sistema})
+        return name, len(data), len(filtro.discarded) if filtro else 0, len(errores), time.perf_counter() - t0
+
+    t_start = time.perf_counter()
+    ctx = multiprocessing.get_context("spawn")
+    extract_pool = ProcessPoolExecutor(max_workers=max(1, args.extract_workers), mp_context=ctx)
+    gen_pool = ThreadPoolExecutor(max_workers=max(1, args.workers))
+    pending = {extract_pool.submit(extract_file, f, args.paginas): ("extraer", f, rel, sig) for f, rel, sig in todo}
+    hechos = 0
+    try:
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                stage, f, rel, sig = pending.pop(fut)
+                try: result = fut.result()
+                except Exception as e: result = e
+                if stage == "extraer":
+                    if isinstance(result, Exception) or result[0].startswith(("Error PDF:", "Error PPTX:")):
+                        error = result if isinstance(result, Exception) else result[0]
+                        hechos += 1; totals["errores"] += 1
+                        checkpoint.record(rel, status="error", sig=sig, error=str(error))
+                        print(f"✗ [{hechos}/{len(todo)}] {rel}: {error}")
+                        continue
+                    text, n_pages, secs = result
+                    totals["paginas"] += n_pages; totals["t_extraccion"] += secs
+                    print(f"· {rel}: {n_pages} págs extraídas en {secs:.1f} s")
+                    pending[gen_pool.submit(generate, f, rel, sig, text, n_pages)] = ("generar", f, rel, sig)
+                    continue
+                hechos += 1
+                if isinstance(result, Exception):
+                    totals["errores"] += 1
+                    checkpoint.record(rel, status="error", sig=sig, error=str(result))
+                    print(f"✗ [{hechos}/{len(todo)}] {rel}: {result}")
+                    continue
+                name, n, dups, lotes_fallidos, secs = result
+                totals["ok"] += 1; totals["preguntas"] += n; totals["duplicadas"] += dups
+                checkpoint.record(rel, status="ok", sig=sig, deck=name, preguntas=n)
+                extra = (f" · {dups} duplicadas descartadas" if dups else "") + (f" · {lotes_fallidos} lotes fallidos" if lotes_fallidos else "")
+                print(f"✓ [{hechos}/{len(todo)}] {rel} → '{name}': {n} preguntas en {secs:.1f} s{extra}")
+    except KeyboardInterrupt:
+        print("\nInterrumpido: los archivos terminados quedan en el checkpoint; vuelve a lanzar para continuar.")
+        for fut in pending: fut.cancel()
+        return 130
+    finally:
+        extract_pool.shutdown(wait=False, cancel_futures=True)
+        gen_pool.shutdown(wait=False, cancel_futures=True)
+        if registry is not None: registry.flush()
+        if queue:
+            print("Enviando escrituras pendientes a Firestore...")
+            queue.flush(timeout=60)
+            queue.close()
+
+    wall = time.perf_counter() - t_start
+    e = client.stats()
+    print("\n--- Resumen ---")
+    print(f"Archivos: {totals['ok']} ok de {len(todo)} · {totals['errores']} con error")
+    if totals["t_extraccion"]:
+        print(f"Extracción: {totals['paginas']} páginas · {totals['paginas'] / totals['t_extraccion']:.1f} págs/s por proceso"
+              f" · {totals['paginas'] / wall:.1f} págs/s en total")
+    print(f"Generación: {totals['preguntas']} preguntas · {totals['preguntas'] / (wall / 60):.1f} preguntas/min"
+          + (f" · {totals['duplicadas']} duplicadas descartadas" if totals['duplicadas'] else ""))
+    print(f"IA: {e['llamadas']} llamadas · {e['reintentos']} reintentos · {e['errores']} errores · tiempo total {wall:.1f} s")
+    return 1 if totals["errores"] else 0
+
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# --- ÍNDICES DERIVADOS DE LA BIBLIOTECA DE MAZOS ---
+# Estructuras por usuario que se calculan a partir de todas sus preguntas (casi-duplicados,
+# búsqueda). Se comparten en el proceso, se guardan como instantánea en la caché de disco y
+# se mantienen al guardar/borrar mazos, así que no se reconstruyen en cada login.
+import atexit
+import hashlib
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from medflash import tracing
+from medflash.shards import CorruptShard
+
+PERSIST_DELAY = 5.0  # s: los cambios seguidos de un índice se guardan en una sola instantánea
+
+
+class IndexRegistry:
+    """
+    factory() crea un índice vacío y factory.loads(texto) lo restaura; el índice expone
+    deck_names(), add_deck(nombre, preguntas, meta), remove_deck(nombre) y dumps().
+    El primero de cada usuario sale de la instantánea y se concilia con el índice de mazos:
+    sólo se descargan los mazos que faltan. Los cambios marcan el índice como sucio y la
+    instantánea se reescribe pasados persist_delay segundos (o al salir de deferred()).
+    """
+
+    def __init__(self, cache, factory, name, persist_delay=PERSIST_DELAY):
+        self.cache = cache
+        self.factory = factory
+        self.name = name
+        self.persist_delay = persist_delay
+        self._lock = threading.Lock()
+        self._indices = {}
+        self._user_locks = {}        # usuario -> RLock de su conciliación y sus cambios
+        self._dirty = set()
+        self._deferred = Counter()   # usuario -> deferred() abiertos
+        self._timer = None
+        atexit.register(self.flush)
+
+    def _key(self, username):
+        return hashlib.sha256(f"{self.name}:{username}".encode("utf-8")).hexdigest()
+
+    def _user_lock(self, username):
+        with self._lock: return self._user_locks.setdefault(username, threading.RLock())
+
+    def _persist(self, username):
+        with self._user_lock(username):
+            with self._lock:
+                if username not in self._dirty: return
+                self._dirty.discard(username)
+            self.cache.put(self._key(username), self._indices[username].dumps())
+
+    def _mark_dirty(self, username):
+        with self._lock:
+            self._dirty.add(username)
+            if self._deferred[username] or self._timer is not None: return
+            self._timer = threading.Timer(self.persist_delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Guarda ya las instantáneas sucias (menos las de usuarios dentro de deferred())."""
+        with self._lock:
+            self._timer = None
+            users = [u for u in self._dirty if not self._deferred[u]]
+        for username in users: self._persist(username)
+
+    @contextmanager
+    def deferred(self, username):
+        """Mientras dura, los cambios del índice de username no se guardan; al salir, una vez."""
+        with self._lock: self._deferred[username] += 1
+        try: yield
+        finally:
+            with self._lock:
+                self._deferred[username] -= 1
+                done = not self._deferred[username]
+            if done: self._persist(username)
+
+    def get(self, username, deck_index, load_deck):
+        """deck_index: {nombre: meta} actual del usuario; load_deck(nombre) -> mazo o None."""
+        # Con el cerrojo del usuario, dos sesiones suyas no concilian (ni añaden un mazo) a la vez.
+        with self._user_lock(username):
+            index = self._indices.get(username)
+            if index is None:
+                snapshot = self.cache.get(self._key(username))
+                index = self._indices[username] = self.factory.loads(snapshot) if snapshot else self.factory()
+            indexed, current = index.deck_names(), set(deck_index)
+            for name in indexed - current: index.remove_deck(name)
+            for name in current - indexed:
+                deck = load_deck(name)
+                try:
+                    if deck: index.add_deck(name, deck.get('preguntas', []), deck_index[name])
+                except CorruptShard as e: tracing.error(f"índice {self.name}", e)  # se reintenta en la próxima conciliación
+            if indexed != current: self._mark_dirty(username)
+        return index
+
+    def loaded(self, username):
+        """Índice ya en memoria (sin conciliar) o None."""
+        return self._indices.get(username)
+
+    def on_save(self, username, name, preguntas, meta):
+        with self._user_lock(username):
+            index = self._indices.get(username)
+            if index is None: return  # se conciliará al cargarse
+            index.remove_deck(name)
+            index.add_deck(name, preguntas, meta)
+            self._mark_dirty(username)
+
+    def on_delete(self, username, name):
+        with self._user_lock(username):
+            index = self._indices.get(username)
+            if index is None: return
+            index.remove_deck(name)
+            self._mark_dirty(username)
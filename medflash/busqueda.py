@@ -0,0 +1,126 @@
+# --- BÚSQUEDA DE TEXTO COMPLETO EN LA BIBLIOTECA ---
+# Índice invertido término -> {tarjeta: peso} sobre enunciado, opciones y explicación,
+# insensible a tildes y mayúsculas ("Válvula" = "valvula"). La última palabra de la consulta
+# se trata como prefijo (búsqueda mientras se escribe) con bisect sobre el vocabulario
+# ordenado. Se mantiene al guardar/borrar mazos (ver medflash/biblioteca.py).
+import bisect
+import heapq
+import json
+import math
+import re
+import threading
+from collections import Counter
+
+from medflash.contexto import STOPWORDS, normalize
+from medflash.srs import card_id
+
+FIELD_WEIGHTS = (("pregunta", 3), ("opciones", 1), ("explicacion", 1))
+MAX_PREFIX_TERMS = 64   # expansiones como máximo de la palabra incompleta
+SNIPPET_CHARS = 160
+
+
+def terms(text):
+    return [t for t in re.findall(r"\w+", normalize(str(text))) if len(t) > 1 and t not in STOPWORDS]
+
+
+def card_terms(q):
+    weights = Counter()
+    for field, w in FIELD_WEIGHTS:
+        value = q.get(field, "")
+        if isinstance(value, dict): value = " ".join(str(v) for v in value.values())
+        for t in terms(value): weights[t] += w
+    return weights
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.docs = {}       # doc -> [mazo, card_id, fragmento, materia, sistema]
+        self.by_deck = {}    # mazo -> [doc]
+        self.postings = {}   # término -> {doc: peso}
+        self.vocab = []      # términos ordenados (prefijos)
+        self._next = 0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def deck_names(self):
+        with self._lock: return set(self.by_deck)
+
+    def _add_posting(self, term, doc, weight):
+        plist = self.postings.get(term)
+        if plist is None:
+            plist = self.postings[term] = {}
+            bisect.insort(self.vocab, term)
+        plist[doc] = weight
+
+    def add_deck(self, deck, preguntas, meta=None):
+        meta = meta or {}
+        prepared = [(q, card_terms(q)) for q in preguntas]
+        with self._lock:
+            docs = self.by_deck.setdefault(deck, [])
+            for q, weights in prepared:
+                doc, self._next = self._next, self._next + 1
+                self.docs[doc] = [deck, card_id(q), str(q.get("pregunta", ""))[:SNIPPET_CHARS],
+                                  meta.get("materia", "General"), meta.get("sistema", "General")]
+                docs.append(doc)
+                for t, w in weights.items(): self._add_posting(t, doc, w)
+
+    def remove_deck(self, deck):
+        with self._lock:
+            docs = set(self.by_deck.pop(deck, []))
+            if not docs: return
+            for doc in docs: del self.docs[doc]
+            for t in [t for t, plist in self.postings.items() if docs.intersection(plist)]:
+                plist = self.postings[t]
+                for doc in docs.intersection(plist): del plist[doc]
+                if not plist:
+                    del self.postings[t]
+                    del self.vocab[bisect.bisect_left(self.vocab, t)]
+
+    def _prefix(self, prefix):
+        i = bisect.bisect_left(self.vocab, prefix)
+        out = []
+        while i < len(self.vocab) and self.vocab[i].startswith(prefix) and len(out) < MAX_PREFIX_TERMS:
+            out.append(self.vocab[i]); i += 1
+        return out
+
+    def search(self, query, limit=50, prefix=True):
+        """
+        Todas las palabras deben aparecer (la última, como prefijo si prefix). Devuelve
+        (total, [(puntuación, mazo, card_id, fragmento, materia, sistema)]) ordenado.
+        """
+        words = terms(query)
+        if not words: return 0, []
+        with self._lock:
+            n_docs = max(len(self.docs), 1)
+            groups = [[w] for w in words]
+            if prefix and query[-1:].isalnum(): groups[-1] = self._prefix(words[-1]) or [words[-1]]
+            # Primero se intersecan los conjuntos (en C) y sólo se puntúan las tarjetas que quedan.
+            lists = [[self.postings[t] for t in group if t in self.postings] for group in groups]
+            if not all(lists): return 0, []
+            sets = [set(pl[0]) if len(pl) == 1 else set().union(*pl) for pl in lists]
+            sets.sort(key=len)
+            hits = sets[0].intersection(*sets[1:])
+            weights = [(plist, math.log(1 + n_docs / len(plist))) for pl in lists for plist in pl]
+            scores = {d: sum(plist.get(d, 0) * idf for plist, idf in weights) for d in hits}
+            best = heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+            return len(hits), [(round(sc, 2), *self.docs[d]) for d, sc in best]
+
+    # --- Instantánea ---
+    def dumps(self):
+        with self._lock:
+            return json.dumps({"docs": self.docs, "by_deck": self.by_deck, "next": self._next,
+                               "postings": {t: [list(p), list(p.values())] for t, p in self.postings.items()}},
+                              ensure_ascii=False)
+
+    @classmethod
+    def loads(cls, text):
+        data = json.loads(text)
+        index = cls()
+        index.docs = {int(d): v for d, v in data["docs"].items()}
+        index.by_deck = data["by_deck"]
+        index._next = data["next"]
+        index.postings = {t: dict(zip(docs, ws)) for t, (docs, ws) in data["postings"].items()}
+        index.vocab = sorted(index.postings)
+        return index
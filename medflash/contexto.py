@@ -0,0 +1,182 @@
+# --- SELECCIÓN DE CONTEXTO POR RELEVANCIA ---
+# En lugar de mandar los primeros N caracteres del documento, se trocea el texto, se indexa
+# con BM25 (NumPy) y se rellena el prompt con los trozos que mejor puntúan para la
+# materia/sistema elegidos, hasta un presupuesto de tokens.
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict
+
+from medflash import deps
+from medflash.extraccion import PAGE_MARK, PAGE_MARK_RE
+
+np = deps.lazy_module("numpy")
+
+CHARS_PER_TOKEN = 4  # aproximación suficiente para presupuestar texto en español
+CHUNK_CHARS = 1200
+
+STOPWORDS = set("""
+de la que el en y a los del se las por un para con no una su al lo como mas pero sus le ya o
+este si porque esta entre cuando muy sin sobre tambien me hasta hay donde quien desde todo nos
+durante todos uno les ni contra otros ese eso ante ellos e esto mi antes algunos que unos yo otro
+otras otra el tanto esa estos mucho quienes nada muchos cual poco ella estar estas algunas algo
+nosotros es son ser fue puede pueden cada pag the of and to in is
+""".split())
+
+# Términos que suelen aparecer en el texto de cada sistema aunque no se nombre literalmente.
+EXPANSION = {
+    "Cardiovascular": "corazon cardiaco miocardio arteria arterial vena presion coronario ventriculo auricula",
+    "Respiratorio": "pulmon pulmonar alveolo bronquio ventilacion respiracion oxigeno disnea",
+    "Nervioso Central": "cerebro encefalo medula neurona cortex sinapsis cerebelo",
+    "Nervioso Periférico": "nervio periferico axon mielina sensitivo motor placa",
+    "Digestivo": "estomago intestino higado hepatico pancreas colon esofago gastrico",
+    "Renal (Urinario)": "riñon renal nefrona glomerulo orina tubulo filtracion",
+    "Musculoesquelético": "musculo hueso articulacion tendon esqueletico oseo",
+    "Endocrino": "hormona glandula tiroides insulina suprarrenal hipofisis",
+    "Hematológico": "sangre eritrocito hemoglobina plaqueta leucocito coagulacion anemia",
+    "Inmunológico": "inmune anticuerpo linfocito antigeno inflamacion citocina",
+    "Reproductivo": "ovario utero testiculo embarazo gameto menstrual",
+    "Metabolismo": "glucolisis metabolismo atp lipido glucosa via",
+    "Enzimas/Proteínas": "enzima proteina sustrato cinetica aminoacido",
+    "Genética/ADN": "adn arn gen cromosoma mutacion replicacion transcripcion",
+    "Biología Celular": "celula membrana organelo mitocondria citoplasma nucleo",
+    "Farmacocinética": "absorcion distribucion metabolismo eliminacion vida media biodisponibilidad",
+    "Farmacodinámica": "receptor agonista antagonista dosis respuesta potencia eficacia",
+    "Antibióticos": "antibiotico bacteria resistencia penicilina espectro",
+}
+
+
+def normalize(text):
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [t for t in re.findall(r"\w+", normalize(text)) if len(t) > 2 and t not in STOPWORDS and not t.isdigit()]
+
+
+def chunk_text(text, chunk_chars=CHUNK_CHARS):
+    """Trozos de ~chunk_chars respetando párrafos (o líneas si no hay párrafos)."""
+    parts = [p for p in re.split(r"\n\s*\n", text) if p.strip()]
+    if len(parts) <= 1: parts = [p for p in text.split("\n") if p.strip()]
+    chunks, buf, size = [], [], 0
+    for p in parts:
+        while len(p) > chunk_chars * 2:  # párrafos enormes (PDF sin saltos): se cortan
+            chunks.append(p[:chunk_chars]); p = p[chunk_chars:]
+        if size + len(p) > chunk_chars and buf:
+            chunks.append("\n".join(buf)); buf, size = [], 0
+        buf.append(p); size += len(p)
+    if buf: chunks.append("\n".join(buf))
+    return _carry_page_marks(chunks) if PAGE_MARK_RE.search(text) else chunks
+
+
+def _carry_page_marks(chunks):
+    # Un trozo que empieza a mitad de página hereda la última marca [Pág. N]: suelto en el
+    # prompt, el modelo sigue sabiendo de qué página sale.
+    out, last = [], None
+    for chunk in chunks:
+        if last and not PAGE_MARK_RE.match(chunk): chunk = f"{PAGE_MARK.format(last)}\n{chunk}"
+        marks = PAGE_MARK_RE.findall(chunk)
+        if marks: last = marks[-1]
+        out.append(chunk)
+    return out
+
+
+class BM25Index:
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1, self.b = k1, b
+        postings = {}
+        lengths = np.zeros(len(chunks), dtype=np.float32)
+        for i, chunk in enumerate(chunks):
+            counts = Counter(tokenize(chunk))
+            lengths[i] = sum(counts.values())
+            for term, tf in counts.items():
+                docs, tfs = postings.setdefault(term, ([], []))
+                docs.append(i); tfs.append(tf)
+        self.lengths = lengths
+        avgdl = float(lengths.mean()) if len(chunks) else 1.0
+        self._norm = k1 * (1 - b + b * lengths / max(avgdl, 1.0))
+        n = len(chunks)
+        self.postings = {}
+        for term, (docs, tfs) in postings.items():
+            idf = np.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            self.postings[term] = (np.asarray(docs, dtype=np.int32), np.asarray(tfs, dtype=np.float32), idf)
+
+    def scores(self, query):
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term in set(tokenize(query)):
+            hit = self.postings.get(term)
+            if hit is None: continue
+            docs, tfs, idf = hit
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[docs])
+        return scores
+
+    def select(self, query, token_budget):
+        """Trozos más relevantes dentro del presupuesto, devueltos en orden de documento."""
+        budget = token_budget * CHARS_PER_TOKEN
+        scores = self.scores(query) if query else np.zeros(len(self.chunks), dtype=np.float32)
+        if scores.any():
+            order = np.argsort(-scores, kind="stable")
+            order = order[scores[order] > 0]
+        else:
+            # Sin coincidencias: muestreo repartido por todo el documento, no sólo el inicio.
+            per_chunk = max(1, int(np.mean([len(c) for c in self.chunks]))) if self.chunks else 1
+            k = max(1, budget // per_chunk)
+            order = np.unique(np.linspace(0, len(self.chunks) - 1, num=min(k, len(self.chunks))).astype(int))
+        picked, used = [], 0
+        for i in order:
+            size = len(self.chunks[i])
+            if used + size > budget and picked: continue
+            picked.append(int(i)); used += size
+            if used >= budget: break
+        return [self.chunks[i] for i in sorted(picked)]
+
+    def partition(self, query, n_batches, token_budget):
+        """Reparte los trozos entre n lotes (round-robin por relevancia) para que cada lote vea otra parte."""
+        budget = token_budget * CHARS_PER_TOKEN
+        scores = self.scores(query) if query else np.zeros(len(self.chunks), dtype=np.float32)
+        order = np.argsort(-scores, kind="stable")
+        batches, used = [[] for _ in range(n_batches)], [0] * n_batches
+        for rank, i in enumerate(order):
+            b = rank % n_batches
+            if used[b] + len(self.chunks[i]) > budget and batches[b]: continue
+            batches[b].append(int(i)); used[b] += len(self.chunks[i])
+        filled = [b for b in batches if b] or [[]]
+        return ["\n[...]\n".join(self.chunks[i] for i in sorted(b or filled[j % len(filled)]))
+                for j, b in enumerate(batches)]
+
+
+_indices = OrderedDict()
+_lock = threading.Lock()
+MAX_INDICES = 16
+
+
+def get_index(doc_key, text):
+    """Índice BM25 por documento, compartido por el proceso (LRU de MAX_INDICES documentos)."""
+    with _lock:
+        if doc_key in _indices:
+            _indices.move_to_end(doc_key)
+            return _indices[doc_key]
+    index = BM25Index(chunk_text(text))
+    with _lock:
+        _indices[doc_key] = index
+        while len(_indices) > MAX_INDICES: _indices.popitem(last=False)
+    return index
+
+
+def build_query(materia, sistema, extra=""):
+    terms = [t for t in (materia, sistema) if t and not t.startswith("Seleccionar") and t not in ("General", "Otro")]
+    terms += [EXPANSION.get(sistema, ""), extra]
+    return " ".join(t for t in terms if t)
+
+
+def select_context(doc_key, text, materia, sistema, token_budget, extra=""):
+    if len(text) <= token_budget * CHARS_PER_TOKEN: return text
+    chunks = get_index(doc_key, text).select(build_query(materia, sistema, extra), token_budget)
+    return "\n[...]\n".join(chunks)
+
+
+def select_context_batches(doc_key, text, materia, sistema, n_batches, token_budget, extra=""):
+    if n_batches <= 1: return [select_context(doc_key, text, materia, sistema, token_budget, extra)]
+    return get_index(doc_key, text).partition(build_query(materia, sistema, extra), n_batches, token_budget)
@@ -0,0 +1,158 @@
+# --- DETECCIÓN DE PREGUNTAS CASI DUPLICADAS ---
+# MinHash sobre shingles de palabras (enunciado + opciones) y LSH por bandas: una pregunta
+# nueva sólo se compara con las que comparten alguna banda, así que la consulta cuesta lo
+# mismo con cien tarjetas que con decenas de miles. El índice de cada usuario se actualiza
+# al guardar/borrar mazos y se persiste en disco (ver medflash/biblioteca.py).
+import base64
+import json
+import re
+import threading
+import zlib
+
+from medflash import deps
+from medflash.contexto import normalize
+from medflash.srs import card_id
+
+np = deps.lazy_module("numpy")
+
+NUM_PERM = 64
+BANDS, ROWS = 16, 4          # umbral LSH ~ (1/16)^(1/4) = 0.5 de Jaccard
+THRESHOLD = 0.7              # Jaccard estimado a partir del cual se considera duplicado
+SHINGLE = 2
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_perms = None  # (a, b) de las permutaciones, creadas al primer uso
+_perm_lock = threading.Lock()
+
+
+def _permutations():
+    global _perms
+    if _perms is None:
+        with _perm_lock:
+            if _perms is None:
+                rng = np.random.RandomState(1)  # semilla fija: las firmas persistidas siguen valiendo
+                a = rng.randint(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+                b = rng.randint(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+                _perms = (a, b)
+    return _perms
+
+
+def question_text(q):
+    opciones = q.get("opciones") or {}
+    return " ".join([str(q.get("pregunta", ""))] + sorted(str(v) for v in opciones.values()))
+
+
+def shingles(text, k=SHINGLE):
+    words = re.findall(r"\w+", normalize(text))
+    if len(words) < k: return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+def signature(q):
+    """Firma MinHash (NUM_PERM enteros de 32 bits) de una pregunta."""
+    sh = shingles(question_text(q))
+    if not sh: return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint32)
+    x = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in sh), dtype=np.uint64, count=len(sh))
+    a, b = _permutations()
+    h = (np.outer(x, a) + b) % _PRIME & _MAX_HASH
+    return h.min(axis=0).astype(np.uint32)
+
+
+def _bands(sig):
+    return [(i, sig[i * ROWS:(i + 1) * ROWS].tobytes()) for i in range(BANDS)]
+
+
+class NearDuplicateIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sigs = {}      # card_id -> firma
+        self.decks = {}     # card_id -> set(mazos) (una misma tarjeta puede estar en varios)
+        self.buckets = {}   # (banda, bytes) -> set(card_id)
+
+    def __len__(self):
+        return len(self.sigs)
+
+    def deck_names(self):
+        with self._lock: return set().union(*self.decks.values()) if self.decks else set()
+
+    def _insert(self, cid, sig, deck):
+        self.decks.setdefault(cid, set()).add(deck)
+        if cid in self.sigs: return
+        self.sigs[cid] = sig
+        for band in _bands(sig): self.buckets.setdefault(band, set()).add(cid)
+
+    def add(self, q, deck, sig=None):
+        sig = signature(q) if sig is None else sig
+        with self._lock: self._insert(card_id(q), sig, deck)
+
+    def add_deck(self, deck, preguntas, meta=None):
+        sigs = [(card_id(q), signature(q)) for q in preguntas]
+        with self._lock:
+            for cid, sig in sigs: self._insert(cid, sig, deck)
+
+    def remove_deck(self, deck):
+        with self._lock:
+            for cid in [c for c, ds in self.decks.items() if deck in ds]:
+                self.decks[cid].discard(deck)
+                if self.decks[cid]: continue
+                del self.decks[cid]
+                sig = self.sigs.pop(cid)
+                for band in _bands(sig):
+                    ids = self.buckets.get(band)
+                    if ids is None: continue
+                    ids.discard(cid)
+                    if not ids: del self.buckets[band]
+
+    def query(self, q, threshold=THRESHOLD, sig=None):
+        """[(card_id, jaccard estimado, mazos)] de las tarjetas parecidas, de más a menos."""
+        sig = signature(q) if sig is None else sig
+        with self._lock:
+            candidates = set()
+            for band in _bands(sig): candidates |= self.buckets.get(band, set())
+            out = []
+            for cid in candidates:
+                sim = float(np.mean(self.sigs[cid] == sig))
+                if sim >= threshold: out.append((cid, sim, sorted(self.decks[cid])))
+        return sorted(out, key=lambda r: -r[1])
+
+    # --- Instantánea (para la caché en disco) ---
+    def dumps(self):
+        with self._lock:
+            ids = list(self.sigs)
+            blob = np.stack([self.sigs[c] for c in ids]).tobytes() if ids else b""
+            return json.dumps({"perm": NUM_PERM, "ids": ids, "decks": [sorted(self.decks[c]) for c in ids],
+                               "sigs": base64.b64encode(blob).decode("ascii")})
+
+    @classmethod
+    def loads(cls, text):
+        data = json.loads(text)
+        index = cls()
+        if data.get("perm") != NUM_PERM: return index
+        sigs = np.frombuffer(base64.b64decode(data["sigs"]), dtype=np.uint32).reshape(-1, NUM_PERM)
+        for cid, decks, sig in zip(data["ids"], data["decks"], sigs):
+            for deck in decks: index._insert(cid, sig.copy(), deck)
+        return index
+
+
+class DedupFilter:
+    """
+    Filtro para generate_deck: descarta preguntas casi iguales a alguna de la biblioteca o a otra
+    ya aceptada en esta misma generación. Se llama desde el hilo que consume el stream.
+    """
+
+    def __init__(self, library, threshold=THRESHOLD):
+        self.library = library
+        self.threshold = threshold
+        self.run = NearDuplicateIndex()
+        self.discarded = []  # (pregunta, [(card_id, sim, mazos)])
+
+    def __call__(self, q):
+        sig = signature(q)
+        matches = self.library.query(q, self.threshold, sig) if self.library is not None else []
+        matches = matches or self.run.query(q, self.threshold, sig)
+        if matches:
+            self.discarded.append((q, matches))
+            return True
+        self.run.add(q, "", sig)
+        return False
+
@@ -0,0 +1,73 @@
+# --- IMPORTACIONES PEREZOSAS ---
+# fitz, pptx, google.generativeai, firebase_admin... tardan cientos de ms y decenas de MB en
+# cargarse. Aquí se declaran como proxies que importan el módulo real en el primer uso y
+# registran cuánto costó, para que el login no pague lo que sólo usa "Cargar Contenido".
+import importlib
+import os
+import sys
+import threading
+import time
+
+PROCESS_START = time.perf_counter()
+IMPORT_TIMINGS = {}  # módulo -> (segundos, instante relativo al arranque)
+DEBUG_IMPORTS = os.environ.get("MEDFLASH_DEBUG_IMPORTS", "") not in ("", "0")
+
+_lock = threading.Lock()
+_missing_handler = None
+
+
+def set_missing_handler(handler):
+    """handler(nombre, ImportError) se llama cuando falta una dependencia (p.ej. st.error + st.stop)."""
+    global _missing_handler
+    _missing_handler = handler
+
+
+def timed_import(name):
+    if name in sys.modules: return sys.modules[name]
+    with _lock:
+        if name in sys.modules: return sys.modules[name]
+        t0 = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - t0
+        IMPORT_TIMINGS[name] = (elapsed, t0 - PROCESS_START)
+    if DEBUG_IMPORTS: print(f"[import] {name}: {elapsed * 1000:.0f} ms")
+    return module
+
+
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            try: module = timed_import(self._name)
+            except ImportError as e:
+                if _missing_handler: _missing_handler(self._name, e)
+                raise
+            self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    @property
+    def loaded(self):
+        return self.__dict__['_module'] is not None or self._name in sys.modules
+
+    def __repr__(self):
+        return f"<LazyModule {self._name} ({'cargado' if self.loaded else 'pendiente'})>"
+
+
+def lazy_module(name):
+    return LazyModule(name)
+
+
+def import_report():
+    """Filas (módulo, ms, ms desde el arranque) ordenadas por coste."""
+    rows = [(name, t * 1000, at * 1000) for name, (t, at) in IMPORT_TIMINGS.items()]
+    return sorted(rows, key=lambda r: r[1], reverse=True)
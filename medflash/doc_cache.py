@@ -0,0 +1,181 @@
+# --- CACHÉ DE DOCUMENTOS EXTRAÍDOS ---
+# Direccionada por contenido: la clave es el hash del archivo subido (más los parámetros de
+# extracción), así que la misma clase en PDF subida por toda una promoción se procesa una vez.
+# Disco con tope de tamaño y desalojo LRU (por mtime) + un LRU pequeño en RAM compartido.
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+EXTRACTOR_VERSION = "2"  # 2: marcas [Pág. N] en el texto de los PDF
+_HEADER = struct.Struct("<d")  # fecha de creación, delante del texto comprimido
+DEFAULT_CACHE_DIR = os.environ.get(
+    "MEDFLASH_CACHE_DIR", os.path.join(tempfile.gettempdir(), "medflash_cache"))
+DEFAULT_MAX_BYTES = int(float(os.environ.get("MEDFLASH_DOC_CACHE_MB", "512")) * 1024 * 1024)
+
+
+def content_key(file_stream, *params):
+    h = hashlib.sha256()
+    if isinstance(file_stream, (bytes, bytearray, memoryview)):
+        h.update(file_stream)
+    elif hasattr(file_stream, "getbuffer"):
+        h.update(file_stream.getbuffer())  # sin copiar el archivo subido
+    else:
+        file_stream.seek(0)
+        for block in iter(lambda: file_stream.read(1024 * 1024), b""): h.update(block)
+        file_stream.seek(0)
+    h.update(("|".join([EXTRACTOR_VERSION] + [str(p or "") for p in params])).encode())
+    return h.hexdigest()
+
+
+class DocumentCache:
+    """
+    Caché de texto en dos niveles: LRU en RAM (memory_items) y disco comprimido con tope de
+    bytes y desalojo LRU por mtime. Con ttl, las entradas caducan según su fecha de creación.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, memory_items=8,
+                 namespace="docs", ttl=None):
+        self.root = os.path.join(root, namespace)
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.ttl = ttl
+        self.hits = self.misses = 0
+        self._memory = OrderedDict()  # key -> (creado, texto)
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self._total = sum(size for _, size, _ in self._scan())
+
+    SUFFIX = ".z"
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + self.SUFFIX)
+
+    def _pack(self, created, text):
+        return _HEADER.pack(created) + zlib.compress(text.encode("utf-8"), 6)
+
+    def _unpack(self, raw):
+        return _HEADER.unpack_from(raw)[0], zlib.decompress(raw[_HEADER.size:]).decode("utf-8")
+
+    def _scan(self):
+        for dirpath, _, files in os.walk(self.root):
+            for fn in files:
+                if not fn.endswith(self.SUFFIX): continue
+                p = os.path.join(dirpath, fn)
+                try: st_ = os.stat(p)
+                except FileNotFoundError: continue
+                yield p, st_.st_size, st_.st_mtime
+
+    def _expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def _remember(self, key, created, text):
+        self._memory[key] = (created, text)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items: self._memory.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._memory or os.path.exists(self._path(key))
+
+    def get(self, key):
+        if not key: return None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and not self._expired(entry[0]):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fh: raw = fh.read()
+            created, text = self._unpack(raw)
+            if self._expired(created): raise FileNotFoundError(path)
+            os.utime(path)  # marca de uso para el LRU en disco
+        except (FileNotFoundError, struct.error, zlib.error):
+            with self._lock: self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self._remember(key, created, text)
+        return text
+
+    def put(self, key, text):
+        created = time.time()
+        data = self._pack(created, text)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as fh: fh.write(data)
+        with self._lock:
+            old = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp, path)  # escritura atómica: otra sesión nunca ve un archivo a medias
+            self._total += len(data) - old
+            self._remember(key, created, text)
+            if self._total > self.max_bytes: self._evict()
+
+    def _evict(self):
+        # Se desaloja hasta el 90% del tope para no escanear en cada put.
+        target = self.max_bytes * 0.9
+        for path, size, _ in sorted(self._scan(), key=lambda e: e[2]):
+            if self._total <= target: break
+            try: os.remove(path)
+            except FileNotFoundError: continue
+            self._total -= size
+            self._memory.pop(os.path.basename(path)[:-len(self.SUFFIX)], None)
+
+    def get_or_extract(self, key, extract):
+        text = self.get(key)
+        if text is None:
+            text = extract()
+            if text and not text.startswith(("Error PDF:", "Error PPTX:")): self.put(key, text)
+        return text
+
+    @property
+    def size_bytes(self):
+        return self._total
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0,
+                "memoria": len(self._memory), "disco_mb": self._total / (1024 * 1024)}
+
+
+def blob_key(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BlobCache(DocumentCache):
+    """
+    La misma caché para bytes ya comprimidos (PDF originales, imágenes JPEG): se guardan tal
+    cual, sin cabecera ni zlib, así que path() sirve para abrirlos directamente desde disco.
+    Sin caducidad (ttl); las entradas sólo salen por el tope de bytes.
+    """
+
+    SUFFIX = ".bin"
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, memory_items=0, namespace="blobs"):
+        super().__init__(root, max_bytes, memory_items, namespace)
+
+    def _pack(self, created, data):
+        return bytes(data)
+
+    def _unpack(self, raw):
+        return 0.0, raw
+
+    def path(self, key):
+        """Ruta del archivo en disco (y lo marca como usado), o None si no está."""
+        path = self._path(key) if key else None
+        if not path or not os.path.exists(path): return None
+        try: os.utime(path)
+        except FileNotFoundError: return None
+        return path
+
+    def put_blob(self, data):
+        """Guarda por contenido y devuelve la clave."""
+        key = blob_key(data)
+        if self.path(key) is None: self.put(key, data)
+        return key
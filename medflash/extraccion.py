@@ -0,0 +1,142 @@
+# --- EXTRACCIÓN DE TEXTO (PDF / PPTX) ---
+# Los extractores producen trozos por página/diapositiva en vez de concatenar un único
+# string, para poder mostrar progreso, quedarse con un capítulo y repartir libros grandes
+# entre varios procesos.
+import io
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from medflash import deps, tracing
+
+fitz = deps.lazy_module("fitz")  # PyMuPDF
+pptx = deps.lazy_module("pptx")
+
+PDF_PARALLEL_MIN_PAGES = 120   # por debajo de esto arrancar procesos cuesta más de lo que ahorra
+PDF_RANGE_SIZE = 40            # páginas por tarea enviada al pool
+PDF_MAX_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+# Cada página del PDF empieza con esta marca: el contexto conserva de qué página sale cada
+# trozo y el modelo puede citarla (para adjuntar sus figuras, ver medflash/imagenes.py).
+PAGE_MARK = "[Pág. {}]"
+PAGE_MARK_RE = re.compile(r"\[Pág\. (\d+)\]")
+
+
+def parse_page_range(spec, total_pages, max_pages=None):
+    """'10-45, 50' -> índices 0-based ordenados (sin duplicados), recortados a max_pages."""
+    if not spec or not str(spec).strip():
+        pages = list(range(total_pages))
+    else:
+        selected = set()
+        for part in str(spec).replace(";", ",").split(","):
+            part = part.strip()
+            if not part: continue
+            if "-" in part:
+                a, b = part.split("-", 1)
+                start = int(a) if a.strip() else 1
+                stop = int(b) if b.strip() else total_pages
+            else:
+                start = stop = int(part)
+            if start > stop: start, stop = stop, start
+            selected.update(range(max(start, 1) - 1, min(stop, total_pages)))
+        pages = sorted(selected)
+    if max_pages: pages = pages[:max_pages]
+    return pages
+
+
+def open_pdf(source):
+    if isinstance(source, (str, os.PathLike)): return fitz.open(source)
+    if isinstance(source, (bytes, bytearray)): return fitz.open(stream=source, filetype="pdf")
+    # UploadedFile es un BytesIO: PyMuPDF lo lee sin copiarlo a un bytes intermedio.
+    source.seek(0)
+    return fitz.open(stream=source, filetype="pdf")
+
+
+def pdf_select_pages(source, pages=None, max_pages=None):
+    """Índices 0-based que se van a extraer (para saber el total antes de empezar)."""
+    doc = open_pdf(source)
+    try: total = doc.page_count
+    finally: doc.close()
+    return parse_page_range(pages, total, max_pages)
+
+
+def _extract_range(path, indices):
+    # Corre en un proceso del pool: abre su propia copia del documento.
+    doc = fitz.open(path)
+    try: return [(i + 1, doc.load_page(i).get_text()) for i in indices]
+    finally: doc.close()
+
+
+def _chunks(seq, size):
+    for i in range(0, len(seq), size): yield seq[i:i + size]
+
+
+def _spool_to_disk(source):
+    # Los procesos hijos necesitan una ruta; se copia por bloques, sin leer todo en memoria.
+    if isinstance(source, (str, os.PathLike)): return os.fspath(source), False
+    tmp = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    with tmp:
+        if isinstance(source, (bytes, bytearray)): tmp.write(source)
+        else:
+            source.seek(0)
+            shutil.copyfileobj(source, tmp, 1024 * 1024)
+    return tmp.name, True
+
+
+def iter_pdf_pages(source, pages=None, max_pages=None, workers=None):
+    """
+    Genera (número_de_página, texto) en orden. `pages` admite '10-45, 50' o una lista de
+    índices 0-based. Con workers > 1 y suficientes páginas, reparte rangos en un pool de procesos.
+    """
+    doc = open_pdf(source)
+    try:
+        total = doc.page_count
+        indices = pages if isinstance(pages, (list, tuple, range)) else parse_page_range(pages, total, max_pages)
+        workers = PDF_MAX_WORKERS if workers is None else workers
+        if workers <= 1 or len(indices) < PDF_PARALLEL_MIN_PAGES:
+            for i in indices: yield i + 1, doc.load_page(i).get_text()
+            return
+    finally:
+        doc.close()
+
+    path, is_tmp = _spool_to_disk(source)
+    try:
+        ctx = multiprocessing.get_context("spawn")  # fork desde el servidor con hilos no es seguro
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            ranges = list(_chunks(list(indices), PDF_RANGE_SIZE))
+            for result in pool.map(_extract_range, [path] * len(ranges), ranges):
+                yield from result
+    finally:
+        if is_tmp: os.unlink(path)
+
+
+def iter_pptx_slides(file_stream):
+    prs = pptx.Presentation(file_stream)
+    for n, slide in enumerate(prs.slides, 1):
+        yield n, "".join(shape.text + "\n" for shape in slide.shapes if hasattr(shape, "text"))
+
+
+@tracing.traced("extraccion.pdf")
+def extraer_texto_pdf(file_stream, pages=None, max_pages=None, on_page=None, workers=None):
+    try:
+        indices = pdf_select_pages(file_stream, pages, max_pages)
+        tracing.count("paginas", len(indices))
+        partes = []
+        for n, texto in iter_pdf_pages(file_stream, indices, workers=workers):
+            partes.append(f"{PAGE_MARK.format(n)}\n{texto}")
+            if on_page: on_page(n, len(partes), len(indices))
+        return "".join(partes)
+    except Exception as e: return f"Error PDF: {e}"
+
+
+@tracing.traced("extraccion.pptx")
+def extraer_texto_pptx(file_stream, on_slide=None):
+    try:
+        partes = []
+        for n, texto in iter_pptx_slides(file_stream):
+            partes.append(texto)
+            if on_slide: on_slide(n)
+        return "".join(partes)
+    except Exception as e: return f"Error PPTX: {e}"
@@ -0,0 +1,198 @@
+# --- GENERACIÓN DE MAZOS (MIR/USMLE) ---
+# Un mazo grande se parte en lotes de BATCH_SIZE preguntas, cada uno con otros trozos del
+# documento; los lotes se lanzan en paralelo con concurrencia acotada y se fusionan sin
+# duplicados. Las respuestas llegan en streaming y cada pregunta se valida y se entrega en
+# cuanto su objeto JSON se cierra. Si algún lote falla, se conserva lo que sí llegó.
+import json
+import queue
+import re
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+from medflash import tracing
+from medflash.extraccion import PAGE_MARK_RE
+
+BATCH_SIZE = 10
+MAX_CONCURRENCY = 4
+CONTEXT_TOKENS_GENERACION = 2500  # contexto del documento por lote
+AVOID_LIMIT = 8                   # enunciados descartados que se citan al reponer
+
+
+def build_exam_prompt(materia, sistema, nivel, contexto, num, avoid=()):
+    # PROMPT MIR/USMLE ESPECIALIZADO
+    return [
+        f"Eres un experto redactor de preguntas para exámenes MIR y USMLE especializado en {materia}.",
+        f"Tema: {sistema}. Nivel Estudiante: {nivel}.",
+        f"Texto base para extraer conceptos:\n{contexto}",
+        f"Genera {num} preguntas de opción múltiple.",
+
+        "ESTILO DE PREGUNTAS (PRIORIDAD MIR/USMLE):",
+        "1. VINETAS CLÍNICAS (80%): Presenta un caso corto (Paciente de X años, síntomas Y...).",
+        "   - Pregunta por el DIAGNÓSTICO, MECANISMO o MANEJO.",
+        "2. RAZONAMIENTO FISIOLÓGICO (Importante):",
+        "   - Incluye preguntas de vectores/cambios: '¿Cómo cambian la Presión Arterial y la RVS?'",
+        "   - Opciones tipo: 'Aumenta / Disminuye', 'No cambia / Aumenta'.",
+        "3. CONCEPTUALES (20%): Definiciones directas si el nivel es Novato.",
+
+        "IMPORTANTE - FEEDBACK VISUAL Y EDUCATIVO:",
+        "En el campo 'explicacion', la respuesta debe ser una revisión de alto rendimiento:",
+        "- Usa MARKDOWN para Tablas, Listas y Esquemas.",
+        "- Explica por qué la correcta es correcta Y por qué las otras son incorrectas.",
+
+        "Formato JSON array estricto:",
+        """[{"pregunta": "...", "opciones": {"A": "...", "B": "...", "C": "...", "D": "..."}, "respuesta_correcta": "A", "explicacion": "Markdown rico aquí..."}]"""
+    ] + ([
+        # Con la página citada se adjuntan después sus figuras (medflash/imagenes.py).
+        "El texto base trae marcas [Pág. N]: añade a cada pregunta \"pagina\": N (número entero) con la "
+        "página de la que sale, sobre todo si se apoya en una figura, ECG, imagen o tabla de esa página."
+    ] if PAGE_MARK_RE.search(contexto) else []) + ([
+        "Ya existen estos casos; NO los repitas, plantea situaciones clínicas distintas:\n"
+        + "\n".join(f"- {q[:150]}" for q in avoid)
+    ] if avoid else [])
+
+
+def split_batches(num, batch_size=BATCH_SIZE):
+    """200 -> [10, 10, ...]; 25 -> [10, 10, 5]."""
+    return [min(batch_size, num - i) for i in range(0, num, batch_size)]
+
+
+def question_fingerprint(q):
+    text = unicodedata.normalize("NFKD", str(q.get("pregunta", "")).lower())
+    return " ".join(re.findall(r"\w+", "".join(c for c in text if not unicodedata.combining(c))))
+
+
+QUESTION_FIELDS = ("pregunta", "opciones", "respuesta_correcta", "explicacion")
+
+
+def validate_question(q):
+    """Devuelve la pregunta normalizada o None si no cumple el esquema del mazo."""
+    if not isinstance(q, dict): return None
+    pregunta, opciones = q.get("pregunta"), q.get("opciones")
+    correcta, explicacion = q.get("respuesta_correcta"), q.get("explicacion", "")
+    if not isinstance(pregunta, str) or not pregunta.strip(): return None
+    if isinstance(opciones, list):  # a veces llega como lista: se re-etiqueta A, B, C...
+        opciones = {chr(65 + i): o for i, o in enumerate(opciones)}
+    if not isinstance(opciones, dict) or len(opciones) < 2: return None
+    opciones = {str(k).strip(): str(v) for k, v in opciones.items()}
+    correcta = str(correcta).strip().rstrip(")").upper() if correcta is not None else ""
+    if correcta not in opciones: return None
+    if not isinstance(explicacion, str): explicacion = str(explicacion)
+    out = {"pregunta": pregunta, "opciones": opciones, "respuesta_correcta": correcta, "explicacion": explicacion}
+    try: pagina = int(str(q.get("pagina", "")).strip())
+    except ValueError: pagina = 0
+    if pagina > 0: out["pagina"] = pagina  # opcional: página del PDF de la que sale
+    return out
+
+
+class JSONArrayStream:
+    """
+    Parser incremental de un array JSON de objetos: feed() recibe texto parcial (con o sin
+    ```json) y devuelve los objetos de primer nivel que ya se cerraron. Un objeto malformado
+    se descarta sin perder los demás.
+    """
+
+    def __init__(self):
+        self._buf = []
+        self._started = False
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+        self.invalid = 0
+
+    def feed(self, text):
+        out = []
+        for ch in text:
+            if not self._started:
+                if ch == "[": self._started = True
+                continue
+            if self._depth == 0:
+                if ch == "{": self._depth, self._buf = 1, ["{"]
+                continue
+            self._buf.append(ch)
+            if self._in_str:
+                if self._escape: self._escape = False
+                elif ch == "\\": self._escape = True
+                elif ch == '"': self._in_str = False
+            elif ch == '"': self._in_str = True
+            elif ch in "{[": self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    try: out.append(json.loads("".join(self._buf)))
+                    except ValueError: self.invalid += 1
+                    self._buf = []
+        return out
+
+
+def _stream_text(model, prompt):
+    try: response = model.generate_content(prompt, stream=True)
+    except TypeError: response = [model.generate_content(prompt)]  # modelos sin streaming
+    for chunk in response:
+        try: text = chunk.text
+        except ValueError: continue  # trozo sin texto (p.ej. bloqueado por seguridad)
+        if text: yield text
+
+
+def stream_questions(model, prompt):
+    """Genera cada pregunta válida en cuanto su objeto JSON se cierra en la respuesta."""
+    parser = JSONArrayStream()
+    for text in _stream_text(model, prompt):
+        for obj in parser.feed(text):
+            q = validate_question(obj)
+            if q: yield q
+            else: parser.invalid += 1
+
+
+def generate_deck(model, prompts, max_workers=MAX_CONCURRENCY, on_batch=None, on_question=None, is_duplicate=None):
+    """
+    Lanza un prompt por lote en un pool de hilos, en streaming. Devuelve (preguntas, errores)
+    donde errores es una lista de (n_lote, excepción). Los callbacks se llaman desde el hilo
+    que invoca (seguro para Streamlit): on_question(n_lote, pregunta) con cada pregunta nueva
+    (ya sin duplicados) y on_batch(n_lote, n_preguntas|None, error|None) al cerrar cada lote.
+    is_duplicate(pregunta) -> bool descarta además casi-duplicados (ver medflash/dedup.py).
+    Si un lote se corta a mitad, las preguntas que ya llegaron se conservan.
+    """
+    events = queue.Queue()
+    seen, merged, errors = set(), [], []
+
+    def run(n, prompt):
+        count = 0
+        try:
+            for q in stream_questions(model, prompt):
+                events.put(("q", n, q)); count += 1
+            events.put(("done", n, count))
+        except Exception as e:
+            events.put(("error", n, e))
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts))))
+    try:
+        # Cada hilo hereda la traza del rerun, así los spans de la IA cuelgan del span que genera.
+        for n, p in enumerate(prompts): pool.submit(tracing.wrap_context(run), n, p)
+        pending = len(prompts)
+        while pending:
+            kind, n, payload = events.get()
+            if kind == "q":
+                fp = question_fingerprint(payload)
+                if fp in seen or (is_duplicate and is_duplicate(payload)): continue
+                seen.add(fp); merged.append(payload)
+                if on_question: on_question(n, payload)
+                continue
+            pending -= 1
+            if kind == "error": errors.append((n, payload))
+            if on_batch: on_batch(n, payload if kind == "done" else None, payload if kind == "error" else None)
+    finally:
+        pool.shutdown(wait=False)
+    return merged, errors
+
+
+def refill_deck(model, missing, discarded, prompts_for, max_workers=MAX_CONCURRENCY, on_question=None, is_duplicate=None):
+    """
+    Reposición de lo que is_duplicate descartó: prompts_for(lotes, evitar) da un prompt por
+    lote de split_batches(missing), con evitar = enunciados descartados para pedir casos
+    distintos (el prompt cambia, así que tampoco sale de la caché de respuestas).
+    Devuelve (preguntas, errores) como generate_deck; nada si no falta o no hubo descartes.
+    """
+    if missing <= 0 or not discarded: return [], []
+    avoid = [q['pregunta'] for q, _ in discarded[:AVOID_LIMIT]]
+    return generate_deck(model, prompts_for(split_batches(missing), avoid), max_workers,
+                         on_question=on_question, is_duplicate=is_duplicate)
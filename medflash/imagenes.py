@@ -0,0 +1,154 @@
+# --- IMÁGENES DE LOS PDF (FIGURAS Y MINIATURAS DE PÁGINA) ---
+# ECG, radiografías y cortes histológicos son lo más valioso de una clase y el texto los
+# pierde. Tras generar un mazo, sólo las páginas que citan sus preguntas ("pagina") se abren
+# con PyMuPDF: se sacan las figuras incrustadas (sin logos ni iconos) y una miniatura de la
+# página, reducidas y recodificadas con Pillow como JPEG progresivo, a una BlobCache en disco
+# direccionada por contenido. El mazo sólo guarda los hashes; la tarjeta lee los bytes al pintarse.
+import hashlib
+import io
+import json
+import os
+
+from medflash import deps, tracing
+from medflash.doc_cache import DEFAULT_CACHE_DIR, BlobCache
+from medflash.extraccion import open_pdf
+
+fitz = deps.lazy_module("fitz")  # PyMuPDF
+Image = deps.lazy_module("PIL.Image")
+
+IMAGES_VERSION = "1"
+FIGURE_SIDE = 1024          # lado mayor de una figura
+THUMB_SIDE = 320            # lado mayor de la miniatura de página
+JPEG_QUALITY = 80
+MIN_FIGURE_SIDE = 96        # px de la imagen original: por debajo, iconos y viñetas
+MIN_FIGURE_AREA = 0.03      # fracción de la página que ocupa: por debajo, logos y decoración
+MAX_FIGURES_PER_PAGE = 3
+MAX_PAGES = 40              # páginas distintas por mazo que se procesan
+DEFAULT_MAX_BYTES = int(float(os.environ.get("MEDFLASH_IMAGE_CACHE_MB", "256")) * 1024 * 1024)
+_MODES = {1: "L", 2: "LA", 3: "RGB", 4: "RGBA"}
+
+
+def image_cache(root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    return BlobCache(root, max_bytes, memory_items=16, namespace="imagenes")
+
+
+def _flatten(img):
+    # JPEG no tiene transparencia: lo transparente pasa a fondo blanco, no negro.
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        bg = Image.new("RGB", img.size, (255, 255, 255))
+        bg.paste(img, mask=img.getchannel("A"))
+        return bg
+    return img if img.mode in ("RGB", "L") else img.convert("RGB")
+
+
+def to_jpeg(img, max_side):
+    """Imagen de Pillow -> (bytes JPEG progresivo, ancho, alto) con el lado mayor <= max_side."""
+    img = _flatten(img)
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue(), img.width, img.height
+
+
+def _pixmap_image(pix):
+    if pix.n - pix.alpha >= 4: pix = fitz.Pixmap(fitz.csRGB, pix)  # CMYK
+    return Image.frombytes(_MODES[pix.n], (pix.width, pix.height), pix.samples)
+
+
+def _embedded_image(doc, xref):
+    info = doc.extract_image(xref)
+    try:
+        img = Image.open(io.BytesIO(info["image"]))
+        img.draft("RGB", (FIGURE_SIDE, FIGURE_SIDE))  # JPEG: se decodifica ya reducida
+        img.load()
+        return img
+    except Exception:
+        return _pixmap_image(fitz.Pixmap(doc, xref))  # JBIG2, JPX... que Pillow no abre
+
+
+def _figures(doc, page):
+    page_area = max(page.rect.width * page.rect.height, 1.0)
+    seen = set()
+    for xref, _, width, height, *_ in page.get_images(full=True):
+        if xref in seen or min(width, height) < MIN_FIGURE_SIDE: continue
+        seen.add(xref)
+        rects = page.get_image_rects(xref)
+        if not rects or max(r.width * r.height for r in rects) / page_area < MIN_FIGURE_AREA: continue
+        yield xref
+
+
+def page_images(doc, index, cache, thumbnail=True):
+    """Refs [{'id', 'tipo': 'figura'|'pagina', 'ancho', 'alto'}] de la página (0-based) index."""
+    page = doc.load_page(index)
+    refs = []
+    for xref in _figures(doc, page):
+        try: data, w, h = to_jpeg(_embedded_image(doc, xref), FIGURE_SIDE)
+        except Exception as e:
+            tracing.error("imagen", e)
+            continue
+        refs.append({'id': cache.put_blob(data), 'tipo': 'figura', 'ancho': w, 'alto': h})
+        if len(refs) >= MAX_FIGURES_PER_PAGE: break
+    if thumbnail:
+        zoom = THUMB_SIDE / max(page.rect.width, page.rect.height, 1.0)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        data, w, h = to_jpeg(_pixmap_image(pix), THUMB_SIDE)
+        refs.append({'id': cache.put_blob(data), 'tipo': 'pagina', 'ancho': w, 'alto': h})
+    return refs
+
+
+def _memo_key(source_key, page_no):
+    return hashlib.sha256(f"{source_key}|imagenes|{IMAGES_VERSION}|{page_no}".encode()).hexdigest()
+
+
+@tracing.traced("imagenes.extraer")
+def extract_images(source, page_numbers, cache, memo=None, source_key=None):
+    """
+    {nº de página (1-based): refs} sólo para page_numbers. Con memo (DocumentCache) y
+    source_key, las páginas ya procesadas de ese documento no se vuelven a abrir mientras
+    sus imágenes sigan en la caché.
+    """
+    out, todo = {}, []
+    for n in page_numbers:
+        cached = memo.get(_memo_key(source_key, n)) if memo is not None and source_key else None
+        refs = json.loads(cached) if cached else None
+        if refs is not None and all(cache.path(r['id']) for r in refs): out[n] = refs
+        else: todo.append(n)
+    if not todo: return out
+    doc = open_pdf(source)
+    try:
+        for n in todo:
+            if not 1 <= n <= doc.page_count: continue
+            out[n] = page_images(doc, n - 1, cache)
+            tracing.count("paginas_imagen")
+            if memo is not None and source_key: memo.put(_memo_key(source_key, n), json.dumps(out[n]))
+    finally:
+        doc.close()
+    return out
+
+
+def cited_pages(preguntas, limit=MAX_PAGES):
+    pages = sorted({q['pagina'] for q in preguntas if isinstance(q.get('pagina'), int)})
+    return pages[:limit]
+
+
+def attach_images(preguntas, source, cache, memo=None, source_key=None):
+    """Añade 'imagenes' (refs por hash) a las preguntas que citan página. Devuelve cuántas llevan."""
+    pages = cited_pages(preguntas)
+    if not pages: return 0
+    by_page = extract_images(source, pages, cache, memo, source_key)
+    n = 0
+    for q in preguntas:
+        refs = by_page.get(q.get('pagina'))
+        if refs:
+            q['imagenes'] = refs
+            n += 1
+    return n
+
+
+def figures(q):
+    return [r for r in q.get('imagenes') or [] if r.get('tipo') == 'figura']
+
+
+def thumbnail(q):
+    return next((r for r in q.get('imagenes') or [] if r.get('tipo') == 'pagina'), None)
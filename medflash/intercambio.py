@@ -0,0 +1,487 @@
+# --- EXPORTAR / IMPORTAR BIBLIOTECAS (JSONL Y ANKI) ---
+# Toda la biblioteca de un usuario sale o entra de una vez, en streaming: la exportación
+# recorre los mazos de uno en uno (los fragmentados, fragmento a fragmento) y escribe cada
+# tarjeta según llega; la importación lee el archivo por líneas o por filas de SQLite, valida
+# cada tarjeta con el esquema del mazo y la persiste en partes de IMPORT_DECK_SIZE. La memoria
+# no depende del tamaño de la biblioteca. Formatos:
+#   - JSONL propio: una tarjeta por línea con "mazo", "materia" y "sistema".
+#   - Paquete de Anki (.apkg): se exporta con un tipo de nota "MedFlash MIR" que guarda la
+#     pregunta original (ida y vuelta sin pérdidas); se importan también notas Básicas y Cloze.
+#   - Texto de Anki ("Notas en texto plano", .txt/.tsv) con sus cabeceras #separator, #deck column...
+#
+#   python -m medflash.intercambio exportar --user ana biblioteca.apkg
+#   python -m medflash.intercambio importar --user ana mis_tarjetas.apkg
+import argparse
+import csv
+import hashlib
+import html
+import importlib.util
+import io
+import itertools
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import zipfile
+
+from medflash import batch, deps, imagenes, render, tracing
+from medflash.generacion import validate_question
+from medflash.srs import card_id
+from medflash.storage import DEFAULT_SQLITE_PATH
+
+zstandard = deps.lazy_module("zstandard")  # sólo para .apkg de Anki >= 2.1.50 sin compatibilidad
+
+IMPORT_DECK_SIZE = 500      # tarjetas por mazo importado; uno mayor se parte en "Nombre (2)", ...
+MAX_BUFFERED = 2000         # tarjetas retenidas entre todos los mazos antes de escribir
+PROGRESS_EVERY = 250
+MAX_ERRORS = 20             # rechazos que se detallan (el resto sólo se cuenta)
+ANKI_ROOT = "MedFlash"      # mazo padre en Anki
+ANKI_MODEL = "MedFlash MIR"
+ANKI_FIELDS = ("Pregunta", "Opciones", "Respuesta", "Explicacion", "MedFlash")
+SELF_GRADED = {"A": "Lo sabía", "B": "No lo sabía"}  # notas de Anki sin opciones: autoevaluación
+FORMATS = {".jsonl": "jsonl", ".json": "jsonl", ".apkg": "apkg", ".colpkg": "apkg", ".txt": "anki_txt", ".tsv": "anki_txt"}
+
+
+class Progress:
+    """Contador de tarjetas con ritmo; on_progress(self) cada `every` tarjetas."""
+
+    def __init__(self, on_progress=None, every=PROGRESS_EVERY):
+        self.on_progress, self.every = on_progress, every
+        self.cards = self.rejected = 0
+        self.decks = []   # mazos escritos (exportados o creados al importar)
+        self.errors = []  # (dónde, motivo) de los primeros MAX_ERRORS rechazos
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.cards / max(self.elapsed, 1e-9)
+
+    def card(self):
+        self.cards += 1
+        if self.on_progress and self.cards % self.every == 0: self.on_progress(self)
+
+    def reject(self, where, reason):
+        self.rejected += 1
+        if len(self.errors) < MAX_ERRORS: self.errors.append((where, reason))
+
+    def summary(self):
+        out = f"{self.cards:,} tarjetas en {self.elapsed:.1f} s · {self.rate:,.0f} tarjetas/s · {len(self.decks)} mazos"
+        return out + (f" · {self.rejected:,} rechazadas" if self.rejected else "")
+
+
+# --- Exportación ---
+def _record(name, deck, q):
+    return dict(q, mazo=name, materia=deck.get('materia', 'General'), sistema=deck.get('sistema', 'General'))
+
+
+@tracing.traced("intercambio.exportar_jsonl")
+def export_jsonl(decks, out, progress=None):
+    """decks: iterable de (nombre, mazo), p.ej. storage.iter_decks(usuario); out: archivo de texto."""
+    progress = progress or Progress()
+    for name, deck in decks:
+        for q in deck.get('preguntas', []):
+            out.write(json.dumps(_record(name, deck, q), ensure_ascii=False) + "\n")
+            progress.card()
+        progress.decks.append(name)
+    return progress
+
+
+_ANKI_SCHEMA = """
+CREATE TABLE col (id integer primary key, crt integer not null, mod integer not null, scm integer not null,
+    ver integer not null, dty integer not null, usn integer not null, ls integer not null, conf text not null,
+    models text not null, decks text not null, dconf text not null, tags text not null);
+CREATE TABLE notes (id integer primary key, guid text not null, mid integer not null, mod integer not null,
+    usn integer not null, tags text not null, flds text not null, sfld integer not null, csum integer not null,
+    flags integer not null, data text not null);
+CREATE TABLE cards (id integer primary key, nid integer not null, did integer not null, ord integer not null,
+    mod integer not null, usn integer not null, type integer not null, queue integer not null, due integer not null,
+    ivl integer not null, factor integer not null, reps integer not null, lapses integer not null,
+    left integer not null, odue integer not null, odid integer not null, flags integer not null, data text not null);
+CREATE TABLE revlog (id integer primary key, cid integer not null, usn integer not null, ease integer not null,
+    ivl integer not null, lastIvl integer not null, factor integer not null, time integer not null, type integer not null);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn on notes (usn);
+CREATE INDEX ix_cards_usn on cards (usn);
+CREATE INDEX ix_revlog_usn on revlog (usn);
+CREATE INDEX ix_cards_nid on cards (nid);
+CREATE INDEX ix_cards_sched on cards (did, queue, due);
+CREATE INDEX ix_revlog_cid on revlog (cid);
+CREATE INDEX ix_notes_csum on notes (csum);
+"""
+_ANKI_DCONF = {"1": {
+    "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60, "autoplay": True, "timer": 0, "replayq": True,
+    "new": {"bury": True, "delays": [1, 10], "initialFactor": 2500, "ints": [1, 4, 7], "order": 1, "perDay": 20, "separate": True},
+    "lapse": {"delays": [10], "leechAction": 0, "leechFails": 8, "minInt": 1, "mult": 0},
+    "rev": {"bury": True, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1, "maxIvl": 36500, "minSpace": 1, "perDay": 100},
+}}
+_ANKI_CSS = ".card { font-family: arial; font-size: 18px; text-align: left; color: black; background-color: white; }\n" \
+            "table { border-collapse: collapse; } td, th { border: 1px solid #999; padding: 4px 8px; }"
+
+
+def _anki_id(text):
+    return int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:11], 16)  # < 2^44: cabe en un entero de JS
+
+
+def _anki_deck(did, name, now):
+    return {"id": did, "name": name, "mod": now, "usn": -1, "desc": "", "dyn": 0, "conf": 1, "collapsed": False,
+            "extendNew": 10, "extendRev": 50, "newToday": [0, 0], "revToday": [0, 0], "lrnToday": [0, 0], "timeToday": [0, 0]}
+
+
+def _anki_model(mid, did, now):
+    return {
+        "id": mid, "name": ANKI_MODEL, "type": 0, "mod": now, "usn": -1, "sortf": 0, "did": did, "tags": [], "vers": [],
+        "css": _ANKI_CSS, "req": [[0, "any", [0]]],
+        "latexPre": "\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage{amssymb,amsmath}\n"
+                    "\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "flds": [{"name": n, "ord": i, "sticky": False, "rtl": False, "font": "Arial", "size": 20, "media": []}
+                 for i, n in enumerate(ANKI_FIELDS)],
+        "tmpls": [{"name": "Tarjeta 1", "ord": 0, "did": None, "bqfmt": "", "bafmt": "",
+                   "qfmt": "{{Pregunta}}<hr>{{Opciones}}",
+                   "afmt": "{{FrontSide}}<hr id=answer><b>{{Respuesta}}</b><br><br>{{Explicacion}}"}],
+    }
+
+
+def _anki_fields(q, media, images):
+    pregunta = render.to_html(q.get('pregunta', ''), remember=False)
+    for ref in q.get('imagenes') or []:
+        path = images.path(ref['id']) if images is not None and ref.get('tipo') == 'figura' else None
+        if not path: continue
+        fname = f"medflash_{ref['id'][:24]}.jpg"
+        media[fname] = path
+        pregunta += f'<br><img src="{fname}">'
+    opciones = q.get('opciones', {})
+    correcta = q.get('respuesta_correcta', '')
+    return [pregunta,
+            "<br>".join(f"<b>{html.escape(k)})</b> {html.escape(str(v))}" for k, v in opciones.items()),
+            f"{html.escape(correcta)}) {html.escape(str(opciones.get(correcta, '')))}",
+            render.to_html(q.get('explicacion', ''), remember=False),
+            html.escape(json.dumps(q, ensure_ascii=False), quote=False)]
+
+
+@tracing.traced("intercambio.exportar_anki")
+def export_apkg(decks, out, progress=None, images=None, batch_size=500):
+    """
+    Paquete .apkg (colección de Anki en formato 2.1 clásico, que importan todas las versiones)
+    en `out` (ruta o archivo binario). La colección se escribe en un SQLite temporal por lotes;
+    con images (BlobCache) se incluyen las figuras como media.
+    """
+    progress = progress or Progress()
+    tmpdir = tempfile.mkdtemp(prefix="medflash_apkg_")
+    try:
+        path = os.path.join(tmpdir, "collection.anki2")
+        con = sqlite3.connect(path)
+        con.executescript(_ANKI_SCHEMA)
+        now = int(time.time())
+        mid = _anki_id(ANKI_MODEL)
+        anki_decks = {"1": _anki_deck(1, "Default", now)}
+        media, notes, cards = {}, [], []
+        nid = now * 1000
+        def flush():
+            con.executemany("INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)", notes)
+            con.executemany("INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", cards)
+            notes.clear(); cards.clear()
+        for name, deck in decks:
+            full = f"{ANKI_ROOT}::{name}"
+            did = _anki_id(full)
+            anki_decks[str(did)] = _anki_deck(did, full, now)
+            for q in deck.get('preguntas', []):
+                nid += 1
+                fields = _anki_fields(q, media, images)
+                sfld = html_to_text(fields[0])
+                csum = int(hashlib.sha1(sfld.encode("utf-8")).hexdigest()[:8], 16)
+                notes.append((nid, card_id(q), mid, now, -1, f" {ANKI_ROOT} ", "\x1f".join(fields), sfld, csum, 0, ""))
+                cards.append((nid, nid, did, 0, now, -1, 0, 0, nid - now * 1000, 0, 0, 0, 0, 0, 0, 0, 0, ""))
+                if len(notes) >= batch_size: flush()
+                progress.card()
+            progress.decks.append(name)
+        flush()
+        first = next((int(k) for k in anki_decks if k != "1"), 1)
+        conf = {"activeDecks": [1], "curDeck": 1, "curModel": str(mid), "nextPos": nid - now * 1000 + 1,
+                "newSpread": 0, "collapseTime": 1200, "timeLim": 0, "estTimes": True, "dueCounts": True,
+                "sortType": "noteFld", "sortBackwards": False, "addToCur": True, "newBury": True}
+        con.execute("INSERT INTO col VALUES (1,?,?,?,11,0,0,0,?,?,?,?,?)",
+                    (now // 86400 * 86400, now * 1000, now * 1000, json.dumps(conf),
+                     json.dumps({str(mid): _anki_model(mid, first, now)}), json.dumps(anki_decks), json.dumps(_ANKI_DCONF), "{}"))
+        con.commit()
+        con.close()
+        with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as z:
+            z.write(path, "collection.anki2")
+            numbered = {}
+            for i, (fname, src) in enumerate(media.items()):
+                z.write(src, str(i), compress_type=zipfile.ZIP_STORED)  # JPEG: ya comprimido
+                numbered[str(i)] = fname
+            z.writestr("media", json.dumps(numbered))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return progress
+
+
+# --- Importación ---
+class DeckWriter:
+    """
+    Agrupa las tarjetas por mazo y las guarda en partes de deck_size con
+    save(nombre, preguntas, materia, sistema) -> bool. Nunca retiene más de max_buffered
+    tarjetas: si se llega, se escribe el mazo con más tarjetas pendientes. Los nombres que ya
+    existen (exists(nombre)) o ya se usaron reciben " (2)", " (3)"...
+    """
+
+    def __init__(self, save, exists=None, progress=None, deck_size=IMPORT_DECK_SIZE, max_buffered=MAX_BUFFERED):
+        self._save, self._exists = save, exists or (lambda name: False)
+        self.progress = progress or Progress()
+        self.deck_size, self.max_buffered = deck_size, max_buffered
+        self._buffers = {}  # mazo -> (materia, sistema, [preguntas])
+        self._buffered = 0
+        self._used = set()
+
+    def _free_name(self, base):
+        name, n = base, 1
+        while name in self._used or self._exists(name):
+            n += 1
+            name = f"{base} ({n})"
+        self._used.add(name)
+        return name
+
+    def add(self, deck, q, materia="General", sistema="General"):
+        buf = self._buffers.setdefault(deck, (materia, sistema, []))[2]
+        buf.append(q)
+        self._buffered += 1
+        if len(buf) >= self.deck_size: self._flush(deck)
+        elif self._buffered >= self.max_buffered: self._flush(max(self._buffers, key=lambda d: len(self._buffers[d][2])))
+
+    def _flush(self, deck):
+        materia, sistema, preguntas = self._buffers.pop(deck)
+        self._buffered -= len(preguntas)
+        name = self._free_name(deck)
+        with tracing.span("intercambio.guardar"):
+            ok = self._save(name, preguntas, materia, sistema)
+        if ok: self.progress.decks.append(name)
+        else: self.progress.reject(name, f"no se pudo guardar ({len(preguntas)} tarjetas)")
+
+    def close(self):
+        for deck in list(self._buffers): self._flush(deck)
+
+
+def validate_card(obj):
+    """Tarjeta con el esquema del mazo (pregunta/opciones/respuesta_correcta/explicacion) o None."""
+    q = validate_question(obj)
+    if q is None: return None
+    refs = obj.get('imagenes')
+    if isinstance(refs, list) and refs and all(isinstance(r, dict) and isinstance(r.get('id'), str) for r in refs):
+        q['imagenes'] = refs
+    return q
+
+
+_BREAK = re.compile(r"<br\s*/?>|</(?:div|p|li|tr|h\d)>", re.I)
+_TAG = re.compile(r"<[^>]+>")
+_SOUND = re.compile(r"\[sound:[^\]]*\]")
+_CLOZE = re.compile(r"\{\{c\d+::(.*?)(?:::(.*?))?\}\}", re.S)
+
+
+def html_to_text(value):
+    text = _TAG.sub("", _BREAK.sub("\n", _SOUND.sub("", value)))
+    text = html.unescape(text).replace("\xa0", " ")
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def anki_note(names, values):
+    """Campos de una nota de Anki -> dict con el esquema del mazo (sin validar)."""
+    fields = dict(zip(names or [], values))
+    if fields.get("MedFlash"):
+        try: return json.loads(html.unescape(fields["MedFlash"]))  # exportada por MedFlash: sin pérdidas
+        except ValueError: pass
+    texts = [html_to_text(v) for v in values]
+    front, rest = (texts[0] if texts else ""), [t for t in texts[1:] if t]
+    if _CLOZE.search(front):
+        pregunta = _CLOZE.sub(lambda m: f"[{m.group(2) or '...'}]", front)
+        rest = [_CLOZE.sub(lambda m: f"**{m.group(1)}**", front)] + rest
+    else: pregunta = front
+    # Básica/Cloze no tienen opciones: la tarjeta se autoevalúa y el reverso va a la explicación.
+    return {"pregunta": pregunta, "opciones": dict(SELF_GRADED), "respuesta_correcta": "A", "explicacion": "\n\n".join(rest)}
+
+
+def _text_stream(stream):
+    if isinstance(stream, (str, os.PathLike)): return open(stream, encoding="utf-8-sig", errors="replace", newline="")
+    if isinstance(stream, io.TextIOBase): return stream
+    stream.seek(0)
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+
+
+def _release(text, stream):
+    # No cerrar el archivo del llamador (p.ej. el UploadedFile de Streamlit).
+    if text is stream: return
+    if isinstance(text, io.TextIOWrapper) and not isinstance(stream, (str, os.PathLike)): text.detach()
+    else: text.close()
+
+
+def read_jsonl(stream, default_deck):
+    """(dónde, obj|None, mazo, materia, sistema) por línea; obj None si la línea no es JSON."""
+    text = _text_stream(stream)
+    try:
+        for n, line in enumerate(text, 1):
+            line = line.strip()
+            if not line: continue
+            try: obj = json.loads(line)
+            except ValueError:
+                yield f"línea {n}", None, default_deck, "General", "General"
+                continue
+            if not isinstance(obj, dict): obj = {}
+            yield (f"línea {n}", obj, str(obj.get('mazo') or default_deck),
+                   str(obj.get('materia') or 'General'), str(obj.get('sistema') or 'General'))
+    finally:
+        _release(text, stream)
+
+
+_SEPARATORS = {"tab": "\t", "comma": ",", "semicolon": ";", "space": " ", "pipe": "|", "colon": ":"}
+
+
+def read_anki_text(stream, default_deck):
+    """Exportación "Notas en texto plano" de Anki (con o sin cabeceras #clave:valor)."""
+    text = _text_stream(stream)
+    try:
+        lines, headers, first = iter(text), {}, None
+        for line in lines:
+            if line.startswith("#") and ":" in line:
+                key, value = line[1:].split(":", 1)
+                headers[key.strip().lower()] = value.strip()
+                continue
+            first = line
+            break
+        sep = headers.get("separator", "tab")
+        sep = _SEPARATORS.get(sep.lower(), sep[:1] or "\t")
+        cols = {k: int(headers[f"{k} column"]) - 1 for k in ("deck", "tags", "guid", "notetype")
+                if headers.get(f"{k} column", "").isdigit()}
+        rows = csv.reader(itertools.chain([first] if first is not None else [], lines), delimiter=sep)
+        for n, row in enumerate(rows, 1):
+            if not any(row): continue
+            deck = row[cols["deck"]] if "deck" in cols and cols["deck"] < len(row) else default_deck
+            values = [v for i, v in enumerate(row) if i not in cols.values()]
+            yield f"fila {n}", anki_note(None, values), _deck_name(deck), "General", "General"
+    finally:
+        _release(text, stream)
+
+
+def _deck_name(anki_name):
+    name = anki_name.replace("\x1f", "::")
+    if name.startswith(f"{ANKI_ROOT}::"): name = name[len(ANKI_ROOT) + 2:]
+    return name.replace("::", " / ") or "Anki"
+
+
+def _anki_meta(con):
+    # {id de modelo: [campos]} y {id de mazo: nombre}; esquema clásico (JSON en col) o 18 (tablas).
+    tables = {r[0] for r in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "notetypes" in tables:
+        fields = {}
+        for ntid, name in con.execute("SELECT ntid, name FROM fields ORDER BY ntid, ord"): fields.setdefault(ntid, []).append(name)
+        return fields, dict(con.execute("SELECT id, name FROM decks"))
+    models, decks = con.execute("SELECT models, decks FROM col").fetchone()
+    fields = {int(mid): [f["name"] for f in sorted(m["flds"], key=lambda f: f["ord"])] for mid, m in json.loads(models).items()}
+    return fields, {int(did): d["name"] for did, d in json.loads(decks).items()}
+
+
+def read_apkg(stream):
+    """Notas de un .apkg/.colpkg; la colección se descomprime a un SQLite temporal y se lee por filas."""
+    tmpdir = tempfile.mkdtemp(prefix="medflash_apkg_")
+    try:
+        path = os.path.join(tmpdir, "collection")
+        with zipfile.ZipFile(stream) as z:
+            names = set(z.namelist())
+            if "collection.anki21b" in names:  # Anki >= 2.1.50: colección comprimida con zstd
+                if importlib.util.find_spec("zstandard") is None:
+                    raise ValueError("Este paquete usa el formato nuevo de Anki. Expórtalo marcando "
+                                     "'Compatibilidad con versiones anteriores de Anki' o instala 'zstandard'.")
+                with z.open("collection.anki21b") as src, open(path, "wb") as dst:
+                    zstandard.ZstdDecompressor().copy_stream(src, dst)
+            else:
+                member = next((m for m in ("collection.anki21", "collection.anki2") if m in names), None)
+                if member is None: raise ValueError("El archivo no contiene una colección de Anki.")
+                with z.open(member) as src, open(path, "wb") as dst: shutil.copyfileobj(src, dst, 1024 * 1024)
+        con = sqlite3.connect(path)
+        try:
+            fields, decks = _anki_meta(con)
+            rows = con.execute("SELECT n.id, n.mid, n.flds, MIN(c.did) AS did FROM notes n JOIN cards c ON c.nid = n.id "
+                               "GROUP BY n.id ORDER BY did, n.id")
+            for nid, mid, flds, did in rows:
+                yield f"nota {nid}", anki_note(fields.get(mid), flds.split("\x1f")), _deck_name(decks.get(did, "Anki")), "General", "General"
+        finally:
+            con.close()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def detect_format(filename):
+    fmt = FORMATS.get(os.path.splitext(filename.lower())[1])
+    if fmt is None: raise ValueError(f"Formato no soportado: {filename} (usa .jsonl, .apkg o texto de Anki)")
+    return fmt
+
+
+@tracing.traced("intercambio.importar")
+def import_file(stream, filename, writer):
+    """Importa un archivo (ruta o binario) con writer (DeckWriter). Devuelve su Progress."""
+    fmt = detect_format(filename)
+    default_deck = os.path.splitext(os.path.basename(filename))[0] or "Importado"
+    if fmt == "jsonl": records = read_jsonl(stream, default_deck)
+    elif fmt == "apkg": records = read_apkg(stream)
+    else: records = read_anki_text(stream, default_deck)
+    progress = writer.progress
+    for where, obj, deck, materia, sistema in records:
+        q = validate_card(obj) if obj is not None else None
+        if q is None:
+            progress.reject(where, "JSON inválido" if obj is None else "no cumple el esquema del mazo")
+            continue
+        writer.add(deck, q, materia, sistema)
+        progress.card()
+    writer.close()
+    return progress
+
+
+# --- Línea de comandos ---
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(prog="python -m medflash.intercambio", description="Exporta o importa la biblioteca de un usuario.")
+    p.add_argument("accion", choices=("exportar", "importar"))
+    p.add_argument("archivo", help="salida (.jsonl / .apkg) o archivo a importar (.jsonl, .apkg, .txt)")
+    p.add_argument("--user", required=True)
+    p.add_argument("--sin-imagenes", action="store_true", help="no incluir figuras en el .apkg")
+    p.add_argument("--backend", choices=("sqlite", "firestore"), default="sqlite")
+    p.add_argument("--sqlite", default=DEFAULT_SQLITE_PATH)
+    p.add_argument("--firebase-cred", default=None, help="ruta o JSON de la cuenta de servicio")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    storage, queue = batch.open_storage(args)
+    progress = Progress(lambda p: print(f"· {p.summary()}"), every=1000)
+    try:
+        if args.accion == "exportar":
+            decks = storage.iter_decks(args.user)
+            if detect_format(args.archivo) == "apkg":
+                export_apkg(decks, args.archivo, progress, None if args.sin_imagenes else imagenes.image_cache())
+            else:
+                with open(args.archivo, "w", encoding="utf-8") as out: export_jsonl(decks, out, progress)
+        else:
+            existing, known_cards = set(storage.get_deck_index(args.user)), storage.get_card_states(args.user)
+            def save(name, preguntas, materia, sistema):
+                batch.save_deck(storage, args.user, name, preguntas, materia, sistema, known_cards)
+                return True
+            import_file(args.archivo, args.archivo, DeckWriter(save, existing.__contains__, progress))
+    finally:
+        if queue:
+            print("Enviando escrituras pendientes a Firestore...")
+            queue.flush(timeout=60)
+            queue.close()
+    print(f"✓ {progress.summary()}")
+    for where, reason in progress.errors: print(f"  ✗ {where}: {reason}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
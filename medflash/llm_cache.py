@@ -0,0 +1,62 @@
+# --- CACHÉ DE RESPUESTAS DEL LLM ---
+# La clave es el hash de (modelo, prompt completo, parámetros de generación): la misma auditoría
+# de la misma clase pedida por otro estudiante se sirve sin llamar a la API.
+import hashlib
+import json
+import os
+
+from medflash import tracing
+from medflash.doc_cache import DEFAULT_CACHE_DIR, DocumentCache
+
+DEFAULT_TTL = float(os.environ.get("MEDFLASH_LLM_CACHE_TTL_H", "168")) * 3600
+DEFAULT_MAX_BYTES = int(float(os.environ.get("MEDFLASH_LLM_CACHE_MB", "256")) * 1024 * 1024)
+
+
+def prompt_key(model_name, prompt, params=None):
+    payload = json.dumps([model_name, prompt, params or {}], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache(DocumentCache):
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, memory_items=64, ttl=DEFAULT_TTL):
+        super().__init__(root, max_bytes, memory_items, namespace="llm", ttl=ttl)
+
+
+class CachedResponse:
+    """Imita la respuesta del SDK (.text) y, en streaming, se itera como un único trozo."""
+
+    def __init__(self, text):
+        self.text = text
+
+    def __iter__(self):
+        yield self
+
+
+class CachedModel:
+    """Envuelve un GenerativeModel: generate_content consulta la caché antes de llamar a la API."""
+
+    def __init__(self, model, cache, model_name):
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream=False, **params):
+        key = prompt_key(self.model_name, prompt, params)
+        text = self.cache.get(key)
+        if text is not None:
+            tracing.count("llm_cache_hits")
+            return CachedResponse(text)
+        if not stream:
+            response = self.model.generate_content(prompt, **params)
+            self.cache.put(key, response.text)
+            return response
+        return self._stream_and_store(key, prompt, params)
+
+    def _stream_and_store(self, key, prompt, params):
+        parts = []
+        for chunk in self.model.generate_content(prompt, stream=True, **params):
+            try: parts.append(chunk.text)
+            except ValueError: pass
+            yield chunk
+        # Sólo se guarda una respuesta completa; un stream cortado no deja basura en caché.
+        if parts: self.cache.put(key, "".join(parts))
@@ -0,0 +1,218 @@
+# --- CLIENTE GEMINI COMPARTIDO ---
+# Una instancia por proceso (st.cache_resource) que ponen en fila todas las sesiones:
+# token bucket de peticiones/min y tokens/min, concurrencia acotada, reintentos con backoff
+# exponencial + jitter ante 429/5xx, y single-flight para prompts idénticos en vuelo.
+import os
+import random
+import threading
+import time
+
+from medflash import tracing
+from medflash.llm_cache import CachedResponse, prompt_key
+
+DEFAULT_RPM = int(os.environ.get("GEMINI_RPM", "60"))
+DEFAULT_TPM = int(os.environ.get("GEMINI_TPM", "1000000"))
+DEFAULT_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "8"))
+CHARS_PER_TOKEN = 4
+COALESCE_TIMEOUT = 300.0  # si el líder no termina en este tiempo, el seguidor llama por su cuenta
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+RETRYABLE_NAMES = {"ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "InternalServerError",
+                   "TooManyRequests", "GatewayTimeout", "TimeoutError", "ConnectionError"}
+
+
+def is_retryable(e):
+    code = getattr(e, "code", None)
+    code = getattr(code, "value", code)  # grpc.StatusCode o int
+    if isinstance(code, int) and code in RETRYABLE_CODES: return True
+    if type(e).__name__ in RETRYABLE_NAMES: return True
+    return "429" in str(e) or "quota" in str(e).lower()
+
+
+def prompt_chars(prompt):
+    return len(prompt) if isinstance(prompt, str) else sum(len(str(p)) + 1 for p in prompt)
+
+
+def estimate_tokens(prompt, expected_output=2000):
+    return prompt_chars(prompt) // CHARS_PER_TOKEN + expected_output
+
+
+class TokenBucket:
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = float(per_minute)
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, n):
+        """Descuenta n (puede quedar en negativo) y devuelve cuántos segundos hay que esperar."""
+        self._refill()
+        n = min(n, self.capacity)
+        self.tokens -= n
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.text = None
+        self.error = None
+
+
+class GeminiClient:
+    def __init__(self, model, model_name="", rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_concurrency=DEFAULT_CONCURRENCY,
+                 max_retries=5, base_delay=1.0, max_delay=30.0, expected_output_tokens=2000,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.model = model
+        self.model_name = model_name
+        self.max_retries = max_retries
+        self.base_delay, self.max_delay = base_delay, max_delay
+        self.expected_output_tokens = expected_output_tokens
+        self.clock, self.sleep = clock, sleep
+        self._requests = TokenBucket(rpm, clock)
+        self._tokens = TokenBucket(tpm, clock)
+        self._bucket_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = self.retries = self.coalesced = self.errors = 0
+        self.total_wait = self.last_wait = 0.0
+
+    # --- Control de admisión ---
+    def _admit(self, prompt):
+        t0 = self.clock()
+        with self._lock: self.waiting += 1
+        try:
+            with self._bucket_lock:
+                delay = max(self._requests.reserve(1),
+                            self._tokens.reserve(estimate_tokens(prompt, self.expected_output_tokens)))
+            if delay > 0: self.sleep(delay)
+            self._slots.acquire()
+        finally:
+            with self._lock: self.waiting -= 1
+        # Sólo cuenta como admitida (y su espera) si obtuvo hueco.
+        waited = self.clock() - t0
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+            self.total_wait += waited
+            self.last_wait = waited
+
+    def _release(self):
+        self._slots.release()
+        with self._lock: self.in_flight -= 1
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(0, delay)  # full jitter: las sesiones no reintentan a la vez
+
+    def _call(self, prompt, params):
+        t0, counters = time.perf_counter(), {"llm_prompt_chars": prompt_chars(prompt)}
+        try:
+            text = self._call_retrying(prompt, params)
+            counters["llm_response_chars"] = len(text or "")
+            return text
+        except Exception:
+            counters["errores"] = 1
+            raise
+        finally: tracing.record("llm.generate", t0, counters)
+
+    def _call_retrying(self, prompt, params):
+        for attempt in range(self.max_retries + 1):
+            self._admit(prompt)
+            try: return self.model.generate_content(prompt, **params).text
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    with self._lock: self.errors += 1
+                    raise
+                with self._lock: self.retries += 1
+            finally: self._release()
+            self.sleep(self._backoff(attempt))
+
+    def _stream(self, prompt, params):
+        for attempt in range(self.max_retries + 1):
+            self._admit(prompt)
+            started = False
+            try:
+                for chunk in self.model.generate_content(prompt, stream=True, **params):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                # Una vez entregados trozos no se puede reintentar sin duplicar texto.
+                if started or attempt >= self.max_retries or not is_retryable(e):
+                    with self._lock: self.errors += 1
+                    raise
+                with self._lock: self.retries += 1
+            finally: self._release()
+            self.sleep(self._backoff(attempt))
+
+    # --- API compatible con GenerativeModel ---
+    def generate_content(self, prompt, stream=False, **params):
+        key = prompt_key(self.model_name, prompt, params)
+        if stream: return self._stream_flight(key, prompt, params)
+        flight, leader = self._join(key)
+        if not leader: return self._follow(flight, prompt, params)
+        try:
+            flight.text = self._call(prompt, params)
+            return CachedResponse(flight.text)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally: self._land(key, flight)
+
+    def _join(self, key):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader: flight = self._flights[key] = _Flight()
+            else: self.coalesced += 1
+        return flight, leader
+
+    def _follow(self, flight, prompt, params):
+        if not flight.done.wait(COALESCE_TIMEOUT): return CachedResponse(self._call(prompt, params))
+        if flight.error is not None: raise flight.error
+        return CachedResponse(flight.text)
+
+    def _stream_flight(self, key, prompt, params):
+        # El vuelo se registra al empezar a iterar: un stream que nunca se consume no deja esperando a nadie.
+        flight, leader = self._join(key)
+        if not leader: yield from self._follow(flight, prompt, params)
+        else: yield from self._lead_stream(key, flight, prompt, params)
+
+    def _lead_stream(self, key, flight, prompt, params):
+        parts, t0 = [], time.perf_counter()
+        try:
+            for chunk in self._stream(prompt, params):
+                try: parts.append(chunk.text)
+                except ValueError: pass
+                yield chunk
+            flight.text = "".join(parts)
+        except BaseException as e:
+            flight.error = e if isinstance(e, Exception) else RuntimeError("stream cancelado")
+            raise
+        finally:
+            self._land(key, flight)
+            counters = {"llm_prompt_chars": prompt_chars(prompt), "llm_response_chars": sum(map(len, parts))}
+            if flight.error is not None: counters["errores"] = 1
+            tracing.record("llm.stream", t0, counters)
+
+    def _land(self, key, flight):
+        if flight.text is None and flight.error is None: flight.error = RuntimeError("respuesta incompleta")
+        with self._lock: self._flights.pop(key, None)
+        flight.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"en_cola": self.waiting, "en_vuelo": self.in_flight, "llamadas": self.calls,
+                    "reintentos": self.retries, "coalescidas": self.coalesced, "errores": self.errors,
+                    "espera_media_s": self.total_wait / self.calls if self.calls else 0.0,
+                    "ultima_espera_s": self.last_wait}
+
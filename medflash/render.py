@@ -0,0 +1,56 @@
+# --- HTML PRE-RENDERIZADO DE TARJETAS ---
+# La explicación de cada pregunta es Markdown (con tablas). Se convierte a HTML una sola vez por
+# texto y se guarda en un LRU del proceso, para que la vista de estudio sólo tenga que volcarlo.
+import hashlib
+import html
+import threading
+from collections import OrderedDict
+
+from medflash import deps
+
+markdown = deps.lazy_module("markdown")
+
+MAX_ENTRIES = 4096
+EXTENSIONS = ["tables", "sane_lists"]
+
+_lock = threading.Lock()
+_html = OrderedDict()  # sha1(texto) -> html
+
+
+def _separate_tables(text):
+    # Python-Markdown exige una línea en blanco antes de una tabla; el renderizador de Streamlit (GFM) no.
+    lines, prev = [], ""
+    for line in text.split("\n"):
+        if line.lstrip().startswith("|") and prev.strip() and not prev.lstrip().startswith("|"): lines.append("")
+        lines.append(line)
+        prev = line
+    return "\n".join(lines)
+
+
+def to_html(text, remember=True):
+    """Markdown -> HTML, memorizado por contenido (LRU de MAX_ENTRIES textos). remember=False para
+    recorridos de una sola pasada (exportación) que no deben desalojar lo que se está estudiando."""
+    text = str(text or "")
+    if not remember: return markdown.markdown(_separate_tables(text), extensions=EXTENSIONS)
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    with _lock:
+        if key in _html:
+            _html.move_to_end(key)
+            return _html[key]
+    rendered = markdown.markdown(_separate_tables(text), extensions=EXTENSIONS)
+    with _lock:
+        _html[key] = rendered
+        while len(_html) > MAX_ENTRIES: _html.popitem(last=False)
+    return rendered
+
+
+def question_html(q):
+    return f'<div class="flashcard"><h5>{to_html(q.get("pregunta", ""))}</h5></div>'
+
+
+def feedback_html(ok, correcta, explicacion):
+    """Bloque completo de corrección + explicación, en un único elemento."""
+    if ok: header = '<div class="feedback-correct">✅ ¡EXCELENTE! RESPUESTA CORRECTA</div>'
+    else: header = f'<div class="feedback-incorrect">❌ INCORRECTO. RESPUESTA REAL: {html.escape(str(correcta))}</div>'
+    return (f'<div class="feedback-container">{header}'
+            f'<div class="feedback-explanation">{to_html(explicacion)}</div></div>')
@@ -0,0 +1,147 @@
+# --- MAZOS EN FRAGMENTOS COMPRIMIDOS ---
+# Un mazo de unos cientos de preguntas con explicaciones en Markdown ya no cabe en un documento
+# de Firestore (1 MiB) y, aunque cupiera, estudiarlo obligaría a descargarlo entero. Las
+# preguntas se guardan en fragmentos de SHARD_SIZE (menos si comprimidos superarían
+# MAX_SHARD_BYTES): JSON comprimido con zlib, direccionado por su hash. Una cabecera pequeña
+# guarda el orden (card_id de cada pregunta) y la lista de fragmentos con su tamaño; el id de
+# cada fragmento es su suma de comprobación. LazyDeck se usa como la lista de preguntas pero
+# sólo descarga el fragmento donde cae el índice pedido y adelanta el siguiente.
+import bisect
+import hashlib
+import json
+import threading
+import zlib
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from medflash import tracing
+from medflash.srs import card_id
+
+FORMAT = 2
+SHARD_SIZE = 25
+MAX_SHARD_BYTES = 256 * 1024   # comprimido: ninguna lectura de un fragmento pasa de aquí
+PREFETCH_AHEAD = 5             # a tantas preguntas del final de un fragmento se pide el siguiente
+
+_prefetch_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="medflash-shards")
+
+
+class CorruptShard(ValueError):
+    """Fragmento ausente o cuyo contenido no coincide con la suma de la cabecera."""
+
+
+def checksum(blob):
+    return hashlib.sha256(blob).hexdigest()[:24]
+
+
+def encode(preguntas):
+    return zlib.compress(json.dumps(preguntas, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+
+
+def decode(blob, expected):
+    if blob is None or checksum(bytes(blob)) != expected: raise CorruptShard(f"fragmento {expected}")
+    return json.loads(zlib.decompress(bytes(blob)).decode("utf-8"))
+
+
+def _pack(preguntas, shard_size, max_bytes):
+    # Trozos de shard_size preguntas; el que comprimido se pase de max_bytes se parte en dos.
+    out = []
+    for i in range(0, len(preguntas), shard_size):
+        pending = [preguntas[i:i + shard_size]]
+        while pending:
+            chunk = pending.pop(0)
+            blob = encode(chunk)
+            if len(blob) <= max_bytes: out.append((chunk, blob))
+            elif len(chunk) == 1: raise ValueError(f"una pregunta ocupa {len(blob)} bytes comprimida (máx. {max_bytes})")
+            else: pending[:0] = [chunk[:len(chunk) // 2], chunk[len(chunk) // 2:]]
+    return out
+
+
+def build(deck, shard_size=SHARD_SIZE, max_bytes=MAX_SHARD_BYTES):
+    """
+    Mazo {'preguntas': [...], ...} -> (cabecera, [(id, bytes)]). La cabecera lleva todo lo
+    demás del mazo más 'formato', 'orden' y 'shards' ([[id, nº de preguntas]] en orden).
+    """
+    preguntas = list(deck.get('preguntas', []))
+    packed = [(checksum(blob), chunk, blob) for chunk, blob in _pack(preguntas, shard_size, max_bytes)]
+    header = {k: v for k, v in deck.items() if k != 'preguntas'}
+    header.update(formato=FORMAT, orden=[card_id(q) for q in preguntas],
+                  shards=[[sid, len(chunk)] for sid, chunk, _ in packed])
+    return header, [(sid, blob) for sid, _, blob in packed]
+
+
+def shard_ids(header):
+    return [sid for sid, _ in header.get('shards', [])]
+
+
+class LazyDeck(Sequence):
+    """
+    Lista de preguntas de solo lectura respaldada por fragmentos. load(id) -> bytes del
+    fragmento; cada uno se descarga una sola vez (también si lo piden dos hilos a la vez).
+    """
+
+    def __init__(self, header, load, prefetch=True):
+        self.order = list(header.get('orden', []))
+        self.ids = shard_ids(header)
+        self._starts, total = [], 0
+        for _, n in header.get('shards', []): self._starts.append(total); total += n
+        self._load = load
+        self._prefetch = prefetch
+        self._lock = threading.Lock()
+        self._futures = {}  # k -> Future con las preguntas del fragmento k
+
+    def __len__(self):
+        return len(self.order)
+
+    @property
+    def loaded(self):
+        with self._lock: return sum(1 for f in self._futures.values() if f.done() and not f.exception())
+
+    def _shard_of(self, i):
+        return bisect.bisect_right(self._starts, i) - 1
+
+    def shard(self, k):
+        with self._lock:
+            fut = self._futures.get(k)
+            owner = fut is None
+            if owner: fut = self._futures[k] = Future()
+        if owner:
+            try: fut.set_result(decode(self._load(self.ids[k]), self.ids[k]))
+            except Exception as e:
+                with self._lock: self._futures.pop(k, None)  # el siguiente intento vuelve a leer
+                fut.set_exception(e)
+        return fut.result()
+
+    def prefetch(self, k):
+        if not self._prefetch or not 0 <= k < len(self.ids): return
+        with self._lock:
+            if k in self._futures: return
+        _prefetch_pool.submit(tracing.wrap_context(self._quiet_shard), k)
+
+    def _quiet_shard(self, k):
+        try: self.shard(k)
+        except Exception as e: tracing.error("fragmento", e)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice): return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0: i += len(self)
+        if not 0 <= i < len(self): raise IndexError(i)
+        k = self._shard_of(i)
+        questions = self.shard(k)
+        if i - self._starts[k] >= len(questions) - PREFETCH_AHEAD: self.prefetch(k + 1)
+        return questions[i - self._starts[k]]
+
+    def __iter__(self):
+        for k in range(len(self.ids)):
+            self.prefetch(k + 1)
+            yield from self.shard(k)
+
+    def pick(self, cids):
+        """{card_id: pregunta} de las pedidas, descargando sólo los fragmentos que las contienen."""
+        wanted = [i for i, cid in enumerate(self.order) if cid in cids]
+        return {self.order[i]: self[i] for i in wanted}
+
+
+def pick(preguntas, cids):
+    """Como LazyDeck.pick, también para listas normales (mazos en formato antiguo o SQLite)."""
+    if isinstance(preguntas, LazyDeck): return preguntas.pick(cids)
+    return {cid: q for cid, q in ((card_id(q), q) for q in preguntas) if cid in cids}
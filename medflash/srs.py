@@ -0,0 +1,127 @@
+# --- REPETICIÓN ESPACIADA (SM-2) ---
+# Estado compacto por tarjeta: [facilidad, intervalo_días, vence_ts, fallos, repeticiones, mazo,
+# otros mazos...], indexado por un id estable derivado del contenido de la pregunta: una misma
+# tarjeta en varios mazos comparte calendario y los lista todos (el primero es de donde se
+# carga la pregunta). Plano y sin listas anidadas, como lo guarda Firestore. DueQueue es un heap con
+# invalidación perezosa: las N próximas tarjetas vencidas de todos los mazos salen en
+# O(log n) cada una, sin cargar ningún mazo.
+import hashlib
+import heapq
+import time
+
+EASE_START = 2.5
+EASE_MIN = 1.3
+RELEARN_SECONDS = 600  # una tarjeta fallada vuelve a la cola a los 10 minutos
+DAY = 86400
+
+EASE, INTERVAL, DUE, LAPSES, REPS, DECK = range(6)  # DECK: primer mazo; state[DECK:] son todos
+
+
+def card_id(question):
+    opciones = question.get('opciones', {})
+    key = question.get('pregunta', '') + "\x1f" + "\x1f".join(f"{k}={opciones[k]}" for k in sorted(opciones))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def new_state(deck, now=None):
+    return [EASE_START, 0.0, now or time.time(), 0, 0, deck]
+
+
+def decks(state):
+    return list(state[DECK:])
+
+
+def with_deck(state, deck):
+    """El estado con deck entre sus mazos (el mismo objeto si ya estaba)."""
+    return state if deck in state[DECK:] else list(state) + [deck]
+
+
+def without_deck(state, deck):
+    """El estado sin deck entre sus mazos, o None si no le queda ninguno."""
+    rest = [d for d in state[DECK:] if d != deck]
+    return list(state[:DECK]) + rest if rest else None
+
+
+def review(state, quality, now=None):
+    """SM-2: quality 0-5 (>=3 es acierto). Devuelve un estado nuevo."""
+    now = now or time.time()
+    ease, interval, _, lapses, reps, *mazos = state
+    if quality < 3:
+        reps, lapses, interval = 0, lapses + 1, 0.0
+        due = now + RELEARN_SECONDS
+    else:
+        reps += 1
+        interval = 1.0 if reps == 1 else 6.0 if reps == 2 else round(max(interval, 1.0) * ease, 1)
+        due = now + interval * DAY
+    ease = max(EASE_MIN, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return [round(ease, 3), interval, due, lapses, reps, *mazos]
+
+
+def quality_from_answer(correct, latency=None):
+    if not correct: return 1
+    if latency is not None and latency > 60: return 3  # acierto, pero costó
+    return 4
+
+
+class DueQueue:
+    def __init__(self, states=None):
+        self.states = {}
+        self._heap = []
+        # Recuento incremental de vencidas: _counted son las que vencen antes de _horizon (el
+        # último count_due) y _uncounted el heap de las demás, que se cuentan al irse alcanzando.
+        self._counted = set()
+        self._uncounted = []
+        self._horizon = float("-inf")
+        for cid, state in (states or {}).items(): self.push(cid, state)
+
+    def push(self, cid, state):
+        self.states[cid] = state
+        heapq.heappush(self._heap, (state[DUE], cid))
+        self._counted.discard(cid)
+        if state[DUE] <= self._horizon: self._counted.add(cid)
+        else: heapq.heappush(self._uncounted, (state[DUE], cid))
+
+    def remove_deck(self, deck):
+        """Quita deck de sus tarjetas; las que no quedan en otro mazo salen de la cola. Devuelve
+        {card_id: estado nuevo | None} de las afectadas (lo que hay que escribir o borrar)."""
+        changed = {cid: without_deck(s, deck) for cid, s in self.states.items() if deck in s[DECK:]}
+        for cid, state in changed.items():
+            if state is None:
+                del self.states[cid]
+                self._counted.discard(cid)
+            else: self.states[cid] = state  # el vencimiento no cambia: su entrada del heap sigue valiendo
+        return changed
+
+    def _clean_top(self):
+        # Entradas viejas del heap (tarjeta re-programada o borrada) se descartan al llegar arriba.
+        while self._heap:
+            due, cid = self._heap[0]
+            state = self.states.get(cid)
+            if state is not None and state[DUE] == due: return
+            heapq.heappop(self._heap)
+
+    def due(self, n, now=None):
+        """Las n tarjetas con vencimiento más antiguo que ya vencieron: [(card_id, estado)]."""
+        now = now or time.time()
+        out, popped = [], []
+        self._clean_top()
+        while self._heap and len(out) < n and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            popped.append(entry)
+            out.append((entry[1], self.states[entry[1]]))
+            self._clean_top()
+        for entry in popped: heapq.heappush(self._heap, entry)
+        return out
+
+    def count_due(self, now=None):
+        """Tarjetas vencidas; coste proporcional a las que vencieron desde la llamada anterior."""
+        now = max(now or time.time(), self._horizon)  # el horizonte sólo avanza
+        while self._uncounted and self._uncounted[0][0] <= now:
+            due, cid = heapq.heappop(self._uncounted)
+            state = self.states.get(cid)
+            if state is not None and state[DUE] == due: self._counted.add(cid)  # si no, entrada vieja
+        self._horizon = now
+        return len(self._counted)
+
+    def __len__(self):
+        return len(self.states)
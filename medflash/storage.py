@@ -0,0 +1,486 @@
+# --- CAPA DE ALMACENAMIENTO ---
+# Los helpers del script (register_new_user, get_user_decks, save_user_deck...) hablan con
+# un StorageBackend. FirestoreBackend es la nube (con la cola write-behind); SQLiteBackend es
+# un único archivo en modo WAL compartido por todas las sesiones del proceso, para
+# despliegues de un solo nodo y como sustituto local de Firestore.
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from medflash import analytics, deps, shards, srs, tracing
+from medflash import write_queue as wq
+from medflash.auth import CREDENTIAL_FIELDS
+from medflash.doc_cache import DEFAULT_CACHE_DIR
+
+firestore = deps.lazy_module("firebase_admin.firestore")
+
+DEFAULT_SQLITE_PATH = os.environ.get("MEDFLASH_SQLITE_PATH", os.path.join(DEFAULT_CACHE_DIR, "medflash.db"))
+MAX_GROUP_BYTES = 8 * 1024 * 1024  # por batch de fragmentos (Firestore acepta hasta 10 MiB por commit)
+INDEX_FLUSH_TIMEOUT = 5.0          # s que la migración del índice espera a la cola del usuario
+SRS_PREFIX = 1                     # caracteres del card_id por documento de estados: 16 documentos
+
+
+def deck_meta(deck):
+    # Entrada del índice de mazos: lo justo para listar/filtrar sin descargar las preguntas.
+    return {'materia': deck.get('materia', 'General'), 'sistema': deck.get('sistema', 'General'),
+            'n': len(deck.get('preguntas', [])), 'creado': as_epoch(deck.get('creado'))}
+
+
+def as_epoch(creado):
+    if hasattr(creado, 'timestamp'): return creado.timestamp()
+    try: return float(creado)
+    except (TypeError, ValueError): return 0.0
+
+
+class StorageBackend:
+    name = "base"
+
+    def get_user_credentials(self, username): raise NotImplementedError
+    def find_username(self, username): return None  # id guardado que coincide sin mayúsculas/minúsculas
+    def create_user(self, username, user_data): raise NotImplementedError  # False si ya existe
+    def get_progress(self, username): raise NotImplementedError
+    def apply_exam(self, username, materia, level, xp_delta, exam_id): raise NotImplementedError
+    def get_deck_index(self, username): raise NotImplementedError
+    def get_deck(self, username, name): raise NotImplementedError
+    def iter_decks(self, username): raise NotImplementedError  # (nombre, mazo) de uno en uno
+    def save_deck(self, username, name, deck): raise NotImplementedError
+    def delete_deck(self, username, name): raise NotImplementedError
+    # Repetición espaciada: estados compactos por tarjeta (ver medflash/srs.py)
+    def get_card_states(self, username): raise NotImplementedError
+    def save_card_states(self, username, states): raise NotImplementedError
+    def delete_card_states(self, username, deck, states=None): raise NotImplementedError  # states: los que ya tenga el llamador
+    # Intentos: lotes de eventos sólo-añadir + rollups incrementales (ver medflash/analytics.py)
+    def append_attempts(self, username, batch_id, events, deltas): raise NotImplementedError
+    def get_attempt_rollups(self, username): raise NotImplementedError
+
+    def pending(self, username=None):
+        return 0
+
+
+# --- FIRESTORE ---
+class FirestoreBackend(StorageBackend):
+    name = "firestore"
+
+    def __init__(self, db, write_queue, recent_decks=64):
+        self.db = db
+        self.queue = write_queue
+        # Mazos recién guardados (quizá aún en la cola): la lectura siguiente no debe perderlos.
+        self._recent = OrderedDict()
+        self._recent_max = recent_decks
+        self._stored = {}  # (usuario, mazo) -> ids de fragmentos de la última versión guardada aquí
+        self._aliases = None  # minúsculas -> id de los usuarios antiguos con mayúsculas
+        self._lock = threading.Lock()
+
+    def _user(self, username):
+        return self.db.collection('usuarios').document(username)
+
+    def _read(self, ref, **kwargs):
+        tracing.count("firestore_reads")
+        return ref.get(**kwargs)
+
+    def get_user_credentials(self, username):
+        doc = self._read(self._user(username), field_paths=CREDENTIAL_FIELDS)
+        if doc.exists:
+            data = doc.to_dict() or {}
+            if 'password' in data: return {k: data.get(k) for k in CREDENTIAL_FIELDS}
+        return None
+
+    def find_username(self, username):
+        # Los ids con mayúsculas son de antes de normalizar (ya no se crean): se listan una vez
+        # por proceso, sin leer los documentos.
+        with self._lock: aliases = self._aliases
+        if aliases is None:
+            ids = [ref.id for ref in self.db.collection('usuarios').list_documents()]
+            aliases = {i.lower(): i for i in ids if i != i.lower()}
+            with self._lock: self._aliases = aliases
+        return aliases.get(username.lower())
+
+    def create_user(self, username, user_data):
+        if self._read(self._user(username), field_paths=['password']).exists: return False
+        self.queue.set(['usuarios', username], user_data)
+        return True
+
+    def get_progress(self, username):
+        doc = self._read(self._user(username), field_paths=['progreso'])
+        return (doc.to_dict() or {}).get('progreso', {}) if doc.exists else {}
+
+    def apply_exam(self, username, materia, level, xp_delta, exam_id):
+        # La marca del examen es la clave de idempotencia: create() síncrono falla si otra pestaña
+        # (u otro proceso) ya lo aplicó. El XP va luego por la cola como Increment, sin reescribir 'progreso'.
+        ref = self._user(username).collection('examenes').document(exam_id)
+        try: ref.create({'materia': materia, 'aprobado': xp_delta > 0, 'fecha': firestore.SERVER_TIMESTAMP})
+        except Exception as e:
+            if type(e).__name__ in ("AlreadyExists", "Conflict"): return False
+            raise
+        tracing.count("firestore_writes")
+        self.queue.set(['usuarios', username], {'progreso': {materia: {'level': level, 'xp': wq.increment(xp_delta)}}},
+                       merge=True)
+        return True
+
+    def _index_ref(self, username):
+        return self._user(username).collection('meta').document('mazos_index')
+
+    def get_deck_index(self, username):
+        doc = self._read(self._index_ref(username))
+        if doc.exists: index = dict((doc.to_dict() or {}).get('mazos', {}))
+        else:
+            # Migración única: los usuarios anteriores al índice lo construyen una vez. Antes se
+            # vacía lo pendiente del usuario (un borrado encolado resucitaría el mazo) y el índice
+            # va por la cola, detrás de esas escrituras; si la cola no llega a vaciarse, no se guarda.
+            settled = not self.queue.pending(['usuarios', username]) or self.queue.flush(INDEX_FLUSH_TIMEOUT)
+            index = {k: deck_meta(v) for k, v in self.iter_decks(username)}
+            if settled: self.queue.set(['usuarios', username, 'meta', 'mazos_index'], {'mazos': index}, merge=True)
+        with self._lock:
+            for (u, name), deck in self._recent.items():
+                if u == username: index[name] = deck_meta(deck)
+        return index
+
+    # Mazos: cabecera en mazos/{nombre} y preguntas en mazos/{nombre}/fragmentos/{id} (ver
+    # medflash/shards.py). Los mazos antiguos, con 'preguntas' en la cabecera, se siguen leyendo.
+    def _deck_path(self, username, name):
+        return ['usuarios', username, 'mazos', name]
+
+    def _open_deck(self, username, name, data):
+        if not isinstance(data, dict): return None
+        if 'preguntas' in data: return data
+        if 'shards' not in data: return None
+        col = self._user(username).collection('mazos').document(name).collection('fragmentos')
+        def load(shard_id):
+            doc = self._read(col.document(shard_id))
+            return (doc.to_dict() or {}).get('datos') if doc.exists else None
+        return dict(data, preguntas=shards.LazyDeck(data, load))
+
+    def get_deck(self, username, name):
+        with self._lock:
+            if (username, name) in self._recent: return self._recent[(username, name)]
+        doc = self._read(self._user(username).collection('mazos').document(name))
+        return self._open_deck(username, name, doc.to_dict() if doc.exists else None)
+
+    def iter_decks(self, username):
+        for d in self._user(username).collection('mazos').stream():
+            tracing.count("firestore_reads")
+            deck = self._open_deck(username, d.id, d.to_dict())
+            if deck: yield d.id, deck
+
+    def _stored_shards(self, username, name):
+        # Fragmentos de la versión guardada (para borrar los que la nueva ya no usa).
+        with self._lock:
+            if (username, name) in self._stored: return self._stored[(username, name)]
+        doc = self._read(self._user(username).collection('mazos').document(name), field_paths=['shards'])
+        return shards.shard_ids(doc.to_dict() or {}) if doc.exists else []
+
+    def save_deck(self, username, name, deck):
+        header, blobs = shards.build(deck)
+        new_ids = shards.shard_ids(header)
+        old = set(self._stored_shards(username, name)) - set(new_ids)
+        path = self._deck_path(username, name)
+        save_id = time.time_ns()  # grupos propios de este guardado: no se funden con uno anterior aún en cola
+        # Primero los fragmentos (ids por contenido: no pisan los de la versión anterior), después
+        # la cabecera y el índice que los referencian; hasta entonces los lectores siguen viendo
+        # el mazo viejo. Se apoya en que la cola envía en orden de encolado (grupos = barreras).
+        group, size = [], 0
+        for sid, blob in blobs:
+            if group and (size + len(blob) > MAX_GROUP_BYTES or len(group) >= wq.BATCH_LIMIT):
+                self.queue.submit(group, group=f"fragmentos:{username}:{name}:{save_id}:{group[0][1][-1]}")
+                group, size = [], 0
+            group.append(('set', path + ['fragmentos', sid], {'datos': wq.blob(blob)}, False))
+            size += len(blob)
+        if group: self.queue.submit(group, group=f"fragmentos:{username}:{name}:{save_id}:{group[0][1][-1]}")
+        self.queue.submit([
+            ('set', path, dict(header, creado=wq.SERVER_TIMESTAMP), False),
+            ('set', ['usuarios', username, 'meta', 'mazos_index'], {'mazos': {name: deck_meta(deck)}}, True),
+        ], group=f"mazo:{username}:{name}:{save_id}")
+        # Los fragmentos viejos ya no los referencia nadie: se borran después, en grupos de BATCH_LIMIT.
+        old = [('delete', path + ['fragmentos', sid]) for sid in sorted(old)]
+        for i in range(0, len(old), wq.BATCH_LIMIT):
+            self.queue.submit(old[i:i + wq.BATCH_LIMIT], group=f"limpieza:{username}:{name}:{save_id}:{i}")
+        with self._lock:
+            self._stored[(username, name)] = new_ids
+            self._recent[(username, name)] = deck
+            self._recent.move_to_end((username, name))
+            while len(self._recent) > self._recent_max: self._recent.popitem(last=False)
+        return True
+
+    def delete_deck(self, username, name):
+        stored = self._stored_shards(username, name)
+        with self._lock:
+            self._recent.pop((username, name), None)
+            self._stored[(username, name)] = []
+        path = self._deck_path(username, name)
+        ops = [('delete', path + ['fragmentos', sid]) for sid in stored]
+        last = [('delete', path),
+                ('set', ['usuarios', username, 'meta', 'mazos_index'], {'mazos': {name: wq.DELETE_FIELD}}, True)]
+        delete_id = time.time_ns()
+        # Grupos de hasta BATCH_LIMIT escrituras; la cabecera y la entrada del índice, en el último.
+        while len(ops) + len(last) > wq.BATCH_LIMIT:
+            chunk, ops = ops[:wq.BATCH_LIMIT], ops[wq.BATCH_LIMIT:]
+            self.queue.submit(chunk, group=f"borrar:{username}:{name}:{delete_id}:{chunk[0][1][-1]}")
+        self.queue.submit(ops + last, group=f"borrar:{username}:{name}:{delete_id}")
+        return True
+
+    # Estados SRS repartidos por el primer carácter del card_id en usuarios/{u}/srs/{0-f}: con
+    # decenas de miles de tarjetas ningún documento se acerca al límite de 1 MiB de Firestore.
+    def _srs_path(self, username, cid):
+        return ['usuarios', username, 'srs', cid[:SRS_PREFIX]]
+
+    def _submit_srs(self, username, cards):
+        by_doc = {}
+        for cid, value in cards.items(): by_doc.setdefault(cid[:SRS_PREFIX], {})[cid] = value
+        for prefix in sorted(by_doc):
+            self.queue.set(self._srs_path(username, prefix), {'cards': by_doc[prefix]}, merge=True)
+
+    def get_card_states(self, username):
+        states = {}
+        legacy = self._read(self._user(username).collection('meta').document('srs'))
+        if legacy.exists: states.update((legacy.to_dict() or {}).get('cards', {}))
+        for d in self._user(username).collection('srs').stream():
+            tracing.count("firestore_reads")
+            states.update((d.to_dict() or {}).get('cards', {}))
+        if legacy.exists and not self.queue.pending(['usuarios', username, 'srs']):
+            # Migración única del documento meta/srs (un solo mapa) a los documentos repartidos;
+            # con escrituras SRS aún en cola se deja para otra carga, para no pisarlas.
+            self._submit_srs(username, states)
+            self.queue.delete(['usuarios', username, 'meta', 'srs'])
+        return states
+
+    def save_card_states(self, username, states):
+        # Una respuesta = un merge-set de una sola entrada del mapa; la cola lo fusiona.
+        self._submit_srs(username, states)
+
+    def delete_card_states(self, username, deck, states=None):
+        # Con los estados que ya tiene la sesión (su DueQueue) no se vuelve a leer el mapa entero.
+        # Una tarjeta que sigue en otro mazo conserva su estado; sólo pierde este mazo.
+        if states is None: states = self.get_card_states(username)
+        changes = {cid: srs.without_deck(st_, deck) for cid, st_ in states.items() if deck in srs.decks(st_)}
+        self._submit_srs(username, {cid: wq.DELETE_FIELD if st_ is None else st_ for cid, st_ in changes.items()})
+
+    def append_attempts(self, username, batch_id, events, deltas):
+        # Un documento columnar por lote + Increment de los rollups, en un grupo atómico e idempotente.
+        rollups = {analytics.rollup_key(m, s, d): {'n': wq.increment(n), 'ok': wq.increment(ok), 'lat_ms': wq.increment(lat)}
+                   for m, s, d, n, ok, lat in deltas}
+        self.queue.submit([
+            ('create', ['usuarios', username, 'intentos', batch_id],
+             dict(analytics.to_columns(events), fecha=wq.SERVER_TIMESTAMP)),
+            ('set', ['usuarios', username, 'meta', 'stats'], {'rollups': rollups}, True),
+        ], group=f"intentos:{username}:{batch_id}")
+        return True
+
+    def get_attempt_rollups(self, username):
+        doc = self._read(self._user(username).collection('meta').document('stats'))
+        rollups = (doc.to_dict() or {}).get('rollups', {}) if doc.exists else {}
+        return [[*analytics.split_key(k), v.get('n', 0), v.get('ok', 0), v.get('lat_ms', 0)] for k, v in rollups.items()]
+
+    def pending(self, username=None):
+        return self.queue.pending(['usuarios', username] if username else None)
+
+
+# --- SQLITE ---
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY, name TEXT, email TEXT, password TEXT NOT NULL, creado REAL
+);
+CREATE INDEX IF NOT EXISTS users_by_lower ON users (lower(username));
+CREATE TABLE IF NOT EXISTS progress (
+    username TEXT NOT NULL, materia TEXT NOT NULL, level TEXT NOT NULL, xp INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, materia)
+);
+CREATE TABLE IF NOT EXISTS exams (
+    username TEXT NOT NULL, exam_id TEXT NOT NULL, materia TEXT, aprobado INTEGER, fecha REAL,
+    PRIMARY KEY (username, exam_id)
+);
+CREATE TABLE IF NOT EXISTS decks (
+    username TEXT NOT NULL, name TEXT NOT NULL, materia TEXT, sistema TEXT, n INTEGER NOT NULL, creado REAL,
+    PRIMARY KEY (username, name)
+);
+CREATE INDEX IF NOT EXISTS decks_by_materia ON decks (username, materia);
+CREATE TABLE IF NOT EXISTS srs (
+    username TEXT NOT NULL, card_id TEXT NOT NULL, ease REAL, interval REAL, due REAL, lapses INTEGER,
+    reps INTEGER, deck TEXT, PRIMARY KEY (username, card_id)
+);
+CREATE INDEX IF NOT EXISTS srs_by_due ON srs (username, due);
+CREATE TABLE IF NOT EXISTS srs_decks (
+    username TEXT NOT NULL, deck TEXT NOT NULL, card_id TEXT NOT NULL, PRIMARY KEY (username, deck, card_id)
+);
+CREATE INDEX IF NOT EXISTS srs_decks_by_card ON srs_decks (username, card_id);
+CREATE TABLE IF NOT EXISTS attempt_batches (
+    username TEXT NOT NULL, batch_id TEXT NOT NULL, PRIMARY KEY (username, batch_id)
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    username TEXT NOT NULL, ts REAL NOT NULL, deck TEXT, card_id TEXT, opcion TEXT, ok INTEGER,
+    lat_ms INTEGER, materia TEXT, sistema TEXT
+);
+CREATE INDEX IF NOT EXISTS attempts_by_user ON attempts (username, ts);
+CREATE TABLE IF NOT EXISTS attempt_rollups (
+    username TEXT NOT NULL, materia TEXT NOT NULL, sistema TEXT NOT NULL, dia TEXT NOT NULL,
+    n INTEGER NOT NULL, ok INTEGER NOT NULL, lat_ms INTEGER NOT NULL,
+    PRIMARY KEY (username, materia, sistema, dia)
+);
+CREATE TABLE IF NOT EXISTS questions (
+    username TEXT NOT NULL, deck TEXT NOT NULL, pos INTEGER NOT NULL, data TEXT NOT NULL,
+    PRIMARY KEY (username, deck, pos),
+    FOREIGN KEY (username, deck) REFERENCES decks (username, name) ON DELETE CASCADE
+);
+"""
+
+
+class SQLiteBackend(StorageBackend):
+    name = "sqlite"
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, pool_size=4):
+        if path != ":memory:": os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self._pool = queue.Queue()
+        for _ in range(pool_size): self._pool.put(self._connect())
+        with self._conn() as conn: conn.executescript(SCHEMA)
+        with self._tx() as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] < 1:
+                # Migración única: el mazo de cada estado SRS pasa a la tabla de pertenencia.
+                conn.execute("INSERT OR IGNORE INTO srs_decks SELECT username, deck, card_id FROM srs WHERE deck IS NOT NULL")
+                conn.execute("PRAGMA user_version = 1")
+
+    def _connect(self):
+        # check_same_thread=False: las conexiones rotan entre los hilos de las sesiones vía el pool.
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA busy_timeout=10000")
+        return conn
+
+    @contextmanager
+    def _conn(self):
+        conn = self._pool.get()
+        try: yield conn
+        finally: self._pool.put(conn)
+
+    @contextmanager
+    def _tx(self):
+        with self._conn() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+    def get_user_credentials(self, username):
+        with self._conn() as conn:
+            row = conn.execute("SELECT name, email, password FROM users WHERE username = ?", (username,)).fetchone()
+        return dict(zip(CREDENTIAL_FIELDS, row)) if row else None
+
+    def find_username(self, username):
+        with self._conn() as conn:
+            row = conn.execute("SELECT username FROM users WHERE lower(username) = ? LIMIT 1", (username.lower(),)).fetchone()
+        return row[0] if row else None
+
+    def create_user(self, username, user_data):
+        with self._tx() as conn:
+            cur = conn.execute("INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?)",
+                               (username, user_data.get('name'), user_data.get('email'), user_data['password'], time.time()))
+            return cur.rowcount == 1
+
+    def get_progress(self, username):
+        with self._conn() as conn:
+            rows = conn.execute("SELECT materia, level, xp FROM progress WHERE username = ?", (username,)).fetchall()
+        return {m: {'level': lvl, 'xp': xp} for m, lvl, xp in rows}
+
+    def apply_exam(self, username, materia, level, xp_delta, exam_id):
+        with self._tx() as conn:
+            cur = conn.execute("INSERT OR IGNORE INTO exams VALUES (?, ?, ?, ?, ?)",
+                               (username, exam_id, materia, int(xp_delta > 0), time.time()))
+            if cur.rowcount == 0: return False  # ya aplicado (otra pestaña / rerun)
+            conn.execute("""INSERT INTO progress VALUES (?, ?, ?, ?)
+                            ON CONFLICT (username, materia) DO UPDATE SET level = excluded.level, xp = xp + ?""",
+                         (username, materia, level, xp_delta, xp_delta))
+            return True
+
+    def get_deck_index(self, username):
+        with self._conn() as conn:
+            rows = conn.execute("SELECT name, materia, sistema, n, creado FROM decks WHERE username = ?",
+                                (username,)).fetchall()
+        return {name: {'materia': m, 'sistema': s, 'n': n, 'creado': c} for name, m, s, n, c in rows}
+
+    def get_deck(self, username, name):
+        with self._conn() as conn:
+            head = conn.execute("SELECT materia, sistema, creado FROM decks WHERE username = ? AND name = ?",
+                                (username, name)).fetchone()
+            if not head: return None
+            rows = conn.execute("SELECT data FROM questions WHERE username = ? AND deck = ? ORDER BY pos",
+                                (username, name)).fetchall()
+        return {'preguntas': [json.loads(r[0]) for r in rows], 'materia': head[0], 'sistema': head[1], 'creado': head[2]}
+
+    def iter_decks(self, username):
+        with self._conn() as conn:
+            names = [r[0] for r in conn.execute("SELECT name FROM decks WHERE username = ? ORDER BY creado", (username,))]
+        for name in names:
+            deck = self.get_deck(username, name)
+            if deck: yield name, deck
+
+    def save_deck(self, username, name, deck):
+        meta = deck_meta(deck)
+        with self._tx() as conn:
+            conn.execute("DELETE FROM decks WHERE username = ? AND name = ?", (username, name))
+            conn.execute("INSERT INTO decks VALUES (?, ?, ?, ?, ?, ?)",
+                         (username, name, meta['materia'], meta['sistema'], meta['n'], meta['creado'] or time.time()))
+            conn.executemany("INSERT INTO questions VALUES (?, ?, ?, ?)",
+                             ((username, name, i, json.dumps(q, ensure_ascii=False))
+                              for i, q in enumerate(deck.get('preguntas', []))))
+        return True
+
+    def delete_deck(self, username, name):
+        with self._tx() as conn:
+            return conn.execute("DELETE FROM decks WHERE username = ? AND name = ?", (username, name)).rowcount > 0
+
+    def get_card_states(self, username):
+        with self._conn() as conn:
+            rows = conn.execute("SELECT card_id, ease, interval, due, lapses, reps, deck FROM srs WHERE username = ?",
+                                (username,)).fetchall()
+            members = conn.execute("SELECT card_id, deck FROM srs_decks WHERE username = ?", (username,)).fetchall()
+        states = {r[0]: list(r[1:]) for r in rows}
+        for cid, deck in members:
+            state = states.get(cid)
+            if state is not None and deck not in state[srs.DECK:]: state.append(deck)
+        return states
+
+    def save_card_states(self, username, states):
+        # La fila guarda el primer mazo; srs_decks, todos los mazos de la tarjeta.
+        with self._tx() as conn:
+            conn.executemany("INSERT OR REPLACE INTO srs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             ((username, cid, *state[:srs.DECK + 1]) for cid, state in states.items()))
+            conn.executemany("INSERT OR IGNORE INTO srs_decks VALUES (?, ?, ?)",
+                             ((username, deck, cid) for cid, state in states.items() for deck in srs.decks(state)))
+
+    def delete_card_states(self, username, deck, states=None):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM srs_decks WHERE username = ? AND deck = ?", (username, deck))
+            # Las que no quedan en ningún mazo se borran; las demás cambian de primer mazo.
+            conn.execute("""DELETE FROM srs WHERE username = ? AND deck = ? AND NOT EXISTS (
+                            SELECT 1 FROM srs_decks d WHERE d.username = srs.username AND d.card_id = srs.card_id)""",
+                         (username, deck))
+            conn.execute("""UPDATE srs SET deck = (SELECT MIN(d.deck) FROM srs_decks d
+                            WHERE d.username = srs.username AND d.card_id = srs.card_id)
+                            WHERE username = ? AND deck = ?""", (username, deck))
+
+    def append_attempts(self, username, batch_id, events, deltas):
+        with self._tx() as conn:
+            cur = conn.execute("INSERT OR IGNORE INTO attempt_batches VALUES (?, ?)", (username, batch_id))
+            if cur.rowcount == 0: return False  # lote ya guardado
+            conn.executemany("INSERT INTO attempts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             ((username, *e) for e in events))
+            conn.executemany("""INSERT INTO attempt_rollups VALUES (?, ?, ?, ?, ?, ?, ?)
+                                ON CONFLICT (username, materia, sistema, dia) DO UPDATE SET
+                                n = n + excluded.n, ok = ok + excluded.ok, lat_ms = lat_ms + excluded.lat_ms""",
+                             ((username, *d) for d in deltas))
+            return True
+
+    def get_attempt_rollups(self, username):
+        with self._conn() as conn:
+            rows = conn.execute("SELECT materia, sistema, dia, n, ok, lat_ms FROM attempt_rollups WHERE username = ?",
+                                (username,)).fetchall()
+        return [list(r) for r in rows]
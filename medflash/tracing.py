@@ -0,0 +1,232 @@
+# --- TRAZAS Y MÉTRICAS DEL CAMINO CALIENTE ---
+# Spans con nombre (duración + contadores: lecturas/escrituras de Firestore, tamaños de
+# prompt/respuesta, errores) agrupados en una traza por rerun. Cada span cerrado alimenta
+# también agregados de proceso (p50/p95 por nombre) que se exportan en formato de texto de
+# Prometheus o como JSON lines. Sin traza activa (hilos de fondo, subprocesos) sólo se agregan.
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+DEBUG_TRACE = os.environ.get("MEDFLASH_DEBUG_TRACE", "") not in ("", "0")
+METRICS_PATH = os.environ.get("MEDFLASH_METRICS_PATH")  # *.prom (textfile de node_exporter) o *.jsonl
+METRICS_INTERVAL = float(os.environ.get("MEDFLASH_METRICS_INTERVAL", "30"))
+RESERVOIR = 2048      # duraciones recientes por span para los percentiles
+QUANTILES = (0.5, 0.95)
+
+
+class Span:
+    __slots__ = ("name", "parent", "start", "end", "counters", "thread")
+
+    def __init__(self, name, parent, start):
+        self.name, self.parent, self.start, self.end = name, parent, start, None
+        self.counters = {}
+        self.thread = threading.current_thread().name
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def depth(self):
+        d, p = 0, self.parent
+        while p is not None: d, p = d + 1, p.parent
+        return d
+
+
+class Trace:
+    def __init__(self, label):
+        self.label = label
+        self.wall = time.time()
+        self.root = Span("rerun", None, time.perf_counter())
+        self.spans = [self.root]
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock: self.spans.append(span)
+
+    @property
+    def finished(self):
+        return self.root.end is not None
+
+    def rows(self):
+        """[(nombre, profundidad, inicio_ms, duración_ms, contadores, hilo)] en orden de inicio."""
+        with self._lock: spans = [(s, dict(s.counters)) for s in sorted(self.spans, key=lambda s: s.start)]
+        t0 = self.root.start
+        return [(s.name, s.depth(), (s.start - t0) * 1000, s.duration * 1000, c, s.thread) for s, c in spans]
+
+    def totals(self):
+        out = {}
+        with self._lock:
+            for s in self.spans:
+                for k, v in s.counters.items(): out[k] = out.get(k, 0) + v
+        return out
+
+
+_current = contextvars.ContextVar("medflash_span", default=(None, None))  # (traza, span)
+_untraced_lock = threading.Lock()
+
+
+def _counters_lock(trace):
+    # Los hilos de wrap_context cuentan en el span de quien los lanzó: sus contadores se tocan
+    # siempre con el cerrojo de la traza (o uno común para los spans sin traza).
+    return trace._lock if trace is not None else _untraced_lock
+
+
+# --- Agregados de proceso ---
+class Metrics:
+    def __init__(self, reservoir=RESERVOIR):
+        self._lock = threading.Lock()
+        self._reservoir = reservoir
+        self.spans = {}  # nombre -> {'n', 'sum', 'recent': deque, 'counters': {}}
+        self.errors = {}  # dónde -> nº de errores
+
+    def error(self, where):
+        with self._lock: self.errors[where] = self.errors.get(where, 0) + 1
+
+    def observe(self, name, seconds, counters=None):
+        with self._lock:
+            m = self.spans.get(name)
+            if m is None: m = self.spans[name] = {'n': 0, 'sum': 0.0, 'recent': deque(maxlen=self._reservoir), 'counters': {}}
+            m['n'] += 1
+            m['sum'] += seconds
+            m['recent'].append(seconds)
+            for k, v in (counters or {}).items(): m['counters'][k] = m['counters'].get(k, 0) + v
+
+    def snapshot(self):
+        with self._lock: items = [(n, m['n'], m['sum'], sorted(m['recent']), dict(m['counters'])) for n, m in self.spans.items()]
+        out = []
+        for name, n, total, recent, counters in sorted(items):
+            q = {f"p{int(p * 100)}": recent[min(len(recent) - 1, int(p * len(recent)))] if recent else 0.0 for p in QUANTILES}
+            out.append(dict(span=name, count=n, sum_s=round(total, 6), **{k: round(v, 6) for k, v in q.items()}, counters=counters))
+        return out
+
+    def prometheus(self):
+        lines = ["# HELP medflash_span_seconds Duración de los spans de medflash.",
+                 "# TYPE medflash_span_seconds summary"]
+        counter_lines = {}
+        for s in self.snapshot():
+            label = s['span'].replace("\\", "\\\\").replace('"', '\\"')
+            for p in QUANTILES:
+                lines.append(f'medflash_span_seconds{{span="{label}",quantile="{p}"}} {s[f"p{int(p * 100)}"]:.6f}')
+            lines.append(f'medflash_span_seconds_sum{{span="{label}"}} {s["sum_s"]:.6f}')
+            lines.append(f'medflash_span_seconds_count{{span="{label}"}} {s["count"]}')
+            for k, v in s['counters'].items():
+                counter_lines.setdefault(k, []).append(f'medflash_{k}_total{{span="{label}"}} {v}')
+        for k, rows in sorted(counter_lines.items()):
+            lines.append(f"# TYPE medflash_{k}_total counter")
+            lines += rows
+        with self._lock: errors = sorted(self.errors.items())
+        if errors:
+            lines.append("# TYPE medflash_errors_total counter")
+            lines += [f'medflash_errors_total{{where="{w}"}} {n}' for w, n in errors]
+        return "\n".join(lines) + "\n"
+
+    def jsonl(self):
+        ts = time.time()
+        with self._lock: errors = sorted(self.errors.items())
+        lines = [dict(s, ts=ts) for s in self.snapshot()] + [{"error": w, "count": n, "ts": ts} for w, n in errors]
+        return "".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines)
+
+
+METRICS = Metrics()
+
+
+# --- API ---
+def begin_trace(label=""):
+    trace = Trace(label)
+    _current.set((trace, trace.root))
+    return trace
+
+
+def end_trace(trace):
+    if trace is None or trace.finished: return
+    with trace._lock: last = max((s.end for s in trace.spans if s.end is not None), default=None)
+    # Un rerun cortado (st.stop / st.rerun) se cierra en el último span terminado.
+    trace.root.end = time.perf_counter() if _current.get()[0] is trace else (last or time.perf_counter())
+    METRICS.observe("rerun", trace.root.duration, trace.totals())
+
+
+@contextmanager
+def span(name):
+    trace, parent = _current.get()
+    s = Span(name, parent, time.perf_counter())
+    token = _current.set((trace, s))
+    try: yield s
+    finally:
+        s.end = time.perf_counter()
+        _current.reset(token)
+        if trace is not None: trace.add(s)
+        with _counters_lock(trace): counters = dict(s.counters)
+        METRICS.observe(name, s.end - s.start, counters)
+
+
+def record(name, start, counters=None):
+    """Registra un span ya terminado (p.ej. un stream consumido a trozos) bajo el span actual."""
+    trace, parent = _current.get()
+    s = Span(name, parent, start)
+    s.end = time.perf_counter()
+    s.counters = dict(counters or {})
+    if trace is not None: trace.add(s)
+    METRICS.observe(name, s.end - s.start, s.counters)
+
+
+def traced(name=None):
+    def deco(fn):
+        label = name or fn.__name__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label): return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+
+def count(key, n=1):
+    trace, s = _current.get()
+    if s is None: return
+    with _counters_lock(trace): s.counters[key] = s.counters.get(key, 0) + n
+
+
+def error(where, e):
+    """Sustituto de los print(f"Error ...") / except: pass: se registra en la traza y en las métricas."""
+    print(f"Error {where}: {e}")
+    count("errores")
+    METRICS.error(where)
+
+
+def wrap_context(fn):
+    """Para pools de hilos: la tarea hereda la traza y el span de quien la lanza."""
+    ctx = contextvars.copy_context()
+    return functools.partial(ctx.run, fn)
+
+
+# --- Exportación periódica ---
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def write_metrics(path):
+    if path.endswith(".jsonl"):
+        with open(path, "a", encoding="utf-8") as fh: fh.write(METRICS.jsonl())
+        return
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as fh: fh.write(METRICS.prometheus())
+    os.replace(tmp, path)  # el colector nunca lee un archivo a medias
+
+
+def start_exporter(path=METRICS_PATH, interval=METRICS_INTERVAL):
+    global _exporter
+    if not path: return None
+    with _exporter_lock:
+        if _exporter is None:
+            def loop():
+                while True:
+                    time.sleep(interval)
+                    try: write_metrics(path)
+                    except OSError as e: print(f"Error métricas: {e}")
+            _exporter = threading.Thread(target=loop, name="medflash-metrics", daemon=True)
+            _exporter.start()
+    return _exporter
@@ -0,0 +1,305 @@
+# --- COLA DE ESCRITURA EN SEGUNDO PLANO (WRITE-BEHIND) ---
+# Los botones ya no esperan a Firestore: las escrituras se encolan, se fusionan por documento
+# y un hilo las envía en batch writes con reintentos. Cada operación se apunta antes en un
+# diario JSONL local, así que lo pendiente sobrevive a un reinicio del proceso.
+import base64
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+
+from medflash import deps, tracing
+from medflash.doc_cache import DEFAULT_CACHE_DIR
+
+firestore = deps.lazy_module("firebase_admin.firestore")
+
+BATCH_LIMIT = 500          # máximo de escrituras por batch en Firestore
+FLUSH_INTERVAL = 0.5       # segundos que se deja acumular escrituras antes de enviarlas
+MAX_ATTEMPTS = 8
+COMPACT_EVERY = 200        # líneas de diario antes de reescribirlo sólo con lo pendiente
+
+# Centinelas de Firestore serializables en el diario.
+SERVER_TIMESTAMP = {"$sentinel": "server_timestamp"}
+DELETE_FIELD = {"$sentinel": "delete"}
+
+
+def increment(n):
+    return {"$sentinel": "increment", "n": n}
+
+
+def blob(data):
+    # Bytes (Blob en Firestore); en el diario JSON viajan en base64.
+    return {"$sentinel": "bytes", "b64": base64.b64encode(data).decode("ascii")}
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        kind = value.get("$sentinel")
+        if kind == "server_timestamp": return firestore.SERVER_TIMESTAMP
+        if kind == "delete": return firestore.DELETE_FIELD
+        if kind == "increment": return firestore.Increment(value["n"])
+        if kind == "bytes": return base64.b64decode(value["b64"])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list): return [_decode(v) for v in value]
+    return value
+
+
+def _deep_merge(base, extra):
+    out = dict(base)
+    for k, v in extra.items():
+        if isinstance(v, dict) and "$sentinel" not in v and isinstance(out.get(k), dict) and "$sentinel" not in out[k]:
+            out[k] = _deep_merge(out[k], v)
+        else: out[k] = v
+    return out
+
+
+def _merge_updates(base, extra):
+    out = dict(base)
+    for k, v in extra.items():
+        prev = out.get(k)
+        if isinstance(prev, dict) and isinstance(v, dict) and prev.get("$sentinel") == v.get("$sentinel") == "increment":
+            out[k] = increment(prev["n"] + v["n"])
+        else: out[k] = v
+    return out
+
+
+def _is_retryable(e):
+    name = type(e).__name__
+    if name in ("AlreadyExists", "Conflict"): return False
+    if name in ("InvalidArgument", "PermissionDenied", "NotFound", "FailedPrecondition"): return False
+    return True
+
+
+class WriteBehindQueue:
+    """
+    Operaciones: ('set', ruta, datos, merge), ('update', ruta, datos), ('delete', ruta), donde
+    ruta es una lista [colección, doc, colección, doc...]. Las operaciones sin grupo se fusionan
+    por documento; las de un mismo `group` van juntas y solas en su batch (atómicas), y un
+    AlreadyExists en un grupo con create() se toma como "ya aplicado" (idempotencia).
+    Todo se envía en orden de encolado: un grupo hace de barrera, así que lo encolado antes
+    sale antes que él y lo de después no se fusiona con lo anterior.
+    """
+
+    def __init__(self, db, journal_dir=DEFAULT_CACHE_DIR, flush_interval=FLUSH_INTERVAL, sleep=time.sleep):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.sleep = sleep
+        os.makedirs(journal_dir, exist_ok=True)
+        self.journal_path = os.path.join(journal_dir, "firestore_journal.jsonl")
+        self._cond = threading.Condition()
+        # Tramos en orden de encolado: ["docs", {ruta: [(ids, op)] fusionadas}] o ["group", grupo, [(id, op)]].
+        self._queue = deque()
+        self._open_groups = {}       # grupo -> su tramo aún en cola (lo encolado con ese nombre se le añade)
+        self._inflight = None        # lo sacado por _take() hasta que se confirma o se reintenta
+        self._seq = 0
+        self._journal_lines = 0
+        self._stop = False
+        self.flushed = self.failed = self.batches = 0
+        self.last_error = None
+        self._replay()
+        self._thread = threading.Thread(target=self._run, name="medflash-write-behind", daemon=True)
+        self._thread.start()
+
+    # --- Diario ---
+    def _append(self, record):
+        with open(self.journal_path, "a", encoding="utf-8") as fh:
+            fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        self._journal_lines += 1
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path): return
+        ops, done = OrderedDict(), set()
+        with open(self.journal_path, encoding="utf-8") as fh:
+            for line in fh:
+                try: rec = json.loads(line)
+                except ValueError: continue  # última línea a medias tras un corte
+                if "op" in rec: ops[rec["id"]] = rec
+                else: done.update(rec.get("ack", []))
+                self._seq = max(self._seq, rec.get("id", 0))
+        for rec in ops.values():
+            if rec["id"] not in done: self._enqueue_local(rec["id"], tuple(rec["op"]), rec.get("group"))
+        self._compact()
+
+    def _compact(self):
+        docs, groups = self._all_pending()
+        pending = [(i, op, None) for _, items in docs for ids, op in items for i in ids[-1:]]
+        pending += [(i, op, g) for g, items in groups for i, op in items]
+        tmp = self.journal_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as fh:
+            for i, op, g in sorted(pending, key=lambda p: p[0]):
+                rec = {"id": i, "op": list(op)}
+                if g: rec["group"] = g
+                fh.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.journal_path)
+        # Tras compactar, cada operación fusionada queda representada por su último id.
+        for path_items in [items for _, items in docs]: path_items[:] = [(ids[-1:], op) for ids, op in path_items]
+        self._journal_lines = len(pending)
+
+    # --- Encolado ---
+    def _enqueue_local(self, op_id, op, group=None):
+        if group:
+            seg = self._open_groups.get(group)
+            if seg is None:
+                seg = self._open_groups[group] = ["group", group, []]
+                self._queue.append(seg)
+            seg[2].append((op_id, op))
+            return
+        if not self._queue or self._queue[-1][0] != "docs": self._queue.append(["docs", OrderedDict()])
+        path = tuple(op[1])
+        items = self._queue[-1][1].setdefault(path, [])
+        kind = op[0]
+        if kind == "delete" or (kind == "set" and not op[3]):
+            # Lo anterior sobre este documento queda pisado; sus ids se confirman con esta operación.
+            dropped = [i for ids, _ in items for i in ids]
+            items[:] = [(dropped + [op_id], op)]
+            return
+        if items:
+            ids, last = items[-1]
+            if kind == "update" and last[0] == "update":
+                items[-1] = (ids + [op_id], ("update", op[1], _merge_updates(last[2], op[2])))
+                return
+            if kind == "set" and last[0] == "set":
+                merged = _deep_merge(last[2], op[2])
+                items[-1] = (ids + [op_id], ("set", op[1], merged, last[3]))
+                return
+        items.append(([op_id], op))
+
+    def submit(self, ops, group=None):
+        tracing.count("firestore_writes_encoladas", len(ops))
+        with self._cond:
+            for op in ops:
+                self._seq += 1
+                rec = {"id": self._seq, "op": list(op)}
+                if group: rec["group"] = group
+                self._append(rec)
+                self._enqueue_local(self._seq, tuple(op), group)
+            self._cond.notify()
+
+    def set(self, path, data, merge=False): self.submit([("set", list(path), data, merge)])
+    def update(self, path, data): self.submit([("update", list(path), data)])
+    def delete(self, path): self.submit([("delete", list(path))])
+
+    def _all_pending(self):
+        segs = list(self._queue)
+        if self._inflight: segs.append(self._inflight)
+        docs = [item for seg in segs if seg[0] == "docs" for item in seg[1].items()]
+        groups = [tuple(seg[1:]) for seg in segs if seg[0] == "group"]
+        return docs, groups
+
+    def pending(self, prefix=None):
+        with self._cond:
+            paths, group_items = self._all_pending()
+            groups = [op for _, items in group_items for _, op in items]
+        n = sum(len(items) for p, items in paths if prefix is None or list(p[:len(prefix)]) == list(prefix))
+        n += sum(1 for op in groups if prefix is None or op[1][:len(prefix)] == list(prefix))
+        return n
+
+    # --- Envío ---
+    def _ref(self, path):
+        ref = self.db
+        for i, seg in enumerate(path): ref = ref.collection(seg) if i % 2 == 0 else ref.document(seg)
+        return ref
+
+    def _commit(self, ops):
+        with tracing.span("firestore.commit"):
+            tracing.count("firestore_writes", len(ops))
+            batch = self.db.batch()
+            for op in ops:
+                ref = self._ref(op[1])
+                if op[0] == "set": batch.set(ref, _decode(op[2]), merge=op[3])
+                elif op[0] == "create": batch.create(ref, _decode(op[2]))
+                elif op[0] == "update": batch.update(ref, _decode(op[2]))
+                elif op[0] == "delete": batch.delete(ref)
+            batch.commit()
+
+    def _take(self):
+        # Saca el primer tramo: un grupo atómico, o documentos fusionados hasta BATCH_LIMIT
+        # escrituras. Lo que se encole mientras tanto ya no se fusiona con lo que está en vuelo.
+        seg = self._queue[0]
+        if seg[0] == "group":
+            self._queue.popleft()
+            _, group, items = seg
+            del self._open_groups[group]
+            self._inflight = ("group", group, items)
+            return [i for i, _ in items], [op for _, op in items]
+        docs, taken, n = seg[1], OrderedDict(), 0
+        for path in list(docs):
+            if n + len(docs[path]) > BATCH_LIMIT and taken: break
+            taken[path] = docs.pop(path)
+            n += len(taken[path])
+        if not docs: self._queue.popleft()
+        self._inflight = ("docs", taken)
+        items = [item for path_items in taken.values() for item in path_items]
+        return [i for ids, _ in items for i in ids], [op for _, op in items]
+
+    def _restore(self):
+        # Reintento: lo que estaba en vuelo vuelve delante de lo encolado después.
+        with self._cond:
+            if self._inflight[0] == "group":
+                _, group, items = self._inflight
+                later = self._open_groups.pop(group, None)  # mismo grupo encolado mientras tanto
+                if later is not None:
+                    self._queue.remove(later)
+                    items = items + later[2]
+                seg = self._open_groups[group] = ["group", group, items]
+                self._queue.appendleft(seg)
+            elif self._queue and self._queue[0][0] == "docs":
+                # Lo de ese primer tramo se encoló después, sin ningún grupo por medio.
+                docs = self._queue[0][1]
+                for path, items in reversed(self._inflight[1].items()):
+                    docs[path] = items + docs.get(path, [])
+                    docs.move_to_end(path, last=False)
+            else:
+                self._queue.appendleft(["docs", self._inflight[1]])
+            self._inflight = None
+
+    def _ack(self, ids):
+        with self._cond:
+            self._inflight = None
+            self._append({"ack": ids})
+            if self._journal_lines > COMPACT_EVERY: self._compact()
+
+    def _run(self):
+        attempt = 0
+        while True:
+            with self._cond:
+                while not self._stop and not self._queue: self._cond.wait()
+                if self._stop and not self._queue: return
+            if not self._stop: self.sleep(self.flush_interval)  # deja que se fusionen más escrituras
+            with self._cond: ids, ops = self._take()
+            is_group = self._inflight[0] == "group"
+            try:
+                self._commit(ops)
+                self._ack(ids)
+                self.flushed += len(ops); self.batches += 1
+                attempt = 0
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if is_group and type(e).__name__ in ("AlreadyExists", "Conflict"):
+                    self._ack(ids)  # el grupo ya se aplicó antes (idempotencia)
+                    continue
+                attempt += 1
+                if not _is_retryable(e) or attempt >= MAX_ATTEMPTS:
+                    tracing.error("write-behind", f"se descartan {len(ops)} escrituras tras {attempt} intentos: {e}")
+                    self.failed += len(ops)
+                    self._ack(ids)
+                    attempt = 0
+                    continue
+                self._restore()
+                self.sleep(random.uniform(0, min(60.0, 0.5 * 2 ** attempt)))
+
+    def flush(self, timeout=10.0):
+        """Espera (hasta timeout) a que no quede nada pendiente."""
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline: time.sleep(0.05)
+        return self.pending() == 0
+
+    def close(self, timeout=10.0):
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join(timeout)
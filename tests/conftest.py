@@ -0,0 +1,55 @@
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import fakes  # noqa: E402
+from medflash import storage  # noqa: E402
+from medflash import write_queue as wq  # noqa: E402
+
+
+class RecordingFirestore(fakes.InMemoryFirestore):
+    """Firestore en memoria que apunta cada batch confirmado como [(tipo, ruta)] y llama a on_commit()."""
+
+    def __init__(self, on_commit=None):
+        super().__init__()
+        self.commits = []
+        self.on_commit = on_commit
+
+    def batch(self):
+        db = self
+
+        class Batch(fakes.WriteBatch):
+            def commit(self):
+                super().commit()
+                db.commits.append([(kind, "/".join(path)) for kind, path, _, _ in self._ops])
+                if db.on_commit: db.on_commit(db)
+        return Batch(self)
+
+
+@pytest.fixture(autouse=True)
+def firestore_sentinels(monkeypatch):
+    # Los centinelas del diario se traducen a los del Firestore en memoria, sin firebase_admin.
+    fake = types.SimpleNamespace(SERVER_TIMESTAMP=fakes.SERVER_TIMESTAMP, DELETE_FIELD=fakes.DELETE_FIELD,
+                                 Increment=fakes.Increment)
+    monkeypatch.setattr(wq, "firestore", fake)
+    monkeypatch.setattr(storage, "firestore", fake)
+
+
+@pytest.fixture
+def firestore_backend(tmp_path):
+    """(db, FirestoreBackend, compuerta): la cola no envía nada hasta gate.set()."""
+    db, gate = RecordingFirestore(), threading.Event()
+    queue = wq.WriteBehindQueue(db, str(tmp_path), flush_interval=0, sleep=lambda s: gate.wait())
+    yield db, storage.FirestoreBackend(db, queue), gate
+    gate.set()
+    queue.close()
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    return storage.SQLiteBackend(str(tmp_path / "medflash.db"), pool_size=2)
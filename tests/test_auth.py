@@ -0,0 +1,31 @@
+import pytest
+
+from medflash.auth import LazyUsernames, normalize_username
+
+
+def test_lazy_usernames_resolve_the_normalized_name():
+    asked = []
+    def resolver(username):
+        asked.append(username)
+        return {"name": "Ana", "email": "a@x", "password": "hash"} if username == "drana" else None
+    users = LazyUsernames(resolver)
+    assert "drana" in users and users["drana"]["logged_in"] is False
+    assert users.get(" DrAna ")["name"] == "Ana"
+    assert "otro" not in users
+    assert asked == ["drana", "drana", "otro"]
+    assert normalize_username("  DrAna ") == "drana"
+
+
+@pytest.mark.parametrize("kind", ["firestore", "sqlite"])
+def test_find_username_matches_legacy_mixed_case_ids(kind, request):
+    if kind == "firestore":
+        db, backend, gate = request.getfixturevalue("firestore_backend")
+        db.seed(["usuarios", "DrAna"], {"name": "Ana", "email": "a@x", "password": "hash"})
+        db.seed(["usuarios", "luis"], {"name": "Luis", "email": "l@x", "password": "hash"})
+    else:
+        backend = request.getfixturevalue("sqlite_backend")
+        backend.create_user("DrAna", {"name": "Ana", "email": "a@x", "password": "hash"})
+    assert backend.get_user_credentials("drana") is None
+    assert backend.find_username("drana") == "DrAna"
+    assert backend.get_user_credentials(backend.find_username("drana"))["name"] == "Ana"
+    assert backend.find_username("nadie") is None
@@ -0,0 +1,63 @@
+import threading
+import time
+
+from medflash.biblioteca import IndexRegistry
+
+
+class MemoryCache:
+    def __init__(self): self.data, self.puts = {}, 0
+    def get(self, key): return self.data.get(key)
+    def put(self, key, text):
+        self.puts += 1
+        self.data[key] = text
+
+
+class NamesIndex:
+    """Índice mínimo: sólo recuerda qué mazos tiene y cuántas veces se añadió cada uno."""
+
+    def __init__(self, names=()): self.names, self.added = dict.fromkeys(names, 0), []
+    @classmethod
+    def loads(cls, text): return cls(text.split(",") if text else ())
+    def deck_names(self): return set(self.names)
+    def add_deck(self, name, preguntas, meta):
+        self.added.append(name)
+        self.names[name] = len(preguntas)
+    def remove_deck(self, name): self.names.pop(name, None)
+    def dumps(self): return ",".join(sorted(self.names))
+
+
+def test_saves_are_persisted_once_per_debounce_window():
+    cache = MemoryCache()
+    registry = IndexRegistry(cache, NamesIndex, "prueba", persist_delay=0.05)
+    registry.get("ana", {}, lambda name: None)
+    for i in range(50): registry.on_save("ana", f"mazo {i}", [{}], {})
+    assert cache.puts == 0
+    time.sleep(0.3)
+    assert cache.puts == 1
+    assert len(NamesIndex.loads(cache.data[registry._key("ana")]).deck_names()) == 50
+
+
+def test_deferred_persists_once_at_the_end():
+    cache = MemoryCache()
+    registry = IndexRegistry(cache, NamesIndex, "prueba", persist_delay=0.0)
+    registry.get("ana", {}, lambda name: None)
+    with registry.deferred("ana"):
+        for i in range(20):
+            registry.on_save("ana", f"mazo {i}", [{}], {})
+            registry.flush()  # ni el temporizador ni un flush tocan un índice diferido
+        assert cache.puts == 0
+    assert cache.puts == 1
+
+
+def test_concurrent_reconcile_adds_each_deck_once():
+    registry = IndexRegistry(MemoryCache(), NamesIndex, "prueba")
+    decks = {f"mazo {i}": {} for i in range(5)}
+
+    def slow_load(name):
+        time.sleep(0.01)
+        return {'preguntas': [{}]}
+    threads = [threading.Thread(target=registry.get, args=("ana", decks, slow_load)) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert sorted(registry.loaded("ana").added) == sorted(decks)
+    registry.flush()
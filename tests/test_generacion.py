@@ -0,0 +1,78 @@
+import json
+
+from medflash.dedup import DedupFilter, NearDuplicateIndex
+from medflash.generacion import build_exam_prompt, generate_deck, refill_deck
+
+CASOS = [
+    "Varón de 54 años con dolor torácico opresivo irradiado a brazo izquierdo y sudoración",
+    "Mujer de 23 años con poliuria, polidipsia, pérdida de peso y glucemia de 350 mg/dl",
+    "Niño de 6 años con fiebre, odinofagia, exudado amigdalar y adenopatías cervicales",
+]
+NUEVOS = [
+    "Anciana de 81 años con caída, acortamiento y rotación externa de la pierna derecha",
+    "Joven de 19 años con cefalea brusca en trueno durante el ejercicio y rigidez de nuca",
+    "Gestante de 32 semanas con hipertensión, proteinuria y epigastralgia intensa",
+]
+
+
+def _pregunta(texto):
+    return {"pregunta": texto + ". ¿Cuál es el diagnóstico más probable?",
+            "opciones": {"A": "Uno", "B": "Dos", "C": "Tres", "D": "Cuatro"},
+            "respuesta_correcta": "B", "explicacion": "Porque sí."}
+
+
+class _Chunk:
+    def __init__(self, text): self.text = text
+
+
+class DeckModel:
+    """Repite siempre los mismos casos (como una respuesta cacheada) salvo si se le pide evitarlos."""
+
+    def __init__(self):
+        self.prompts = []
+
+    def generate_content(self, prompt, stream=False):
+        self.prompts.append(prompt)
+        casos = NUEVOS if any("NO los repitas" in p for p in prompt) else CASOS
+        text = "```json\n" + json.dumps([_pregunta(c) for c in casos], ensure_ascii=False) + "\n```"
+        return [_Chunk(text[i:i + 40]) for i in range(0, len(text), 40)]
+
+
+def _prompt(ctx, n, avoid=()):
+    return build_exam_prompt("Medicina Interna", "Cardiología", "Residente", ctx, n, avoid=avoid)
+
+
+def test_prompt_is_list_with_avoid_instruction():
+    prompt = _prompt("texto", 3, avoid=["Caso repetido " * 30])
+    assert all(isinstance(p, str) for p in prompt)
+    assert "NO los repitas" in prompt[-1]
+    assert len(prompt[-1].splitlines()[-1]) == len("- ") + 150
+    assert not any("NO los repitas" in p for p in _prompt("texto", 3))
+
+
+def test_top_up_replaces_questions_already_in_library():
+    library = NearDuplicateIndex()
+    for i, c in enumerate(CASOS): library.add(_pregunta(c), f"mazo-{i}")
+    model, filtro = DeckModel(), DedupFilter(library)
+
+    data, errors = generate_deck(model, [_prompt("texto", 3)], is_duplicate=filtro)
+    assert (data, errors) == ([], [])
+    assert len(filtro.discarded) == 3
+
+    lotes_pedidos = []
+    def prompts_for(lotes, avoid):
+        lotes_pedidos.append(lotes)
+        return [_prompt("texto", n, avoid=avoid) for n in lotes]
+    mas, mas_errors = refill_deck(model, 3 - len(data), filtro.discarded, prompts_for, is_duplicate=filtro)
+
+    assert lotes_pedidos == [[3]]
+    assert not mas_errors
+    assert [q["pregunta"] for q in mas] == [_pregunta(c)["pregunta"] for c in NUEVOS]
+    assert CASOS[0] in model.prompts[-1][-1]
+
+
+def test_top_up_skipped_when_nothing_missing():
+    called = []
+    assert refill_deck(DeckModel(), 0, [(_pregunta(CASOS[0]), [])], called.append) == ([], [])
+    assert refill_deck(DeckModel(), 5, [], called.append) == ([], [])
+    assert called == []
@@ -0,0 +1,37 @@
+import io
+
+from medflash import intercambio
+from medflash.biblioteca import IndexRegistry
+from test_biblioteca import MemoryCache, NamesIndex
+
+
+def _deck(n):
+    return {'materia': 'Medicina', 'sistema': 'Renal', 'preguntas': [
+        {"pregunta": f"Caso {i}: ¿diagnóstico?", "opciones": {"A": "Uno", "B": "Dos"},
+         "respuesta_correcta": "B", "explicacion": "Porque sí."} for i in range(n)]}
+
+
+def test_jsonl_import_persists_library_index_once(tmp_path):
+    out = io.StringIO()
+    intercambio.export_jsonl([("Nefro", _deck(1200))], out)
+    path = tmp_path / "biblioteca.jsonl"
+    path.write_text(out.getvalue(), encoding="utf-8")
+
+    cache = MemoryCache()
+    registry = IndexRegistry(cache, NamesIndex, "prueba", persist_delay=0.0)
+    registry.get("ana", {"Nefro": {}}, lambda name: {'preguntas': []})
+    registry.flush()
+    saved = {}
+
+    def save(name, preguntas, materia, sistema):
+        saved[name] = len(preguntas)
+        registry.on_save("ana", name, preguntas, {'materia': materia, 'sistema': sistema})
+        registry.flush()  # lo que haría el temporizador entre partes
+        return True
+    writer = intercambio.DeckWriter(save, {"Nefro"}.__contains__, deck_size=500)
+    with registry.deferred("ana"):
+        progress = intercambio.import_file(str(path), "biblioteca.jsonl", writer)
+    assert saved == {"Nefro (2)": 500, "Nefro (3)": 500, "Nefro (4)": 200}
+    assert progress.cards == 1200 and not progress.errors
+    assert cache.puts == 2  # la conciliación inicial y una sola al final de la importación
+    assert registry.loaded("ana").deck_names() == {"Nefro", "Nefro (2)", "Nefro (3)", "Nefro (4)"}
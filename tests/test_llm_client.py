@@ -0,0 +1,124 @@
+import threading
+
+import pytest
+
+from benchmarks.fakes import FakeModel
+from medflash.generacion import JSONArrayStream, stream_questions
+from medflash.llm_client import GeminiClient, TokenBucket
+
+
+class FakeClock:
+    """Reloj manual: sleep() avanza el tiempo en vez de esperar y apunta cada espera."""
+
+    def __init__(self): self.now, self.sleeps = 0.0, []
+    def __call__(self): return self.now
+    def sleep(self, s):
+        self.sleeps.append(s)
+        self.now += s
+
+
+def _client(model, clock, **kw):
+    return GeminiClient(model, "fake", clock=clock, sleep=clock.sleep, **kw)
+
+
+def test_token_bucket_waits_for_refill():
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock)  # 1 por segundo, ráfaga de 60
+    assert [bucket.reserve(1) for _ in range(60)] == [0.0] * 60
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    clock.now += 5
+    assert bucket.reserve(1) == 0.0
+
+
+def test_request_bucket_throttles_calls():
+    clock, model = FakeClock(), FakeModel(n=1)
+    client = _client(model, clock, rpm=2)
+    for _ in range(4): client.generate_content(f"prompt {clock.now}")
+    assert model.calls == 4
+    assert sum(clock.sleeps) == pytest.approx(60.0)  # 2 de ráfaga y luego una cada 30 s
+    assert client.stats()["llamadas"] == 4
+    assert client.stats()["ultima_espera_s"] == pytest.approx(30.0)
+
+
+def test_retries_429_with_backoff_then_succeeds():
+    clock, model = FakeClock(), FakeModel(n=2, fail_rate=0.5, seed=3)
+    client = _client(model, clock, max_retries=10, base_delay=1.0, max_delay=8.0)
+    text = client.generate_content("prompt").text
+    assert len(JSONArrayStream().feed(text)) == 2
+    stats = client.stats()
+    assert stats["reintentos"] == model.calls - 1 > 0
+    assert stats["errores"] == 0
+    assert all(0 <= s <= 8.0 for s in clock.sleeps)
+
+
+def test_gives_up_after_max_retries_and_on_fatal_errors():
+    clock = FakeClock()
+    client = _client(FakeModel(fail_rate=1.0), clock, max_retries=2)
+    with pytest.raises(FakeModel.RateLimited):
+        client.generate_content("prompt")
+    assert client.stats()["reintentos"] == 2 and client.stats()["errores"] == 1
+
+    class Broken(FakeModel):
+        def generate_content(self, prompt, stream=False, **params):
+            self.calls += 1
+            raise ValueError("prompt inválido")
+    broken = Broken()
+    client = _client(broken, clock, max_retries=5)
+    with pytest.raises(ValueError):
+        client.generate_content("prompt")
+    assert broken.calls == 1
+
+
+def test_single_flight_coalesces_identical_prompts():
+    model = FakeModel(n=3, latency=0.2)
+    client = GeminiClient(model, "fake")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.generate_content("mismo").text)) for _ in range(5)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert model.calls == 1
+    assert client.stats()["coalescidas"] == 4
+    assert len(set(results)) == 1 and len(results) == 5
+
+
+def test_streamed_questions_arrive_complete():
+    client = GeminiClient(FakeModel(n=7, chunk_chars=13), "fake")
+    preguntas = list(stream_questions(client, "prompt"))
+    assert len(preguntas) == 7
+    assert {q["respuesta_correcta"] for q in preguntas} == set("ABCD")
+
+
+def test_dropped_stream_does_not_block_identical_requests():
+    model = FakeModel(n=2)
+    client = GeminiClient(model, "fake")
+    client.generate_content("mismo", stream=True)  # nunca se itera
+    done = threading.Event()
+    t = threading.Thread(target=lambda: (client.generate_content("mismo"), done.set()), daemon=True)
+    t.start()
+    assert done.wait(5)
+    assert client.stats()["coalescidas"] == 0 and model.calls == 1
+    stream = client.generate_content("mismo", stream=True)
+    next(iter(stream))
+    stream.close()  # abandonado a medias: el vuelo se cierra igual
+    assert client.generate_content("mismo").text
+
+
+def test_failed_admission_is_not_counted():
+    class Interrupted(Exception):
+        pass
+
+    def sleep(s): raise Interrupted()
+    client = GeminiClient(FakeModel(), "fake", rpm=1, clock=lambda: 0.0, sleep=sleep)
+    client.generate_content("primero")
+    with pytest.raises(Interrupted):
+        client.generate_content("segundo")
+    stats = client.stats()
+    assert (stats["llamadas"], stats["en_cola"], stats["en_vuelo"]) == (1, 0, 0)
+
+
+def test_json_array_stream_splits_objects_across_chunks():
+    parser = JSONArrayStream()
+    text = 'Aquí tienes:\n```json\n[{"a": "llave } y \\"comillas\\" [x]"}, {"b": [1, {"c": 2}]}, {"roto": }, {"d": 4}]\n```'
+    got = [obj for i in range(0, len(text), 5) for obj in parser.feed(text[i:i + 5])]
+    assert got == [{"a": 'llave } y "comillas" [x]'}, {"b": [1, {"c": 2}]}, {"d": 4}]
+    assert parser.invalid == 1
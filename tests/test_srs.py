@@ -0,0 +1,99 @@
+import sqlite3
+
+import pytest
+
+from medflash import srs, storage
+
+
+def test_review_keeps_every_deck():
+    state = srs.with_deck(srs.new_state("Cardio", now=100.0), "Repaso MIR")
+    assert srs.decks(state) == ["Cardio", "Repaso MIR"]
+    assert srs.with_deck(state, "Cardio") is state
+    reviewed = srs.review(state, 4, now=200.0)
+    assert reviewed[srs.DUE] == 200.0 + srs.DAY and srs.decks(reviewed) == ["Cardio", "Repaso MIR"]
+    assert srs.without_deck(reviewed, "Cardio")[srs.DECK] == "Repaso MIR"
+    assert srs.without_deck(srs.new_state("Cardio"), "Cardio") is None
+
+
+def test_due_queue_remove_deck_keeps_shared_cards():
+    queue = srs.DueQueue({
+        "solo": srs.new_state("Cardio", now=1.0),
+        "compartida": srs.with_deck(srs.new_state("Cardio", now=2.0), "Repaso"),
+        "otra": srs.new_state("Repaso", now=3.0),
+    })
+    changed = queue.remove_deck("Cardio")
+    assert changed == {"solo": None, "compartida": [srs.EASE_START, 0.0, 2.0, 0, 0, "Repaso"]}
+    assert [cid for cid, _ in queue.due(10, now=10.0)] == ["compartida", "otra"]
+
+
+def test_due_count_follows_reviews_and_removals():
+    queue = srs.DueQueue({f"c{i}": srs.new_state("Cardio" if i % 2 else "Renal", now=i + 1.0) for i in range(10)})
+    assert queue.count_due(now=5.5) == 5
+    queue.push("c0", srs.review(queue.states["c0"], 4, now=5.0))  # repasada: vence mañana
+    queue.push("c9", queue.states["c9"][:srs.DUE] + [0.5] + queue.states["c9"][srs.DUE + 1:])
+    assert queue.count_due(now=5.5) == 5  # c1..c4 y c9
+    queue.remove_deck("Cardio")
+    assert queue.count_due(now=5.5) == 2  # c2 y c4
+    assert queue.count_due(now=100.0) == 4
+    later = 5.0 + srs.DAY
+    assert queue.count_due(now=later) == 5 == sum(1 for s in queue.states.values() if s[srs.DUE] <= later)
+
+
+@pytest.mark.parametrize("kind", ["firestore", "sqlite"])
+def test_deleting_a_deck_keeps_cards_shared_with_another(kind, request):
+    if kind == "firestore":
+        db, backend, gate = request.getfixturevalue("firestore_backend")
+        gate.set()
+    else: backend = request.getfixturevalue("sqlite_backend")
+    backend.save_card_states("ana", {"solo": srs.new_state("Cardio", now=1.0), "otra": srs.new_state("Renal", now=1.0)})
+    backend.save_card_states("ana", {"compartida": srs.with_deck(srs.new_state("Cardio", now=1.0), "Repaso")})
+    if kind == "firestore": assert backend.queue.flush(5)
+    backend.delete_card_states("ana", "Cardio")
+    if kind == "firestore": assert backend.queue.flush(5)
+    states = backend.get_card_states("ana")
+    assert set(states) == {"compartida", "otra"}
+    assert srs.decks(states["compartida"]) == ["Repaso"]
+    assert srs.decks(states["otra"]) == ["Renal"]
+
+
+def test_sqlite_migrates_single_deck_states(tmp_path):
+    path = str(tmp_path / "viejo.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""CREATE TABLE srs (username TEXT NOT NULL, card_id TEXT NOT NULL, ease REAL, interval REAL,
+                          due REAL, lapses INTEGER, reps INTEGER, deck TEXT, PRIMARY KEY (username, card_id));
+                          INSERT INTO srs VALUES ('ana', 'c1', 2.5, 0, 1, 0, 0, 'Cardio');""")
+    conn.close()
+    backend = storage.SQLiteBackend(path, pool_size=1)
+    backend.save_card_states("ana", {"c1": srs.with_deck(backend.get_card_states("ana")["c1"], "Repaso")})
+    backend.delete_card_states("ana", "Repaso")
+    assert backend.get_card_states("ana") == {"c1": [2.5, 0.0, 1.0, 0, 0, "Cardio"]}
+
+
+def test_firestore_delete_uses_session_states_without_reading(firestore_backend):
+    db, backend, gate = firestore_backend
+    states = {"c1": srs.new_state("Cardio", now=1.0), "c2": srs.with_deck(srs.new_state("Renal", now=1.0), "Cardio")}
+    backend.save_card_states("ana", states)
+    gate.set()
+    assert backend.queue.flush(5)
+    reads = db.counters().get("reads", 0)
+    backend.delete_card_states("ana", "Cardio", states)
+    assert backend.queue.flush(5)
+    assert db.counters().get("reads", 0) == reads
+    assert db.docs[("usuarios", "ana", "srs", "c")]["cards"] == {"c2": [srs.EASE_START, 0.0, 1.0, 0, 0, "Renal"]}
+
+
+def test_firestore_states_are_split_by_card_id_prefix(firestore_backend):
+    db, backend, gate = firestore_backend
+    gate.set()
+    cards = {srs.card_id({"pregunta": f"Caso {i}", "opciones": {"A": "x"}}): srs.new_state("Cardio", now=1.0)
+             for i in range(3000)}
+    db.seed(["usuarios", "ana", "meta", "srs"], {"cards": dict(list(cards.items())[:1000])})  # formato antiguo
+    assert len(backend.get_card_states("ana")) == 1000
+    assert backend.queue.flush(5)
+    assert ("usuarios", "ana", "meta", "srs") not in db.docs  # migrado
+    backend.save_card_states("ana", dict(list(cards.items())[1000:]))
+    assert backend.queue.flush(5)
+    docs = {p[3]: d for p, d in db.docs.items() if p[:3] == ("usuarios", "ana", "srs")}
+    assert sorted(docs) == list("0123456789abcdef")
+    assert max(len(str(d)) for d in docs.values()) < 20000
+    assert backend.get_card_states("ana") == cards
@@ -0,0 +1,181 @@
+import threading
+
+import pytest
+
+from conftest import RecordingFirestore
+from medflash import shards, storage
+from medflash import write_queue as wq
+
+
+def _deck(n, tema="cardio", materia="Medicina"):
+    return {'materia': materia, 'sistema': 'General', 'creado': '1700000000.0', 'preguntas': [
+        {"pregunta": f"Caso {i} de {tema}: ¿diagnóstico?", "opciones": {"A": "Uno", "B": "Dos"},
+         "respuesta_correcta": "A", "explicacion": f"Explicación {i} " * 20} for i in range(n)]}
+
+
+def _reader_view_is_consistent(db):
+    # Lo que vería otro proceso tras cada batch: el índice, las cabeceras y sus fragmentos cuadran.
+    headers = {p[3]: d for p, d in db.docs.items() if len(p) == 4 and p[2] == 'mazos'}
+    index = db.docs.get(('usuarios', 'ana', 'meta', 'mazos_index'), {}).get('mazos', {})
+    assert set(index) == set(headers)
+    for name, header in headers.items():
+        for sid in shards.shard_ids(header):
+            assert ('usuarios', 'ana', 'mazos', name, 'fragmentos', sid) in db.docs, (name, sid)
+
+
+def test_sharded_saves_never_expose_missing_shards(firestore_backend, monkeypatch):
+    db, backend, gate = firestore_backend
+    monkeypatch.setattr(storage, "MAX_GROUP_BYTES", 4096)  # varios grupos de fragmentos por guardado
+    db.on_commit = _reader_view_is_consistent
+    backend.save_card_states('ana', {'c1': [2.5, 1, 0, 0, 1, 'viejo']})
+    backend.save_deck('ana', 'viejo', _deck(60, "renal"))
+    backend.delete_deck('ana', 'viejo')
+    backend.save_deck('ana', 'viejo', _deck(30, "renal"))
+    backend.save_deck('ana', 'cardio', _deck(80))
+    backend.save_deck('ana', 'cardio', _deck(40))
+    gate.set()
+    assert backend.queue.flush(5)
+    assert len(db.commits) > 6
+    assert [k for k, _ in db.commits[0]] == ['set']  # la escritura SRS encolada antes sale antes
+    backend._recent.clear()
+    assert len(backend.get_deck('ana', 'cardio')['preguntas']) == 40
+    assert list(backend.get_deck('ana', 'viejo')['preguntas']) == _deck(30, "renal")['preguntas']
+    live = {p[5] for p in db.docs if len(p) == 6 and p[3] == 'cardio'}
+    assert live == set(shards.shard_ids(db.docs[('usuarios', 'ana', 'mazos', 'cardio')]))
+
+
+@pytest.fixture(params=["firestore", "sqlite"])
+def backend(request):
+    """Backend con la cola (si la hay) ya enviando; sync() espera a que Firestore lo tenga todo."""
+    if request.param == "sqlite":
+        b = request.getfixturevalue("sqlite_backend")
+        b.sync = lambda: None
+        return b
+    _, b, gate = request.getfixturevalue("firestore_backend")
+    gate.set()
+    b.sync = lambda: b.queue.flush(5)
+    return b
+
+
+def test_users_and_exams(backend):
+    assert backend.create_user("ana", {"name": "Ana", "email": "a@x", "password": "hash"})
+    backend.sync()
+    assert not backend.create_user("ana", {"name": "Otra", "email": "b@x", "password": "hash2"})
+    assert backend.get_user_credentials("ana") == {"name": "Ana", "email": "a@x", "password": "hash"}
+    assert backend.get_user_credentials("nadie") is None
+    assert backend.apply_exam("ana", "Cardio", "Residente", 10, "ex1")
+    backend.sync()
+    assert not backend.apply_exam("ana", "Cardio", "Residente", 10, "ex1")  # otra pestaña: no suma dos veces
+    assert backend.apply_exam("ana", "Cardio", "Residente", 10, "ex2")
+    assert not backend.apply_exam("ana", "Cardio", "Residente", 10, "ex2")  # aún en la cola
+    backend.sync()
+    assert backend.get_progress("ana") == {"Cardio": {"level": "Residente", "xp": 20}}
+
+
+def test_decks_index_and_lazy_reads(backend):
+    backend.save_deck("ana", "Nefro", _deck(60, "renal", "Nefrología"))
+    backend.save_deck("ana", "Cardio", _deck(3))
+    backend.sync()
+    if hasattr(backend, "_recent"): backend._recent.clear()  # se lee de Firestore, no de lo recién guardado
+    index = backend.get_deck_index("ana")
+    assert {k: v['n'] for k, v in index.items()} == {"Nefro": 60, "Cardio": 3}
+    assert index["Nefro"]["materia"] == "Nefrología" and index["Nefro"]["creado"] == 1700000000.0
+    nefro = backend.get_deck("ana", "Nefro")
+    assert nefro["preguntas"][42] == _deck(60, "renal")["preguntas"][42]
+    assert sorted(name for name, _ in backend.iter_decks("ana")) == ["Cardio", "Nefro"]
+    assert backend.delete_deck("ana", "Nefro")
+    backend.sync()
+    assert backend.get_deck("ana", "Nefro") is None
+    assert set(backend.get_deck_index("ana")) == {"Cardio"}
+
+
+def test_attempt_batches_are_idempotent(backend):
+    events = [[1700000000.0, "Cardio", "c1", "A", 1, 900, "Medicina", "Cardio"]]
+    deltas = [["Medicina", "Cardio", "2023-11-14", 1, 1, 900]]
+    backend.append_attempts("ana", "lote1", events, deltas)
+    backend.sync()
+    backend.append_attempts("ana", "lote1", events, deltas)
+    backend.append_attempts("ana", "lote2", events, deltas)
+    backend.sync()
+    assert backend.get_attempt_rollups("ana") == [["Medicina", "Cardio", "2023-11-14", 2, 2, 1800]]
+
+
+def test_firestore_journal_replays_after_restart(tmp_path):
+    # El proceso "muere" con todo en la cola: otro, con el mismo diario, lo envía al arrancar.
+    db, stuck = RecordingFirestore(), threading.Event()
+    first = storage.FirestoreBackend(db, wq.WriteBehindQueue(db, str(tmp_path), flush_interval=0,
+                                                             sleep=lambda s: stuck.wait()))
+    first.create_user("ana", {"name": "Ana", "email": "a@x", "password": "hash"})
+    first.save_deck("ana", "Cardio", _deck(40))
+    first.save_card_states("ana", {"c1": [2.5, 0.0, 1.0, 0, 0, "Cardio"]})
+    assert first.pending("ana") > 0 and not db.docs
+
+    queue = wq.WriteBehindQueue(db, str(tmp_path), flush_interval=0, sleep=lambda s: None)
+    second = storage.FirestoreBackend(db, queue)
+    assert queue.flush(5)
+    queue.close()
+    assert second.get_user_credentials("ana")["name"] == "Ana"
+    assert list(second.get_deck("ana", "Cardio")["preguntas"]) == _deck(40)["preguntas"]
+    assert second.get_card_states("ana") == {"c1": [2.5, 0.0, 1.0, 0, 0, "Cardio"]}
+    stuck.set()
+    first.queue.close(0)
+
+
+def test_shards_round_trip_and_detect_corruption():
+    deck = _deck(60)
+    header, blobs = shards.build(deck, shard_size=25)
+    assert [n for _, n in header["shards"]] == [25, 25, 10]
+    assert header["orden"][0] == shards.card_id(deck["preguntas"][0])
+    assert sum(len(shards.decode(blob, sid)) for sid, blob in blobs) == 60
+    with pytest.raises(shards.CorruptShard):
+        shards.decode(blobs[0][1][:-1] + b"x", blobs[0][0])
+    with pytest.raises(shards.CorruptShard):
+        shards.decode(None, blobs[0][0])
+
+    stored, reads = dict(blobs), []
+    def load(sid):
+        reads.append(sid)
+        return stored[sid]
+    lazy = shards.LazyDeck(header, load, prefetch=False)
+    assert len(lazy) == 60 and lazy[30] == deck["preguntas"][30]
+    assert reads == [blobs[1][0]]
+    picked = lazy.pick({header["orden"][59]})
+    assert list(picked.values()) == [deck["preguntas"][59]] and len(reads) == 2
+    assert list(lazy) == deck["preguntas"] and len(reads) == 3
+
+
+def test_large_deck_delete_is_chunked_under_batch_limit(firestore_backend, monkeypatch):
+    db, backend, gate = firestore_backend
+    monkeypatch.setattr(wq, "BATCH_LIMIT", 2)
+    backend.save_deck('ana', 'grande', _deck(60))  # 3 fragmentos
+    gate.set()
+    assert backend.queue.flush(5)
+    backend._stored.clear()  # los ids se leen de la cabecera guardada
+    sizes = []
+    db.on_commit = lambda d: sizes.append(len(d.commits[-1]))
+    backend.save_deck('ana', 'grande', _deck(60, "otro"))  # 3 nuevos y 3 viejos que borrar
+    assert backend.queue.flush(5)
+    assert sizes == [2, 1, 2, 2, 1] and len(db.docs) == 5
+    sizes.clear()
+    backend.delete_deck('ana', 'grande')
+    assert backend.queue.flush(5)
+    assert sizes == [2, 1, 2] and backend.queue.failed == 0
+    assert db.commits[-1] == [("delete", "usuarios/ana/mazos/grande"), ("set", "usuarios/ana/meta/mazos_index")]
+    assert not [p for p in db.docs if p[2:4] == ('mazos', 'grande')]
+    assert 'grande' not in db.docs[('usuarios', 'ana', 'meta', 'mazos_index')]['mazos']
+
+
+def test_index_migration_waits_for_queued_deletes(firestore_backend):
+    db, backend, gate = firestore_backend
+    gate.set()
+    backend.save_deck('ana', 'viejo', _deck(3))
+    backend.save_deck('ana', 'otro', _deck(2))
+    assert backend.queue.flush(5)
+    del db.docs[('usuarios', 'ana', 'meta', 'mazos_index')]  # usuario de antes del índice
+    backend._recent.clear()
+    gate.clear()
+    backend.delete_deck('ana', 'viejo')  # aún en la cola
+    threading.Timer(0.2, gate.set).start()
+    assert set(backend.get_deck_index('ana')) == {'otro'}
+    assert backend.queue.flush(5)
+    assert set(db.docs[('usuarios', 'ana', 'meta', 'mazos_index')]['mazos']) == {'otro'}
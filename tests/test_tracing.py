@@ -0,0 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from medflash import tracing
+
+
+def test_worker_counts_land_in_parent_span():
+    trace = tracing.begin_trace("prueba")
+    with tracing.span("generacion") as parent:
+        def work(_):
+            for _ in range(2000): tracing.count("llm_chunks")
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for f in [pool.submit(tracing.wrap_context(work), i) for i in range(8)]: f.result()
+    tracing.end_trace(trace)
+    assert parent.counters == {"llm_chunks": 16000}
+    assert trace.totals()["llm_chunks"] == 16000
+    assert [r[4] for r in trace.rows() if r[0] == "generacion"] == [{"llm_chunks": 16000}]
@@ -0,0 +1,98 @@
+import threading
+
+from conftest import RecordingFirestore
+from medflash import write_queue as wq
+
+
+def _queue(db, tmp_path, gate):
+    # El hilo no envía nada hasta abrir la compuerta: todo queda encolado antes del primer batch.
+    return wq.WriteBehindQueue(db, str(tmp_path), flush_interval=0, sleep=lambda s: gate.wait())
+
+
+def test_groups_are_barriers_in_enqueue_order(tmp_path):
+    db, gate = RecordingFirestore(), threading.Event()
+    q = _queue(db, tmp_path, gate)
+    q.set(["users", "ana"], {"xp": 1}, merge=True)
+    q.submit([("set", ["decks", "x"], {"v": 1}, False), ("set", ["decks", "y"], {"v": 1}, False)], group="mazo:1")
+    q.set(["users", "ana"], {"nivel": 2}, merge=True)
+    q.set(["srs", "ana"], {"c": 1}, merge=True)
+    gate.set()
+    assert q.flush(5)
+    q.close()
+    assert db.commits == [
+        [("set", "users/ana")],
+        [("set", "decks/x"), ("set", "decks/y")],
+        [("set", "users/ana"), ("set", "srs/ana")],
+    ]
+    assert db.docs[("users", "ana")] == {"xp": 1, "nivel": 2}
+
+
+def test_resave_after_delete_group_is_not_reordered(tmp_path):
+    db, gate = RecordingFirestore(), threading.Event()
+    db.seed(["decks", "x"], {"v": 0})
+    q = _queue(db, tmp_path, gate)
+    q.submit([("delete", ["decks", "x"])], group="borrar:x")
+    q.set(["decks", "x"], {"v": 2})
+    gate.set()
+    assert q.flush(5)
+    q.close()
+    assert db.commits == [[("delete", "decks/x")], [("set", "decks/x")]]
+    assert db.docs[("decks", "x")] == {"v": 2}
+
+
+def test_journal_replay_keeps_order(tmp_path):
+    stuck = threading.Event()
+    first = _queue(RecordingFirestore(), tmp_path, stuck)
+    first.set(["users", "ana"], {"xp": 1}, merge=True)
+    first.submit([("set", ["decks", "x"], {"v": 1}, False)], group="mazo:1")
+    first.update(["users", "ana"], {"xp": 3})
+
+    # Otro proceso arranca con el mismo diario antes de que el primero envíe nada.
+    db, gate = RecordingFirestore(), threading.Event()
+    db.seed(["users", "ana"], {})
+    second = _queue(db, tmp_path, gate)
+    assert second.pending() == 3
+    gate.set()
+    assert second.flush(5)
+    second.close()
+    assert db.commits == [[("set", "users/ana")], [("set", "decks/x")], [("update", "users/ana")]]
+    assert db.docs[("users", "ana")] == {"xp": 3}
+    first.close(0)
+
+
+def test_retry_keeps_failed_batch_ahead(tmp_path):
+    db, gate = RecordingFirestore(), threading.Event()
+    fails = []
+    real = db.batch
+
+    def flaky():
+        batch = real()
+        commit = batch.commit
+        def once():
+            if not fails:
+                fails.append(1)
+                raise ConnectionError("red caída")
+            commit()
+        batch.commit = once
+        return batch
+    db.batch = flaky
+    q = _queue(db, tmp_path, gate)
+    q.set(["users", "ana"], {"xp": 1}, merge=True)
+    q.submit([("set", ["decks", "x"], {"v": 1}, False)], group="mazo:1")
+    gate.set()
+    assert q.flush(5)
+    q.close()
+    assert fails and db.commits == [[("set", "users/ana")], [("set", "decks/x")]]
+
+
+def test_dropped_writes_are_reported_through_tracing(tmp_path, monkeypatch):
+    from medflash import tracing
+    errors = []
+    monkeypatch.setattr(tracing.METRICS, "error", errors.append)
+    db, gate = RecordingFirestore(), threading.Event()
+    q = _queue(db, tmp_path, gate)
+    q.update(["users", "nadie"], {"xp": 1})  # NotFound: no se reintenta
+    gate.set()
+    assert q.flush(5)
+    q.close()
+    assert errors == ["write-behind"] and q.failed == 1